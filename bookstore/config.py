@@ -1,6 +1,7 @@
 import os
 import datetime
 import ssl
+import tempfile
 import uuid
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -19,6 +20,62 @@ class Config:
     DB_PASSWORD = os.environ.get('DB_PASSWORD')
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Read replicas (comma separated URLs): the read-only endpoints query
+    # them in turn, a client who wrote reads from the primary for a while
+    DATABASE_REPLICA_URLS = [url for url in (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url]
+    SQLALCHEMY_BINDS = {'replica_%d' % i: url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+    SQLALCHEMY_REPLICA_BINDS = sorted(SQLALCHEMY_BINDS)
+    REPLICA_PIN_SECONDS = 5
+    REPLICA_HEALTH_INTERVAL = 5
+    REPLICA_RETRY_INTERVAL = 30
+    # Connection pool: recycle before MySQL's wait_timeout closes idle
+    # connections, ping them on checkout, fail after pool_timeout seconds
+    # when the pool and its overflow are exhausted
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 20),
+        'pool_recycle': 280,
+        'pool_pre_ping': True,
+        'pool_timeout': 10,
+    }
+
+    # JSON serializer of the responses: 'orjson', 'json' or 'auto'
+    JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER') or 'auto'
+
+    FLASKY_BOOKS_PER_PAGE = 50
+    FLASKY_MAX_BOOKS_PER_PAGE = 200
+    FLASKY_STREAM_CHUNK_SIZE = 500
+    # Batch registration: users per request and per INSERT statement
+    FLASKY_REGISTER_BATCH_MAX = 100
+    FLASKY_REGISTER_CHUNK_SIZE = 100
+    # Book import: rows per INSERT statement and per transaction, invalid
+    # rows reported
+    FLASKY_IMPORT_CHUNK_SIZE = 1000
+    FLASKY_IMPORT_TRANSACTION_ROWS = 10000
+    FLASKY_IMPORT_MAX_ERRORS = 1000
+    # Catalog statistics: lower edges of the price histogram buckets (run
+    # flask rebuild-book-stats after changing them), authors listed
+    FLASKY_STATS_PRICE_BUCKETS = (0, 10000, 20000, 50000, 100000, 200000, 500000)
+    FLASKY_STATS_TOP_AUTHORS = 100
+
+    # Response cache of the catalog endpoints: 'simple' (per process),
+    # 'redis' (shared by all workers) or 'null'
+    RESPONSE_CACHE_TYPE = os.environ.get('RESPONSE_CACHE_TYPE') or 'simple'
+    RESPONSE_CACHE_DEFAULT_TIMEOUT = 60
+    RESPONSE_CACHE_THRESHOLD = 1024
+    RESPONSE_CACHE_REDIS_URL = os.environ.get('REDIS_URL')
+    # Responses read from a replica are not cached for this long after
+    # their books changed: the replica may not have the change yet
+    RESPONSE_CACHE_SETTLE_SECONDS = REPLICA_PIN_SECONDS if DATABASE_REPLICA_URLS else 0
+
+    # Rate limit counters shared by the workers of the host in a mmap'd
+    # file ('mmap://' alone: an anonymous file, only shared with the
+    # workers forked after the app was created, e.g. gunicorn --preload)
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI') or \
+        'mmap://' + os.path.join(tempfile.gettempdir(), 'bookstore-ratelimit')
+    RATELIMIT_STORAGE_OPTIONS = {'buckets': 16384, 'ways': 8}
+    # 'fixed-window' where limits < 4.1 (Python < 3.9) has no sliding window
+    RATELIMIT_STRATEGY = 'sliding-window-counter'
 
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
@@ -26,6 +83,44 @@ class Config:
     BOTO3_SECRET_KEY = AWS_SECRET_ACCESS_KEY
     BOTO3_REGION = 'ap-northeast-2'
     BOTO3_SERVICES = ['s3']
+    # Clients are shared by the threads of a process: size their pool for
+    # the request threads plus the cover upload workers
+    BOTO3_MAX_POOL_CONNECTIONS = int(os.environ.get('BOTO3_MAX_POOL_CONNECTIONS') or 20)
+
+    # Covers are spooled to disk and uploaded to S3 by a pool of threads
+    # (0: inline), large files in parts
+    COVER_UPLOAD_BUCKET = 'kashyyyk-resources'
+    COVER_UPLOAD_WORKERS = int(os.environ.get('COVER_UPLOAD_WORKERS') or 4)
+    COVER_UPLOAD_RETRIES = 3
+    COVER_UPLOAD_RETRY_DELAY = 0.5
+    COVER_SPOOL_DIR = os.environ.get('COVER_SPOOL_DIR')
+    COVER_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    COVER_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+    # Resized JPEG copies of the covers (box in pixels), stored in
+    # Book.cover_<name>; needs Pillow
+    COVER_DERIVATIVES = {
+        'thumbnail': (160, 240),
+        'card': (400, 600),
+        'full': (1200, 1800),
+    }
+    COVER_DERIVATIVE_QUALITY = 85
+
+    # Deleted accounts are purged by a background thread (0: inline), in
+    # transactions of ACCOUNT_PURGE_CHUNK_SIZE books, pausing in between
+    ACCOUNT_PURGE_WORKERS = int(os.environ.get('ACCOUNT_PURGE_WORKERS') or 1)
+    ACCOUNT_PURGE_CHUNK_SIZE = 500
+    ACCOUNT_PURGE_PAUSE = 0.05
+
+    # Password hashes are computed by a pool of worker processes (0: inline).
+    # Changing the method (with its iteration count) rehashes passwords on login.
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 2)
+    PASSWORD_HASH_MAX_PENDING = 32
+    PASSWORD_HASH_TIMEOUT = 5
+
+    # Identity (user + role permissions) of JWT protected requests
+    IDENTITY_CACHE_TTL = 60
+    IDENTITY_CACHE_SIZE = 4096
 
     JWT_ACCESS_TOKEN_EXPIRES = datetime.timedelta(days=1)
     JWT_SECRET_KEY = os.environ.get('SECRET')
@@ -37,12 +132,35 @@ class Config:
 
 class DevelopmentConfig(Config):
     # DEBUG = True
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_recycle': 280,
+        'pool_pre_ping': True,
+        'pool_timeout': 30,
+    }
     SQLALCHEMY_DATABASE_URI = 'mysql+mysqldb://%s:%s@%s/bookstore_dev' % (Config.DB_USERNAME, Config.DB_PASSWORD, Config.DB_HOST)
 
 
 class TestingConfig(Config):
     TESTING = True  
-    SQLALCHEMY_DATABASE_URI = 'mysql+mysqldb://%s:%s@%s/bookstore_test' % (Config.DB_USERNAME, Config.DB_PASSWORD, Config.DB_HOST)
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    COVER_UPLOAD_WORKERS = 0
+    COVER_UPLOAD_RETRY_DELAY = 0
+    ACCOUNT_PURGE_WORKERS = 0
+    ACCOUNT_PURGE_PAUSE = 0
+    # counters of the test run only
+    RATELIMIT_STORAGE_URI = 'mmap://'
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 2,
+        'max_overflow': 2,
+        'pool_pre_ping': True,
+        'pool_timeout': 5,
+    }
+    # TEST_DATABASE_URL=sqlite:// runs the tests without a MySQL server
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
+        'mysql+mysqldb://%s:%s@%s/bookstore_test' % (Config.DB_USERNAME, Config.DB_PASSWORD, Config.DB_HOST)
     
 
 class ProductionConfig(Config):
@@ -1,9 +1,18 @@
 import os
+import json
 import click
 
 from flask_migrate import Migrate
-from web import create_app, db
-from web.models import Role, User, Book
+from web import create_app, db, cache, uploader
+from web.api.book import book_cache_tags, validate_query_filters
+from web.api.user import count_imported_books, requeue_covers
+from web.models import Role, User, Book, BookStats
+from web.utils.book_import import FORMATS, InvalidImport, import_books, read_records
+from web.utils.export import EXPORT_FORMATS, iter_export, stream_rows
+from web.utils.fields import InvalidFields, get_fields
+from web.utils.filter import BadRequest, search
+from web.utils.purge import purge_user
+from web.utils.registration import register_users
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 migrate = Migrate(app, db)
@@ -16,6 +25,7 @@ def make_shell_context():
         Role=Role,
         User=User,
         Book=Book,
+        BookStats=BookStats,
     )
 
 
@@ -29,3 +39,121 @@ def test(test_names):
     else:
         tests = unittest.TestLoader().discover('tests')
     unittest.TextTestRunner(verbosity=2).run(tests)
+
+
+@app.cli.command('register-users')
+@click.argument('source', type=click.File('r'))
+@click.option('--chunk-size', default=None, type=int, help='Users per INSERT statement.')
+def register_users_command(source, chunk_size):
+    """Register the users of a JSON list (or JSON lines) file, - for stdin."""
+    text = source.read()
+    try:
+        records = json.loads(text)
+    except ValueError:
+        try:
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='source')
+    if not isinstance(records, list):
+        raise click.BadParameter('expected a list of users', param_hint='source')
+    created, errors = register_users(
+        db.session, User, records, Role.default_role_id(),
+        chunk_size or app.config['FLASKY_REGISTER_CHUNK_SIZE'])
+    for error in errors:
+        click.echo(f"record {error['index']} ({error['username']}): {error['message']}", err=True)
+    click.echo(f'{created} users created, {len(errors)} rejected')
+
+
+@app.cli.command('import-books')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--author', required=True, help='Username or id of the author of the books.')
+@click.option('--format', 'format_', type=click.Choice(FORMATS), default=None,
+              help='Input format, from the file extension by default.')
+@click.option('--chunk-size', default=None, type=int, help='Books per INSERT statement.')
+@click.option('--transaction-rows', default=None, type=int, help='Books per transaction.')
+def import_books_command(source, author, format_, chunk_size, transaction_rows):
+    """Import the books of a CSV or JSON lines file, - for stdin."""
+    user = User.query.get(int(author)) if author.isdigit() else User.query.filter_by(username=author).first()
+    if user is None:
+        raise click.BadParameter('no such user', param_hint='--author')
+    if format_ is None:
+        format_ = 'csv' if source.name.endswith('.csv') else 'jsonl'
+
+    def progress(created, rejected):
+        click.echo(f'{created} books created, {rejected} rejected', err=True)
+
+    try:
+        created, rejected, errors = import_books(
+            db.session, Book, read_records(source, format_), user.id,
+            chunk_size or app.config['FLASKY_IMPORT_CHUNK_SIZE'],
+            transaction_rows or app.config['FLASKY_IMPORT_TRANSACTION_ROWS'],
+            app.config['FLASKY_IMPORT_MAX_ERRORS'], progress, count_imported_books(user.id))
+    except InvalidImport as e:
+        raise click.BadParameter(str(e), param_hint='source')
+    finally:
+        cache.invalidate(*book_cache_tags())
+    for error in errors:
+        click.echo(f"record {error['index']} ({error['title']}): {error['message']}", err=True)
+    if rejected > len(errors):
+        click.echo(f'... {rejected - len(errors)} more rejected records', err=True)
+    click.echo(f'{created} books created, {rejected} rejected')
+
+
+@app.cli.command('export-books')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Output file, - for stdout.')
+@click.option('--format', 'format_', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson')
+@click.option('--fields', default=None, help='Comma separated columns, all by default.')
+@click.option('--q', 'filters', default=None, help='Filters, as the q parameter of /books.')
+@click.option('--chunk-size', default=None, type=int, help='Rows fetched from the cursor at a time.')
+def export_books_command(output, format_, fields, filters, chunk_size):
+    """Export the books as JSON lines or CSV, in constant memory."""
+    try:
+        columns = get_fields({'fields': fields}, Book.JSON_FIELDS) or Book.JSON_FIELDS
+    except InvalidFields as e:
+        raise click.BadParameter(str(e), param_hint='--fields')
+    try:
+        filters = validate_query_filters({'q': filters}) if filters else None
+        query = (search(db, Book, filters) if filters else Book.query).filter(Book.visible())
+    except (ValueError, KeyError, TypeError, BadRequest):
+        raise click.BadParameter('filter is invalid', param_hint='--q')
+    chunk_size = chunk_size or app.config['FLASKY_STREAM_CHUNK_SIZE']
+    for chunk in iter_export(stream_rows(query, Book, columns, chunk_size), columns, format_, chunk_size):
+        output.write(chunk)
+    output.flush()
+
+
+@app.cli.command('purge-users')
+@click.option('--chunk-size', default=None, type=int, help='Books deleted per transaction.')
+@click.option('--pause', default=None, type=float, help='Seconds to sleep between transactions.')
+def purge_users_command(chunk_size, pause):
+    """Purge the deleted users and their books, resuming unfinished purges."""
+    chunk_size = chunk_size or app.config['ACCOUNT_PURGE_CHUNK_SIZE']
+    pause = app.config['ACCOUNT_PURGE_PAUSE'] if pause is None else pause
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.deleted_at.isnot(None))]
+    for user_id in user_ids:
+        deleted = purge_user(db.session, User, Book, user_id, chunk_size, pause)
+        if deleted is not None:
+            click.echo(f'user {user_id}: {deleted} books deleted')
+    cache.invalidate(*book_cache_tags())
+    click.echo(f'{len(user_ids)} users purged')
+
+
+@app.cli.command('rebuild-book-stats')
+def rebuild_book_stats_command():
+    """Compute the catalog statistics again from the books."""
+    rows = BookStats.rebuild()
+    db.session.commit()
+    cache.invalidate(*book_cache_tags())
+    click.echo(f'{rows} book stats rows')
+
+
+@app.cli.command('requeue-covers')
+@click.option('--min-age', default=None, type=int,
+              help='Seconds a cover stays in the spool before it is taken as lost.')
+def requeue_covers_command(min_age):
+    """Upload again the book covers lost by a stopped process."""
+    min_age = app.config['COVER_SWEEP_MIN_AGE'] if min_age is None else min_age
+    requeued, failed, removed = requeue_covers(min_age)
+    uploader.wait()
+    uploader.shutdown()
+    click.echo(f'{requeued} covers uploaded again, {failed} lost, {removed} spooled files removed')
@@ -0,0 +1,40 @@
+from sqlalchemy import text
+
+
+def explain(session, query):
+    '''
+    Return the query plan of a Query or select as a list of strings,
+    one per plan step, for SQLite (EXPLAIN QUERY PLAN) or MySQL (EXPLAIN)
+    '''
+    statement = getattr(query, 'statement', query)
+    dialect = session.connection().dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        rows = session.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+        return [row[-1] for row in rows]
+    if dialect.name == 'mysql':
+        rows = session.execute(text('EXPLAIN ' + sql)).mappings().fetchall()
+        return ['%s type=%s key=%s' % (row['table'], row['type'], row['key']) for row in rows]
+    raise NotImplementedError('EXPLAIN is not supported on %s' % dialect.name)
+
+
+def full_scans(plan, table):
+    ''' Return the steps of `plan` reading every row of `table` '''
+    scans = []
+    for step in plan:
+        # SQLite: "SCAN books" (>= 3.36) or "SCAN TABLE books"
+        if step in ('SCAN %s' % table, 'SCAN TABLE %s' % table):
+            scans.append(step)
+        # MySQL: access type ALL
+        elif step.startswith(table + ' ') and ' type=ALL ' in step:
+            scans.append(step)
+    return scans
+
+
+class QueryPlanAssertions:
+    ''' Mixin for unittest.TestCase '''
+
+    def assertNoFullScan(self, session, query, table):
+        plan = explain(session, query)
+        scans = full_scans(plan, table)
+        self.assertFalse(scans, 'full scan of %s in query plan: %s' % (table, plan))
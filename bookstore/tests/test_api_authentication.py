@@ -49,3 +49,43 @@ class ApiAuthenticationTestCase(unittest.TestCase):
         self.assertEqual(response_json['code'], 200)
         self.assertEqual(response_json['data']['username'], 'john')
     
+
+    def test_batch_register(self):
+        r = Role.query.filter_by(name='Administrator').first()
+        db.session.add(User(email='admin@example.com', username='admin', password='cat@big', role=r))
+        db.session.commit()
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': 'admin',
+            'password': 'cat@big'
+        })
+        headers = {'Authorization': f"Bearer {response.get_json()['data']['token']}"}
+
+        users = [
+            {'username': 'han', 'email': 'han@example.com', 'password': 'falcon', 'name': 'Han'},
+            {'username': 'leia', 'email': 'leia@example.com', 'password': 'alderaan'},
+            {'username': 'han', 'email': 'solo@example.com', 'password': 'falcon'},
+            {'username': 'luke', 'email': 'luke@example.com', 'password': 'x'},
+            {'username': 'admin', 'email': 'other@example.com', 'password': 'cat@big'},
+            {'username': 'chewie', 'email': 'chewie@example.com', 'password': 'wookiee'},
+            {'username': 'r2d2' * 8, 'email': 'r2d2@example.com', 'password': 'beep-boop'},
+        ]
+        self.app.config['FLASKY_REGISTER_CHUNK_SIZE'] = 2
+        response = self.client.post('bookstore/api/v1/register/batch', json={'users': users}, headers=headers)
+        response_json = response.get_json()
+        self.assertEqual(response_json['code'], 200)
+        self.assertEqual(response_json['data']['created'], 3)
+        self.assertEqual([error['index'] for error in response_json['data']['errors']], [2, 3, 4, 6])
+
+        # the created users have the default role and can log in
+        user = User.query.filter_by(username='chewie').first()
+        self.assertEqual(user.role.name, 'Viewer')
+        self.assertTrue(user.verify_password('wookiee'))
+
+        # only administrators can register in batch
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': 'chewie',
+            'password': 'wookiee'
+        })
+        headers = {'Authorization': f"Bearer {response.get_json()['data']['token']}"}
+        response = self.client.post('bookstore/api/v1/register/batch', json=users, headers=headers)
+        self.assertEqual(response.get_json()['code'], 401)
@@ -2,8 +2,15 @@ import json
 import unittest
 from wsgiref import headers
 from flask import current_app
-from web import create_app, db
-from web.models import User, Role, Book
+from sqlalchemy import event, inspect
+from web import create_app, db, cache
+from web.models import User, Role, Book, BookStats
+from web.utils.cache import SimpleCacheBackend
+from web.utils.fields import project
+from web.utils.filter import compile_filters
+from web.utils.fulltext import index_book
+from web.utils.response import build_response
+from web.utils.serializer import orjson
 
 
 class ApiBookTestCase(unittest.TestCase):
@@ -108,3 +115,316 @@ class ApiBookTestCase(unittest.TestCase):
         response_json = response.get_json()
         self.assertEqual(response_json['code'], 200)
         self.assertEqual(len(response_json['data']), 1)
+
+    def test_paginate_books(self):
+        # Page size of 1: first page has a cursor to the second one
+        response = self.client.get('bookstore/api/v1/books?limit=1')
+        self.assertEqual(response.status_code, 200)
+        response_json = response.get_json()
+        self.assertEqual(response_json['code'], 200)
+        self.assertEqual(len(response_json['data']), 1)
+        self.assertEqual(response_json['data'][0]['id'], 1)
+        self.assertIsNotNone(response_json['next'])
+
+        # Second (last) page
+        response = self.client.get(
+            f"bookstore/api/v1/books?limit=1&after={response_json['next']}")
+        response_json = response.get_json()
+        self.assertEqual(response_json['code'], 200)
+        self.assertEqual(len(response_json['data']), 1)
+        self.assertEqual(response_json['data'][0]['id'], 2)
+        self.assertIsNone(response_json['next'])
+
+        # Sort by price descending
+        response = self.client.get('bookstore/api/v1/books?limit=1&sort=-price')
+        response_json = response.get_json()
+        self.assertEqual(response_json['data'][0]['price'], 30000)
+        cursor = response_json['next']
+        response = self.client.get(
+            f"bookstore/api/v1/books?limit=1&sort=-price&after={cursor}")
+        response_json = response.get_json()
+        self.assertEqual(response_json['data'][0]['price'], 15000)
+
+        # A cursor can not be reused with another sort key
+        response = self.client.get(
+            f"bookstore/api/v1/books?limit=1&sort=price&after={cursor}")
+        self.assertEqual(response.get_json()['code'], 400)
+
+        # Books without a price (NULL) sort first, and last when descending
+        db.session.execute(Book.__table__.insert(), [
+            {'title': 'Nexus', 'price': None, 'author_id': 1},
+            {'title': 'Unstoppable Us', 'price': None, 'author_id': 1},
+        ])
+        db.session.commit()
+        cache.invalidate('books')
+        for sort, ids in (('price', [3, 4, 1, 2]), ('-price', [2, 1, 4, 3])):
+            pages, cursor = [], ''
+            while cursor is not None:
+                response_json = self.client.get(
+                    f"bookstore/api/v1/books?limit=1&sort={sort}&after={cursor}").get_json()
+                self.assertEqual(response_json['code'], 200)
+                pages.extend(book['id'] for book in response_json['data'])
+                cursor = response_json['next']
+            self.assertEqual(pages, ids)
+
+    def test_stream_books(self):
+        query = {
+            "filters": [
+                {"name": "price", "op": "ge", "val": 10000}
+            ]}
+        response = self.client.get(
+            f"bookstore/api/v1/books?stream=true&q={json.dumps(query)}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        response_json = json.loads(response.get_data(as_text=True))
+        self.assertEqual(response_json['code'], 200)
+        self.assertEqual([book['id'] for book in response_json['data']], [1, 2])
+
+    def test_export_books(self):
+        query = {
+            "filters": [
+                {"name": "price", "op": "ge", "val": 20000}
+            ]}
+        response = self.client.get(
+            f"bookstore/api/v1/books?contentType=ndjson&q={json.dumps(query)}")
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [2])
+        self.assertEqual(list(rows[0]), list(Book.JSON_FIELDS))
+
+        response = self.client.get('bookstore/api/v1/books?contentType=csv&fields=id,price,cover')
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.get_data(as_text=True), 'id,cover,price\n1,,15000\n2,,30000\n')
+
+        response = self.client.get('bookstore/api/v1/books?contentType=csv&search=nothingmatches')
+        self.assertEqual(response.get_data(as_text=True), 'id,title,description,cover,cover_thumbnail,'
+                         'cover_card,cover_full,cover_status,price,author_id,created,updated\n')
+
+    def test_fulltext_search_book(self):
+        if db.engine.dialect.name not in ('mysql', 'sqlite'):
+            self.skipTest('no full-text index on this database')
+        for book in Book.query.all():
+            index_book(db.session, book)
+        db.session.commit()
+
+        response = self.client.get('bookstore/api/v1/books?search=history')
+        self.assertEqual(response.status_code, 200)
+        response_json = response.get_json()
+        self.assertEqual(response_json['code'], 200)
+        self.assertEqual(len(response_json['data']), 1)
+        self.assertEqual(response_json['data'][0]['id'], 1)
+
+        response = self.client.get('bookstore/api/v1/books?search=unicorn')
+        response_json = response.get_json()
+        self.assertEqual(len(response_json['data']), 0)
+
+    def test_search_book_reuses_filter_plan(self):
+        compile_filters.cache_clear()
+        for price in (10000, 20000):
+            query = {
+                "filters": [
+                    {"name": "price", "op": "ge", "val": price},
+                    {"name": "id", "op": "in", "val": [1, 2]},
+                ]}
+            response = self.client.get(f"bookstore/api/v1/books?q={json.dumps(query)}")
+            response_json = response.get_json()
+            self.assertEqual(response_json['code'], 200)
+        # only the filter values changed: the second search hits the cache
+        self.assertEqual(len(response_json['data']), 1)
+        self.assertEqual(compile_filters.cache_info().hits, 1)
+        self.assertEqual(compile_filters.cache_info().misses, 1)
+
+        # unknown field
+        query = {"filters": [{"name": "isbn", "op": "eq", "val": 1}]}
+        response = self.client.get(f"bookstore/api/v1/books?q={json.dumps(query)}")
+        self.assertEqual(response.get_json()['code'], 400)
+
+    def test_book_response_cache(self):
+        response = self.client.get('bookstore/api/v1/books/1')
+        self.assertEqual(response.get_json()['data']['price'], 15000)
+        response = self.client.get('bookstore/api/v1/books')
+        self.assertEqual(response.get_json()['data'][0]['price'], 15000)
+
+        # Change the book behind the cache: the cached response is served
+        Book.query.filter_by(id=1).update({'price': 16000})
+        db.session.commit()
+        response = self.client.get('bookstore/api/v1/books/1')
+        self.assertEqual(response.get_json()['data']['price'], 15000)
+        # Another content type is another entry
+        response = self.client.get('bookstore/api/v1/books/1?contentType=xml')
+        self.assertIn(b'16000', response.get_data())
+
+        # Invalidating the book only refreshes that book
+        cache.invalidate('book:1')
+        response = self.client.get('bookstore/api/v1/books/1')
+        self.assertEqual(response.get_json()['data']['price'], 16000)
+        response = self.client.get('bookstore/api/v1/books')
+        self.assertEqual(response.get_json()['data'][0]['price'], 15000)
+
+        # Error envelopes are not cached
+        response = self.client.get('bookstore/api/v1/books/3')
+        self.assertEqual(response.get_json()['code'], 404)
+        self.assertTrue(response.cache_control.no_store)
+        db.session.add(Book(title='Homo Deus', price=20000, author_id=1))
+        db.session.commit()
+        response = self.client.get('bookstore/api/v1/books/3')
+        self.assertEqual(response.get_json()['code'], 200)
+
+    def test_cache_tag_versions_are_bounded(self):
+        backend = SimpleCacheBackend(threshold=2, version_threshold=2)
+        backend.bump_versions(['book:1'])
+        versions = backend.get_versions(['book:1', 'books'])
+        backend.bump_versions(['book:2', 'book:3'])
+        self.assertEqual(len(backend._versions), 2)
+        # the evicted version is not read again, nor any version before it
+        self.assertNotIn(backend.get_versions(['book:1'])[0], (0, versions[0]))
+        self.assertNotEqual(backend.get_versions(['books']), versions[1:])
+
+    def test_conditional_get_book(self):
+        response = self.client.get('bookstore/api/v1/books/1')
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+        response = self.client.get('bookstore/api/v1/books/1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+        # Listing: a new book changes the collection ETag
+        response = self.client.get('bookstore/api/v1/books')
+        etag = response.headers['ETag']
+        cache.invalidate('books')
+        response = self.client.get('bookstore/api/v1/books', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        db.session.add(Book(title='Homo Deus', price=20000, author_id=1))
+        db.session.commit()
+        cache.invalidate('books')
+        response = self.client.get('bookstore/api/v1/books', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.get_json()['data']), 3)
+
+    def test_sparse_fieldset(self):
+        response = self.client.get('bookstore/api/v1/books/1?fields=title,price')
+        response_json = response.get_json()
+        self.assertEqual(response_json['code'], 200)
+        self.assertEqual(response_json['data'], {
+            'title': 'Sapiens A Brief History of Humankind',
+            'price': 15000,
+        })
+
+        # The sort key is loaded for the cursor, but not returned
+        response = self.client.get('bookstore/api/v1/books?fields=title&sort=price&limit=1')
+        response_json = response.get_json()
+        self.assertEqual(list(response_json['data'][0].keys()), ['title'])
+        self.assertIsNotNone(response_json['next'])
+
+        # The description column is not even loaded
+        book = project(Book.query, Book, ('id', 'title')).filter_by(id=1).first()
+        self.assertIn('description', inspect(book).unloaded)
+
+        response = self.client.get('bookstore/api/v1/books?fields=title,isbn')
+        self.assertEqual(response.get_json()['code'], 400)
+
+    def test_json_serializers_agree(self):
+        bodies = []
+        for serializer in ('json', 'orjson'):
+            if serializer == 'orjson' and orjson is None:
+                continue
+            self.app.config['JSON_SERIALIZER'] = serializer
+            cache.invalidate('books')
+            response = self.client.get('bookstore/api/v1/books')
+            self.assertEqual(response.mimetype, 'application/json')
+            bodies.append(response.get_data())
+        self.assertEqual(json.loads(bodies[0])['data'][0]['created'],
+                         str(Book.query.get(1).created))
+        self.assertEqual(len(set(bodies)), 1)
+
+    def test_xml_response(self):
+        # Same document as dicttoxml used to write
+        response = self.client.get('bookstore/api/v1/books/1?contentType=xml&fields=id,title,price')
+        self.assertEqual(response.mimetype, 'application/xml')
+        self.assertEqual(
+            response.get_data(as_text=True),
+            '<?xml version="1.0" encoding="UTF-8" ?><root>'
+            '<ok type="bool">true</ok><code type="int">200</code><data type="dict">'
+            '<id type="int">1</id><title type="str">Sapiens A Brief History of Humankind</title>'
+            '<price type="int">15000</price></data></root>'
+        )
+
+        response = self.client.get('bookstore/api/v1/books?contentType=xml&fields=id&limit=1')
+        self.assertIn(
+            '<data type="list"><item type="dict"><id type="int">1</id></item></data><next type="str">',
+            response.get_data(as_text=True)
+        )
+
+        response = self.client.get('bookstore/api/v1/books/1?contentType=xml&fields=created')
+        self.assertIn('<created type="str">%s</created>' % Book.query.get(1).created.isoformat(),
+                      response.get_data(as_text=True))
+
+        # keys which are not XML names are fixed as dicttoxml did
+        response = build_response({'data': {'0': 1, 'a b': None, '1x': 'c'}}, 'xml')
+        self.assertEqual(
+            response.get_data(as_text=True),
+            '<?xml version="1.0" encoding="UTF-8" ?><root><data type="dict">'
+            '<n0 type="int">1</n0><a_b type="null"></a_b><key name="1x" type="str">c</key>'
+            '</data></root>'
+        )
+
+    def test_book_stats(self):
+        # the books of setUp were added without the API
+        self.assertEqual(BookStats.rebuild(), 2)
+        db.session.commit()
+        response = self.client.get('bookstore/api/v1/books/stats')
+        data = response.get_json()['data']
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['price'], {'min': 15000, 'max': 30000, 'avg': 22500.0})
+        self.assertEqual([bucket['count'] for bucket in data['histogram']], [0, 1, 1, 0, 0, 0, 0])
+        self.assertEqual(data['histogram'][1], {'min': 10000, 'max': 20000, 'count': 1})
+        self.assertEqual(data['authors'], [
+            {'author_id': 1, 'count': 2, 'price_min': 15000, 'price_max': 30000, 'price_avg': 22500.0}])
+
+        # kept up to date by publish, update and delete, without reading books
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': 'JohnPublisher',
+            'password': 'cat@big'
+        })
+        headers = {'Authorization': f"Bearer {response.get_json()['data']['token']}"}
+        self.client.post('bookstore/api/v1/users/1/books', headers=headers, data={'title': 'Homo Deus', 'price': 12000})
+        self.client.put('bookstore/api/v1/users/1/books/2', headers=headers, data={'price': 500})
+        self.client.delete('bookstore/api/v1/users/1/books/1', headers=headers)
+        queries = []
+
+        def record(conn, cursor, statement, *args):
+            queries.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            data = self.client.get('bookstore/api/v1/books/stats').get_json()['data']
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertFalse([q for q in queries if 'FROM books' in q])
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['price'], {'min': 500, 'max': 12000, 'avg': 6250.0})
+        self.assertEqual([bucket['count'] for bucket in data['histogram']], [1, 1, 0, 0, 0, 0, 0])
+
+        # the same as computed from the books
+        BookStats.rebuild()
+        db.session.commit()
+        self.assertEqual(BookStats.summarize(), data)
+        data = self.client.get('bookstore/api/v1/books/stats?author_id=2').get_json()['data']
+        self.assertEqual((data['count'], data['authors']), (0, []))
+
+        # a book without a price (NULL) is counted, out of the prices
+        db.session.execute(Book.__table__.insert(), [{'title': 'Nexus', 'price': None, 'author_id': 1}])
+        BookStats.add(1, [None])
+        db.session.commit()
+        data = BookStats.summarize()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['price'], {'min': 500, 'max': 12000, 'avg': 6250.0})
+        self.assertEqual([bucket['count'] for bucket in data['histogram']], [1, 1, 0, 0, 0, 0, 0])
+        self.assertEqual(data['authors'][0]['price_avg'], 6250.0)
+        BookStats.rebuild()
+        db.session.commit()
+        self.assertEqual(BookStats.summarize(), data)
+        self.client.delete('bookstore/api/v1/users/1/books/4', headers=headers)
+        self.assertEqual(BookStats.summarize()['count'], 2)
+        self.assertEqual(BookStats.summarize()['price'], {'min': 500, 'max': 12000, 'avg': 6250.0})
@@ -1,8 +1,24 @@
+import io
+import os
+import shutil
+import tempfile
+import time
 import unittest
+from unittest import mock
 from wsgiref import headers
+from datetime import datetime, timedelta
 from flask import current_app
-from web import create_app, db
-from web.models import User, Role, Permission
+from sqlalchemy import event
+from web import create_app, db, identity_cache, purger, uploader
+from web.models import User, Role, Permission, Book, BookStats
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:  # optional, the cover upload tests are skipped
+    mock_aws = None
+from web.utils.covers import Image
+from werkzeug.datastructures import FileStorage
 
 
 class ApiUserTestCase(unittest.TestCase):
@@ -156,4 +172,347 @@ class ApiUserTestCase(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 200)
         response_json = response.get_json()
-        self.assertEqual(response_json['code'], 403)
\ No newline at end of file
+        self.assertEqual(response_json['code'], 403)
+
+    def test_identity_cache(self):
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': self.u2.username,
+            'password': 'dog@small'
+        })
+        token = response.get_json()['data']['token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        response = self.client.get('bookstore/api/v1/users', headers=headers)
+        self.assertEqual(response.get_json()['data']['name'], 'Darth Vader')
+
+        # Change behind the cache: the cached identity is served
+        User.query.filter_by(id=self.u2.id).update({'name': 'Anakin'})
+        db.session.commit()
+        response = self.client.get('bookstore/api/v1/users', headers=headers)
+        self.assertEqual(response.get_json()['data']['name'], 'Darth Vader')
+
+        # Updates through the API invalidate it
+        response = self.client.put('bookstore/api/v1/users', headers=headers, data={'pseudonym': 'DV'})
+        self.assertEqual(response.get_json()['code'], 200)
+        response = self.client.get('bookstore/api/v1/users', headers=headers)
+        self.assertEqual(response.get_json()['data']['name'], 'Anakin')
+        self.assertEqual(response.get_json()['data']['pseudonym'], 'DV')
+
+        # The permissions come from the token: a viewer made publisher
+        # has to log in again to publish
+        self.u2.role = Role.query.filter_by(name='Publisher').first()
+        db.session.commit()
+        response = self.client.post(
+            f'bookstore/api/v1/users/{self.u2.id}/books', headers=headers, data={'title': 'Empire'})
+        self.assertEqual(response.get_json()['code'], 401)
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': self.u2.username,
+            'password': 'dog@small'
+        })
+        headers = {'Authorization': f"Bearer {response.get_json()['data']['token']}"}
+        response = self.client.post(
+            f'bookstore/api/v1/users/{self.u2.id}/books', headers=headers, data={'title': 'Empire'})
+        self.assertEqual(response.get_json()['code'], 200)
+
+    def test_permission_claims(self):
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': self.u1.username,
+            'password': 'cat@big'
+        })
+        token = response.get_json()['data']['token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        # Publishing reads the permissions from the token, and whether the
+        # user is deleted from the identity cache, not the database
+        identity_cache.role_versions(Role.load_versions)
+        self.client.get('bookstore/api/v1/users', headers=headers)
+        queries = []
+
+        def record(conn, cursor, statement, *args):
+            queries.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.post(
+                f'bookstore/api/v1/users/{self.u1.id}/books', headers=headers, data={'title': 'Empire'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(response.get_json()['code'], 200)
+        self.assertFalse([q for q in queries if 'FROM users' in q or 'FROM roles' in q])
+
+        # Changing the permissions of the role makes its tokens stale
+        Role.query.filter_by(name='Publisher').update({'permissions': Permission.VIEW})
+        db.session.commit()
+        Role.insert_roles()
+        response = self.client.post(
+            f'bookstore/api/v1/users/{self.u1.id}/books', headers=headers, data={'title': 'Empire'})
+        self.assertEqual(response.get_json()['code'], 401)
+        self.assertEqual(response.get_json()['message'], 'token is outdated, please log in again')
+
+    def login(self, user, password):
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': user.username,
+            'password': password
+        })
+        return {'Authorization': f"Bearer {response.get_json()['data']['token']}"}
+
+    def test_cover_upload(self):
+        if mock_aws is None:
+            self.skipTest('moto is not installed')
+        self.app.config.update(
+            BOTO3_ACCESS_KEY='testing', BOTO3_SECRET_KEY='testing', COVER_UPLOAD_WORKERS=2)
+        headers = self.login(self.u1, 'cat@big')
+        with mock_aws():
+            s3 = boto3.client('s3', region_name=self.app.config['BOTO3_REGION'])
+
+            # No bucket yet: every try fails, the cover is marked as failed
+            response = self.client.post(
+                f'bookstore/api/v1/users/{self.u1.id}/books', headers=headers,
+                data={'title': 'Empire', 'cover': (io.BytesIO(b'png image'), 'cover.png')})
+            response_json = response.get_json()
+            self.assertEqual(response_json['code'], 200)
+            self.assertEqual(response_json['data']['cover_status'], 'pending')
+            self.assertIsNone(response_json['data']['cover'])
+            book_id = response_json['data']['id']
+            self.assertTrue(uploader.wait(timeout=10))
+            db.session.expire_all()
+            self.assertEqual(Book.query.get(book_id).cover_status, 'failed')
+
+            # The bucket exists: the upload completes in background
+            s3.create_bucket(
+                Bucket=self.app.config['COVER_UPLOAD_BUCKET'],
+                CreateBucketConfiguration={'LocationConstraint': self.app.config['BOTO3_REGION']})
+            response = self.client.put(
+                f'bookstore/api/v1/users/{self.u1.id}/books/{book_id}', headers=headers,
+                data={'cover': (io.BytesIO(b'png image'), 'cover.png')})
+            self.assertEqual(response.get_json()['data']['cover_status'], 'pending')
+            self.assertTrue(uploader.wait(timeout=10))
+            db.session.expire_all()
+            book = Book.query.get(book_id)
+            self.assertEqual(book.cover_status, 'ready')
+            self.assertIsNone(book.cover_upload_key)
+            key = book.cover.split('.amazonaws.com/', 1)[1]
+            obj = s3.get_object(Bucket=self.app.config['COVER_UPLOAD_BUCKET'], Key=key)
+            self.assertEqual(obj['Body'].read(), b'png image')
+            self.assertEqual(obj['ContentType'], 'image/png')
+
+            response = self.client.get(f'bookstore/api/v1/books/{book_id}')
+            self.assertEqual(response.get_json()['data']['cover'], book.cover)
+
+    def test_cover_derivatives(self):
+        if mock_aws is None or Image is None:
+            self.skipTest('moto or Pillow is not installed')
+        self.app.config.update(BOTO3_ACCESS_KEY='testing', BOTO3_SECRET_KEY='testing')
+        headers = self.login(self.u1, 'cat@big')
+        cover = io.BytesIO()
+        Image.new('RGBA', (1000, 1500), (200, 30, 30, 128)).save(cover, 'PNG')
+        cover.seek(0)
+        with mock_aws():
+            s3 = boto3.client('s3', region_name=self.app.config['BOTO3_REGION'])
+            bucket = self.app.config['COVER_UPLOAD_BUCKET']
+            s3.create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={'LocationConstraint': self.app.config['BOTO3_REGION']})
+            response = self.client.post(
+                f'bookstore/api/v1/users/{self.u1.id}/books', headers=headers,
+                data={'title': 'Empire', 'cover': (cover, 'cover.png')})
+            book_id = response.get_json()['data']['id']
+
+            data = self.client.get(f'bookstore/api/v1/books/{book_id}').get_json()['data']
+            self.assertEqual(data['cover_status'], 'ready')
+            self.assertTrue(data['cover'].endswith('.png'))
+            # no larger than their box, never enlarged
+            for name, size in (('thumbnail', (160, 240)), ('card', (400, 600)), ('full', (1000, 1500))):
+                self.assertTrue(data['cover_' + name].endswith(f'/{name}.jpg'))
+                key = data['cover_' + name].split('.amazonaws.com/', 1)[1]
+                obj = s3.get_object(Bucket=bucket, Key=key)
+                self.assertEqual(obj['ContentType'], 'image/jpeg')
+                self.assertEqual(Image.open(io.BytesIO(obj['Body'].read())).size, size)
+
+    def test_cover_dedup(self):
+        if mock_aws is None:
+            self.skipTest('moto is not installed')
+        self.app.config.update(
+            BOTO3_ACCESS_KEY='testing', BOTO3_SECRET_KEY='testing', COVER_DERIVATIVES={})
+        headers = self.login(self.u1, 'cat@big')
+        with mock_aws():
+            s3 = boto3.client('s3', region_name=self.app.config['BOTO3_REGION'])
+            bucket = self.app.config['COVER_UPLOAD_BUCKET']
+            s3.create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={'LocationConstraint': self.app.config['BOTO3_REGION']})
+
+            def publish():
+                response = self.client.post(
+                    f'bookstore/api/v1/users/{self.u1.id}/books', headers=headers,
+                    data={'title': 'Empire', 'cover': (io.BytesIO(b'png image'), 'cover.png')})
+                return response.get_json()['data']
+
+            first = self.client.get(f"bookstore/api/v1/books/{publish()['id']}").get_json()['data']
+            # Known by the process: ready at once, nothing queued
+            second = publish()
+            self.assertEqual(second['cover_status'], 'ready')
+            self.assertEqual(second['cover'], first['cover'])
+            # Unknown by the process, but already in the bucket
+            self.app.extensions['cover_uploader']['entries'].clear()
+            third = self.client.get(f"bookstore/api/v1/books/{publish()['id']}").get_json()['data']
+            self.assertEqual(third['cover'], first['cover'])
+            self.assertEqual(s3.list_objects_v2(Bucket=bucket)['KeyCount'], 1)
+
+    def test_requeue_lost_covers(self):
+        if mock_aws is None:
+            self.skipTest('moto is not installed')
+        from web.api.user import requeue_covers
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        self.app.config.update(
+            BOTO3_ACCESS_KEY='testing', BOTO3_SECRET_KEY='testing', COVER_DERIVATIVES={},
+            COVER_SPOOL_DIR=spool_dir)
+
+        # A cover spooled, then its process stopped before the upload
+        path, digest = uploader.spool(FileStorage(io.BytesIO(b'png image'), 'cover.png'), 'png')
+        orphan = os.path.join(spool_dir, 'cover-thumbnail-x.jpg')
+        open(orphan, 'wb').close()
+        created = datetime.utcnow() - timedelta(minutes=30)
+        db.session.add(Book(title='Empire', author_id=self.u1.id, cover_status='pending',
+                            cover_upload_key=f'books/cover/{digest}.png', created=created))
+        db.session.add(Book(title='Jedi', author_id=self.u1.id, cover_status='pending',
+                            cover_upload_key=f'books/cover/{"0" * 64}.png', created=created))
+        db.session.commit()
+        # only the files and books older than the min age are taken as lost
+        self.assertEqual(requeue_covers(3600), (0, 0, 0))
+        for file in (path, orphan):
+            os.utime(file, (time.time() - 1800, time.time() - 1800))
+
+        with mock_aws():
+            s3 = boto3.client('s3', region_name=self.app.config['BOTO3_REGION'])
+            s3.create_bucket(
+                Bucket=self.app.config['COVER_UPLOAD_BUCKET'],
+                CreateBucketConfiguration={'LocationConstraint': self.app.config['BOTO3_REGION']})
+            self.assertEqual(requeue_covers(600), (1, 1, 1))
+        db.session.expire_all()
+        self.assertEqual([book.cover_status for book in Book.query.order_by(Book.id)], ['ready', 'failed'])
+        self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_import_books(self):
+        self.app.config.update(FLASKY_IMPORT_CHUNK_SIZE=2, FLASKY_IMPORT_TRANSACTION_ROWS=3)
+        url = f'bookstore/api/v1/users/{self.u1.id}/books/import'
+        headers = self.login(self.u1, 'cat@big')
+
+        # CSV: the cells are strings, empty ones are missing
+        body = 'title,description,price\nEmpire,,100\nRebels,Hope,abc\nJedi,Return,0\n'
+        response = self.client.post(url, headers=headers, data=body, content_type='text/csv')
+        data = response.get_json()['data']
+        self.assertEqual((data['created'], data['rejected']), (2, 1))
+        self.assertEqual(data['errors'][0]['index'], 1)
+        self.assertEqual(data['errors'][0]['title'], 'Rebels')
+
+        # JSON lines, in chunks and transactions; the books are searchable
+        body = '\n'.join(['{"title": "Clone %d", "price": %d}' % (i, i) for i in range(7)] + ['{bad', '[1]'])
+        response = self.client.post(url, headers=headers, data=body)
+        data = response.get_json()['data']
+        self.assertEqual((data['created'], data['rejected']), (7, 2))
+        self.assertEqual([error['index'] for error in data['errors']], [7, 8])
+        self.assertEqual(Book.query.filter_by(author_id=self.u1.id).count(), 9)
+        self.assertEqual(BookStats.summarize()['count'], 9)
+        response = self.client.get('bookstore/api/v1/books?search=clone')
+        self.assertEqual(len(response.get_json()['data']), 7)
+
+        response = self.client.post(url + '?format=csv', headers=headers, data='title,isbn\nEmpire,1\n')
+        self.assertEqual(response.get_json()['code'], 400)
+
+        # A database error keeps the committed transactions, and tells them
+        inserts = []
+
+        def fail(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO books ('):
+                inserts.append(statement)
+                if len(inserts) == 3:
+                    raise RuntimeError('database is gone')
+        event.listen(db.engine, 'before_cursor_execute', fail)
+        try:
+            response = self.client.post(url, headers=headers, data=body)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', fail)
+        self.assertEqual(response.get_json()['code'], 500)
+        self.assertEqual(response.get_json()['data'], {'created': 4, 'rejected': 0})
+        self.assertEqual(Book.query.filter_by(author_id=self.u1.id).count(), 13)
+
+        # Viewers cannot publish
+        headers = self.login(self.u2, 'dog@small')
+        response = self.client.post(
+            f'bookstore/api/v1/users/{self.u2.id}/books/import', headers=headers, data='{"title": "Empire"}')
+        self.assertEqual(response.get_json()['code'], 401)
+
+    def test_delete_user_purges_books(self):
+        from web.api.user import purge_account
+        u1_id = self.u1.id
+        for i in range(5):
+            db.session.add(Book(title=f'Empire {i}', price=i, author_id=self.u1.id))
+        db.session.add(Book(title='Vader', author_id=self.u2.id))
+        db.session.commit()
+        headers = self.login(self.u1, 'cat@big')
+
+        # A deleted user's books are hidden until the purge
+        self.u1.deleted_at = datetime.utcnow()
+        db.session.commit()
+        response = self.client.get('bookstore/api/v1/books')
+        self.assertEqual([book['title'] for book in response.get_json()['data']], ['Vader'])
+        response = self.client.get('bookstore/api/v1/books/1')
+        self.assertEqual(response.get_json()['code'], 404)
+        response = self.client.get('bookstore/api/v1/users', headers=headers)
+        self.assertEqual(response.get_json()['code'], 404)
+        response = self.client.post('bookstore/api/v1/auth', data={'username': 'loh', 'password': 'cat@big'})
+        self.assertEqual(response.get_json()['code'], 404)
+
+        # The purge deletes the books by chunks, then the user; it resumes
+        self.app.config['ACCOUNT_PURGE_CHUNK_SIZE'] = 2
+        deletes = []
+
+        def record(conn, cursor, statement, *args):
+            if statement.startswith('DELETE FROM books WHERE'):
+                deletes.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(purge_account(u1_id), 5)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(Book.query.count(), 1)
+        self.assertIsNone(User.query.get(u1_id))
+        self.assertIsNone(purge_account(u1_id))
+
+        # Deleting an account purges it at once when there are no workers
+        headers = self.login(self.u2, 'dog@small')
+        response = self.client.delete('bookstore/api/v1/users', headers=headers)
+        self.assertEqual(response.get_json()['code'], 200)
+        self.assertEqual(Book.query.count(), 0)
+        self.assertEqual(User.query.count(), 0)
+
+    def test_deleted_user_token_cannot_publish(self):
+        u1_id = self.u1.id
+        headers = self.login(self.u1, 'cat@big')
+        response = self.client.delete('bookstore/api/v1/users', headers=headers)
+        self.assertEqual(response.get_json()['code'], 200)
+
+        # The token is still signed, but its user is gone
+        response = self.client.post(
+            f'bookstore/api/v1/users/{u1_id}/books', headers=headers, data={'title': 'Empire'})
+        self.assertEqual(response.get_json()['code'], 401)
+        response = self.client.post(
+            f'bookstore/api/v1/users/{u1_id}/books/import', headers=headers, data='{"title": "Empire"}')
+        self.assertEqual(response.get_json()['code'], 401)
+        self.assertEqual(Book.query.count(), 0)
+        self.assertEqual(BookStats.summarize()['count'], 0)
+
+    def test_delete_user_hides_cached_books(self):
+        db.session.add(Book(title='Empire', price=100, author_id=self.u1.id))
+        db.session.commit()
+        self.assertEqual(self.client.get('bookstore/api/v1/books/1').get_json()['code'], 200)
+
+        # Hidden at once from the response cache, before the purge runs
+        headers = self.login(self.u1, 'cat@big')
+        with mock.patch.object(purger, 'submit') as submit:
+            response = self.client.delete('bookstore/api/v1/users', headers=headers)
+        self.assertEqual(response.get_json()['code'], 200)
+        self.assertTrue(submit.called)
+        self.assertEqual(self.client.get('bookstore/api/v1/books/1').get_json()['code'], 404)
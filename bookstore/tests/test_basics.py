@@ -1,6 +1,11 @@
+import os
+import threading
 import unittest
 from flask import current_app
-from web import create_app, db
+from sqlalchemy import create_engine
+from config import TestingConfig
+from web import create_app, db, boto
+from web.utils.dbpool import InstrumentedQueuePool, configure_engine_options, pool_status
 
 
 class BasicsTestCase(unittest.TestCase):
@@ -21,3 +26,49 @@ class BasicsTestCase(unittest.TestCase):
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
 
+
+    def test_boto3_clients_are_pooled(self):
+        client = boto.clients['s3']
+        self.assertEqual(client.meta.config.max_pool_connections,
+                         current_app.config['BOTO3_MAX_POOL_CONNECTIONS'])
+
+        # another app context of the process, in another thread
+        clients = []
+
+        def use_client():
+            with self.app.app_context():
+                clients.append(boto.clients['s3'])
+        thread = threading.Thread(target=use_client)
+        thread.start()
+        thread.join()
+        self.assertIs(clients[0], client)
+
+    def test_db_pool_metrics(self):
+        app = create_app('testing')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///pool-test.db'
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(TestingConfig.SQLALCHEMY_ENGINE_OPTIONS)
+        configure_engine_options(app)
+        engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'], **app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        try:
+            pool = engine.pool
+            self.assertIsInstance(pool, InstrumentedQueuePool)
+            first = engine.connect()
+            second = engine.connect()
+            status = pool_status(pool)
+            self.assertEqual(status['checked_out'], 2)
+            self.assertEqual(status['checkouts'], 2)
+            self.assertEqual(status['connects'], 2)
+            # pool of 2 exhausted, then its 2 overflow connections
+            third, fourth = engine.connect(), engine.connect()
+            self.assertEqual(pool_status(pool)['overflow'], 2)
+            for connection in (first, second, third, fourth):
+                connection.close()
+            status = pool_status(pool)
+            self.assertEqual(status['checked_out'], 0)
+            self.assertEqual(status['checkins'], 4)
+            self.assertGreater(status['wait_max_ms'], 0)
+            engine.dispose()
+            self.assertEqual(pool_status(engine.pool)['checkouts'], 4)
+        finally:
+            engine.dispose()
+            os.remove('pool-test.db')
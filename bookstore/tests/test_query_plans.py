@@ -0,0 +1,41 @@
+import unittest
+from datetime import datetime
+from web import create_app, db
+from web.models import Role, Book
+from web.utils.filter import search
+from web.utils.pagination import page_query
+from tests.query_plan import QueryPlanAssertions
+
+
+class QueryPlanTestCase(QueryPlanAssertions, unittest.TestCase):
+    ''' The hot queries on books must not fall back to a full table scan '''
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        if db.engine.dialect.name not in ('mysql', 'sqlite'):
+            self.skipTest('EXPLAIN is not supported on this database')
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def assertPageNoFullScan(self, query, sort='id'):
+        self.assertNoFullScan(db.session, page_query(query, Book, 20, None, sort), 'books')
+
+    def test_author_books(self):
+        self.assertPageNoFullScan(Book.query.filter_by(author_id=1))
+        self.assertNoFullScan(db.session, Book.query.filter_by(id=1, author_id=1), 'books')
+
+    def test_price_range(self):
+        query = search(db, Book, [{'name': 'price', 'op': 'ge', 'val': 10000}])
+        self.assertPageNoFullScan(query, 'price')
+        self.assertPageNoFullScan(query, '-price')
+
+    def test_created_range(self):
+        query = search(db, Book, [{'name': 'created', 'op': 'ge', 'val': datetime(2022, 1, 1)}])
+        self.assertPageNoFullScan(query, 'created')
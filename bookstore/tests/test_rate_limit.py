@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from limits import parse
+from limits.strategies import SlidingWindowCounterRateLimiter
+from web import create_app, limiter
+from web.utils import ratelimit
+from web.utils.ratelimit import SharedMemoryStorage
+
+
+class RateLimitStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+        self.storage = SharedMemoryStorage(f'mmap://{self.path}?buckets=2&ways=2')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_app_uses_shared_memory(self):
+        app = create_app('testing')
+        self.assertIsInstance(limiter._storage, SharedMemoryStorage)
+
+    def test_strategy_without_sliding_window(self):
+        # limits < 4.1 (Python < 3.9): fixed windows
+        with mock.patch.object(ratelimit, 'SlidingWindowCounterSupport', object):
+            app = create_app('testing')
+        self.assertEqual(app.config['RATELIMIT_STRATEGY'], 'fixed-window')
+        self.assertEqual(create_app('testing').config['RATELIMIT_STRATEGY'], 'sliding-window-counter')
+
+    def test_sliding_window(self):
+        rate_limiter = SlidingWindowCounterRateLimiter(self.storage)
+        item = parse('3 per minute')
+        self.assertEqual([rate_limiter.hit(item, '10.0.0.1') for _ in range(4)], [True, True, True, False])
+        self.assertTrue(rate_limiter.hit(item, '10.0.0.2'))
+        rate_limiter.clear(item, '10.0.0.1')
+        self.assertTrue(rate_limiter.hit(item, '10.0.0.1'))
+
+    def test_shared_between_processes(self):
+        pid = os.fork()
+        if pid == 0:
+            # the child opens the same file, as another worker would
+            storage = SharedMemoryStorage(f'mmap://{self.path}?buckets=2&ways=2')
+            for _ in range(5):
+                storage.incr('client', 60)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(self.storage.incr('client', 60), 6)
+
+    def test_bounded_memory(self):
+        # 4 slots: the least recently used keys are evicted
+        for i in range(10):
+            self.storage.incr(f'client-{i}', 60)
+        self.assertEqual(self.storage.get('client-9'), 1)
+        self.assertEqual(os.path.getsize(self.path), self.storage.size)
+        self.assertLessEqual(self.storage.reset(), 4)
+        self.assertEqual(self.storage.get('client-9'), 0)
@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import text
+from web import create_app, db, replicas
+from web.models import User, Role, Book
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        # two SQLite files stand in for the primary and its replicas
+        self.dir = tempfile.mkdtemp()
+        self.primary = os.path.join(self.dir, 'primary.db')
+        self.app = create_app('testing')
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + self.primary,
+            SQLALCHEMY_BINDS={},
+            SQLALCHEMY_REPLICA_BINDS=[],
+            RESPONSE_CACHE_SETTLE_SECONDS=5,
+        )
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+        r = Role.query.filter_by(name='Publisher').first()
+        self.u1 = User(email='john@example.com', username='JohnPublisher',
+                       password='cat@big', pseudonym='JP', role=r)
+        db.session.add(self.u1)
+        db.session.commit()
+        db.session.add(Book(title='Sapiens', price=15000, author_id=self.u1.id))
+        db.session.commit()
+        self.headers = self.login()
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in [db.engine] + [db.get_engine(bind=key) for key in self.app.config['SQLALCHEMY_BINDS']]:
+            engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.dir)
+
+    def login(self):
+        response = self.client.post('bookstore/api/v1/auth', data={
+            'username': 'JohnPublisher',
+            'password': 'cat@big'
+        })
+        return {'Authorization': f"Bearer {response.get_json()['data']['token']}"}
+
+    def add_replica(self, key, title):
+        ''' Copy the primary to a replica whose book has another title '''
+        path = os.path.join(self.dir, key + '.db')
+        db.session.remove()
+        shutil.copy(self.primary, path)
+        self.app.config['SQLALCHEMY_BINDS'][key] = 'sqlite:///' + path
+        self.app.config['SQLALCHEMY_REPLICA_BINDS'].append(key)
+        with db.get_engine(bind=key).begin() as connection:
+            connection.execute(text('UPDATE books SET title = :title'), {'title': title})
+
+    def clear_pins(self):
+        replicas._pins(self.app.extensions['replicas']).clear()
+
+    def get_book(self, headers=None, **environ):
+        response = self.client.get(
+            'bookstore/api/v1/books/1?fields=id,title', headers=headers, environ_base=environ)
+        return response.get_json()['data']['title']
+
+    def test_reads_go_to_replica(self):
+        self.add_replica('replica', 'Sapiens (replica)')
+        self.clear_pins()
+        self.assertEqual(self.get_book(), 'Sapiens (replica)')
+
+        response = self.client.get(
+            f'bookstore/api/v1/users/{self.u1.id}/books', headers=self.headers)
+        self.assertEqual(response.get_json()['data'][0]['title'], 'Sapiens (replica)')
+
+        # without replicas every read goes to the primary
+        self.app.config['SQLALCHEMY_REPLICA_BINDS'] = []
+        response = self.client.get(
+            f'bookstore/api/v1/users/{self.u1.id}/books', headers=self.headers)
+        self.assertEqual(response.get_json()['data'][0]['title'], 'Sapiens')
+
+    def test_round_robin(self):
+        self.add_replica('replica_0', 'Sapiens 0')
+        self.add_replica('replica_1', 'Sapiens 1')
+        self.clear_pins()
+        titles = []
+        for _ in range(4):
+            response = self.client.get(
+                f'bookstore/api/v1/users/{self.u1.id}/books', headers=self.headers)
+            titles.append(response.get_json()['data'][0]['title'])
+        self.assertEqual(sorted(titles), ['Sapiens 0', 'Sapiens 0', 'Sapiens 1', 'Sapiens 1'])
+        self.assertNotEqual(titles[0], titles[1])
+
+    def test_read_your_writes(self):
+        self.add_replica('replica', 'Sapiens (replica)')
+        self.clear_pins()
+        response = self.client.put(
+            f'bookstore/api/v1/users/{self.u1.id}/books/1', headers=self.headers,
+            data={'title': 'Sapiens, revised'})
+        self.assertEqual(response.get_json()['code'], 200)
+
+        # other clients read from the replica, the writer from the primary,
+        # whatever the response cache holds for the same url
+        self.assertEqual(self.get_book(REMOTE_ADDR='10.0.0.2'), 'Sapiens (replica)')
+        self.assertEqual(self.get_book(self.headers), 'Sapiens, revised')
+        # nor does an anonymous client behind the same address (proxy)
+        self.assertEqual(self.get_book(), 'Sapiens (replica)')
+        self.assertEqual(self.get_book({'Authorization': 'Bearer bad'}), 'Sapiens (replica)')
+        # the writer keeps its pin from another address
+        self.assertEqual(self.get_book(self.headers, REMOTE_ADDR='10.0.0.3'), 'Sapiens, revised')
+
+        # once the pin expired, the writer reads from the replica again
+        self.clear_pins()
+        self.assertEqual(self.get_book(self.headers), 'Sapiens (replica)')
+
+    def test_bulk_writes_pin(self):
+        self.add_replica('replica', 'Sapiens (replica)')
+        self.clear_pins()
+        # the import inserts with Core statements, without an ORM flush
+        response = self.client.post(
+            f'bookstore/api/v1/users/{self.u1.id}/books/import', headers=self.headers,
+            data='{"title": "Homo Deus"}')
+        self.assertEqual(response.get_json()['data']['created'], 1)
+
+        response = self.client.get(
+            f'bookstore/api/v1/users/{self.u1.id}/books', headers=self.headers)
+        self.assertEqual([book['title'] for book in response.get_json()['data']], ['Sapiens', 'Homo Deus'])
+
+    def test_unhealthy_replica(self):
+        self.add_replica('replica', 'Sapiens (replica)')
+        self.app.config['SQLALCHEMY_BINDS']['down'] = 'sqlite:///' + os.path.join(self.dir, 'missing', 'down.db')
+        self.app.config['SQLALCHEMY_REPLICA_BINDS'] = ['down', 'replica']
+        self.clear_pins()
+        for _ in range(3):
+            response = self.client.get(
+                f'bookstore/api/v1/users/{self.u1.id}/books', headers=self.headers)
+            self.assertEqual(response.get_json()['data'][0]['title'], 'Sapiens (replica)')
+        self.assertFalse(replicas.is_healthy('down'))
+        self.assertTrue(replicas.is_healthy('replica'))
+
+        # without a healthy replica the primary serves the reads
+        self.app.config['SQLALCHEMY_REPLICA_BINDS'] = ['down']
+        response = self.client.get(
+            f'bookstore/api/v1/users/{self.u1.id}/books', headers=self.headers)
+        self.assertEqual(response.get_json()['data'][0]['title'], 'Sapiens')
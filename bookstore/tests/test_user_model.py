@@ -1,6 +1,7 @@
 import unittest
 import time
 from web import create_app, db
+from web.utils.hashing import HashingPoolFull, PasswordHasher
 from web.models import User, Role, Permission
 
 
@@ -36,6 +37,37 @@ class UserModelTestCase(unittest.TestCase):
         u2 = User(username='cat2', email='cat2@example.com', password='cat')
         self.assertTrue(u1.password_hash != u2.password_hash)
     
+    def test_password_rehash(self):
+        u = User(password='cat')
+        self.assertFalse(u.password_needs_rehash())
+        # stronger parameters: the hash is out of date
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        hasher = PasswordHasher(self.app)
+        self.assertTrue(hasher.needs_rehash(u.password_hash))
+        self.assertTrue(hasher.verify(u.password_hash, 'cat'))
+
+    def test_password_hashing_pool(self):
+        self.app.config['PASSWORD_HASH_WORKERS'] = 1
+        hasher = PasswordHasher(self.app)
+        try:
+            password_hash = hasher.generate('cat')
+            self.assertTrue(hasher.verify(password_hash, 'cat'))
+            self.assertFalse(hasher.verify(password_hash, 'dog'))
+            # a batch takes the only slot once per sub-batch, not for its whole run
+            self.app.config['PASSWORD_HASH_MAX_PENDING'] = 1
+            hasher.init_app(self.app)
+            hashes = hasher.generate_many(['cat', 'dog', 'cow'])
+            self.assertEqual([hasher.verify(h, p) for h, p in zip(hashes, ['cat', 'dog', 'cow'])], [True] * 3)
+            self.assertTrue(hasher.verify(password_hash, 'cat'))
+        finally:
+            hasher.shutdown()
+
+        # saturated pool: fail fast
+        self.app.config['PASSWORD_HASH_MAX_PENDING'] = 0
+        hasher = PasswordHasher(self.app)
+        with self.assertRaises(HashingPoolFull):
+            hasher.generate('cat')
+
     # def test_valid_confirmation_token(self):
     #     u = User(username='cat', email='cat@example.com', password='cat')
     #     db.session.add(u)
@@ -1,14 +1,10 @@
 
 import sys
 import os
-import json
-import datetime
-import decimal
 import time
 import logging
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from flask_limiter import Limiter
@@ -16,24 +12,26 @@ from flask_limiter.util import get_remote_address
 
 from config import config
 from .utils.flask_boto3 import Boto3
+from .utils.cache import ResponseCache
+from .utils.dbpool import configure_engine_options
+from .utils.hashing import PasswordHasher
+from .utils.identity import IdentityCache
+from .utils.purge import AccountPurger
+from .utils.ratelimit import SharedMemoryStorage, check_storage_uri, check_strategy  # registers the mmap:// storage
+from .utils.replicas import ReplicaRouter, RoutingSQLAlchemy
+from .utils.serializer import JSONEncoder
+from .utils.uploads import CoverUploader
 
 
-class JSONEncoder(json.JSONEncoder):
-    ''' extend json-encoder class'''
-    def default(self, o):
-        if isinstance(o, set):
-            return list(o)
-        if isinstance(o, (datetime.date, datetime.datetime, datetime.time)):
-            return str(o)
-        if isinstance(o, decimal.Decimal):
-            return str(o)
-
-        return json.JSONEncoder.default(self, o)
-
-
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+replicas = ReplicaRouter(db)
 jwt = JWTManager()
 boto = Boto3()
+cache = ResponseCache()
+hasher = PasswordHasher()
+identity_cache = IdentityCache()
+uploader = CoverUploader()
+purger = AccountPurger()
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["5000 per day", "1000 per hour"]
@@ -45,11 +43,20 @@ def create_app(config_name):
 
     app.logger.setLevel(logging.DEBUG)
     app.config.from_object(config[config_name])
+    configure_engine_options(app)
 
     db.init_app(app)
+    replicas.init_app(app)
     jwt.init_app(app)
     boto.init_app(app)
+    check_strategy(app)
     limiter.init_app(app)
+    check_storage_uri(app)
+    cache.init_app(app)
+    hasher.init_app(app)
+    identity_cache.init_app(app)
+    uploader.init_app(app)
+    purger.init_app(app)
     CORS(app, resources=r'/bookstore/api/*', allow_headers=['Content-Type', 'Authorization'])
 
     app.json_encoder = JSONEncoder
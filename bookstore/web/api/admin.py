@@ -0,0 +1,27 @@
+from flask import request
+from flask_jwt_extended import jwt_required
+from flask_restful import Resource
+
+from . import api as api, api_restful, logger
+from .. import db
+from ..common.decorators import permission_required
+from ..models import Permission
+from ..utils.dbpool import pool_status
+from ..utils.response import build_response, get_content_type
+
+
+class DBPoolView(Resource):
+    ''' connection pool of the database, of the process serving the request '''
+
+    @jwt_required()
+    @permission_required(Permission.ADMIN, 'user does not have permission to read the stats')
+    def get(self):
+        content_type = get_content_type(request.args)
+        return build_response({
+            'ok': True,
+            'code': 200,
+            'data': pool_status(db.engine.pool)
+        }, content_type)
+
+
+api_restful.add_resource(DBPoolView, '/admin/db-pool')
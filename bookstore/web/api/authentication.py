@@ -1,13 +1,15 @@
 
-from flask import request
-from flask_jwt_extended import create_access_token, create_refresh_token
+from flask import request, current_app
+from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required
 from flask_restful import Resource, reqparse
 
 from . import api as api, api_restful, logger
 from .. import db
-from ..models import User
+from ..common.decorators import permission_required
+from ..models import User, Role, Permission
 from ..schema.user import validate_user_authentication, validate_register_user
 from ..utils import Utils
+from ..utils.registration import register_users
 from ..utils.response import build_response, get_content_type
 
 utils = Utils()
@@ -54,6 +56,44 @@ class UserRegistration(Resource):
 api_restful.add_resource(UserRegistration, '/register')
 
 
+class UserBatchRegistration(Resource):
+    ''' register many users at once, for administrators '''
+
+    @jwt_required()
+    @permission_required(Permission.ADMIN, 'user does not have permission to register users')
+    def post(self):
+        content_type = get_content_type(request.args)
+        records = request.get_json(silent=True)
+        if isinstance(records, dict):
+            records = records.get('users')
+        if not isinstance(records, list):
+            return build_response({
+                'ok': False,
+                'code': 400,
+                'message': 'Bad request parameters: expected a list of users'
+            }, content_type)
+        max_records = current_app.config['FLASKY_REGISTER_BATCH_MAX']
+        if len(records) > max_records:
+            return build_response({
+                'ok': False,
+                'code': 400,
+                'message': f'Bad request parameters: at most {max_records} users per batch'
+            }, content_type)
+
+        created, errors = register_users(
+            db.session, User, records, Role.default_role_id(),
+            current_app.config['FLASKY_REGISTER_CHUNK_SIZE'])
+        logger.info(f'batch registration: {created} created, {len(errors)} rejected')
+        return build_response({
+            'ok': True,
+            'code': 200,
+            'data': {'created': created, 'errors': errors}
+        }, content_type)
+
+
+api_restful.add_resource(UserBatchRegistration, '/register/batch')
+
+
 class UserAuth(Resource):
     ''' auth endpoint '''
     parser = reqparse.RequestParser()
@@ -69,7 +109,7 @@ class UserAuth(Resource):
         data = validate_user_authentication(args)
         if data['ok']:
             data = data['data']
-            user = User.query.filter_by(username=data['username']).first()
+            user = User.query.filter_by(username=data['username'], deleted_at=None).first()
             if not user:
                 return build_response({
                     'ok': False,
@@ -81,8 +121,13 @@ class UserAuth(Resource):
 
             # Verify the password
             if user.verify_password(data['password']):
-                # Create and embed the user information into access token
-                access_token = create_access_token(identity=data)
+                # Upgrade the hash made with older parameters
+                if user.password_needs_rehash():
+                    user.password = data['password']
+                    db.session.commit()
+                # Create and embed the user information and the role
+                # permissions into access token
+                access_token = create_access_token(identity=data, additional_claims=user.token_claims())
                 # refresh_token = create_refresh_token(identity=data)
                 res = {
                     'token': access_token,
@@ -1,14 +1,31 @@
 
 import json
 
-from flask import request
+from flask import request, current_app
 from flask_restful import Resource
-from flask_restless import search
 
 from . import api as api, api_restful, logger
-from .. import db
-from ..models import Book
-from ..utils.response import build_response, get_content_type
+from .. import db, cache
+from ..common.decorators import replica_reads
+from ..models import Book, BookStats
+from ..utils.conditional import add_validators, book_validators, collection_validators, not_modified
+from ..utils.export import build_export_response, get_export_format, stream_rows
+from ..utils.fields import InvalidFields, get_fields, project
+from ..utils.filter import BadRequest, search
+from ..utils.fulltext import search_books
+from ..utils.pagination import InvalidPageArgument, get_page_args, paginate, paginate_by_rank
+from ..utils.response import build_response, build_streaming_response, get_content_type, is_stream_requested
+
+SORTABLE_FIELDS = ('id', 'price', 'created')
+
+def book_cache_tags(book_id=None):
+    '''
+    Return the response cache tags of a book (or of the book listings)
+    '''
+    if book_id is None:
+        return ('books',)
+    return ('book:%d' % book_id,)
+
 
 def validate_query_filters(args):
     '''
@@ -23,6 +40,8 @@ def validate_query_filters(args):
             {"name":"title","op":"ilike","val":"%game%"},
         ]
     }
+    Prefer search=game for text search: it uses the full-text index
+    instead of scanning books.title
     '''
     if 'q' in args:
         q = args['q'].replace('\n', '')
@@ -32,27 +51,42 @@ def validate_query_filters(args):
 
 
 class BookView(Resource):
+    @replica_reads
+    @cache.cached(book_cache_tags)
     def get(self, book_id=None):
         args = request.args
         content_type = get_content_type(args)
+        # Sparse fieldset: only these columns are loaded and returned
+        try:
+            fields = get_fields(args, Book.JSON_FIELDS)
+        except InvalidFields as e:
+            return build_response({
+                'ok': False,
+                'code': 400,
+                'message': str(e)
+            }, content_type)
 
         # Get information of a book by book id
         if book_id is not None:
-            book = Book.query.filter_by(id=book_id).first()
+            # Answer conditional requests from the book timestamps only
+            etag, last_modified = book_validators(db.session, Book, book_id, Book.visible())
+            response = not_modified(etag, last_modified)
+            if response is not None:
+                return response
+            book = project(Book.query, Book, fields).filter(Book.id == book_id, Book.visible()).first()
             if book is None:
                 return build_response({
                     'ok': False,
                     'code': 404,
                     'message': 'user not found'
                 }, content_type)
-            return build_response({
+            return add_validators(build_response({
                 'ok': True,
                 'code': 200,
-                'data': book.get_response()
-            }, content_type)
+                'data': book.get_response(fields)
+            }, content_type, Book, fields), etag, last_modified)
         # Get all book by conditions
         else:
-            # TODO: pagination
             try:
                 filters = validate_query_filters(args)
             except:
@@ -61,15 +95,83 @@ class BookView(Resource):
                     'code': 400,
                     'message': 'filter is invalid'
                 }, content_type)
+            try:
+                limit, after, sort = get_page_args(
+                    args,
+                    current_app.config['FLASKY_BOOKS_PER_PAGE'],
+                    current_app.config['FLASKY_MAX_BOOKS_PER_PAGE'],
+                    SORTABLE_FIELDS,
+                )
+            except InvalidPageArgument as e:
+                return build_response({
+                    'ok': False,
+                    'code': 400,
+                    'message': str(e)
+                }, content_type)
             if filters == None:
-                books = Book.query.all()
+                query = Book.query
             else:
-                books = search.search(db, Book, filters).all()
-            return build_response({
+                try:
+                    query = search(db, Book, filters)
+                except BadRequest as e:
+                    return build_response({
+                        'ok': False,
+                        'code': 400,
+                        'message': e.details
+                    }, content_type)
+            # the books of deleted users wait for their purge
+            query = query.filter(Book.visible())
+            # Full-text search on title and description
+            terms = args.get('search', '').strip()
+            rank = None
+            if terms:
+                query, rank = search_books(db.session, query, Book, terms)
+            # Answer conditional requests with one aggregate query
+            etag, last_modified = collection_validators(query, Book)
+            response = not_modified(etag, last_modified)
+            if response is not None:
+                return response
+            export_format = get_export_format(args)
+            if export_format is not None:
+                # Export every matching book as CSV or JSON lines, read as
+                # plain rows from a server-side cursor
+                chunk_size = current_app.config['FLASKY_STREAM_CHUNK_SIZE']
+                columns = fields or Book.JSON_FIELDS
+                return add_validators(build_export_response(
+                    stream_rows(query, Book, columns, chunk_size), columns, export_format, chunk_size,
+                ), etag, last_modified)
+            query = project(query, Book, fields, sort.lstrip('-'))
+            if is_stream_requested(args):
+                # Stream every matching book from a server-side cursor
+                chunk_size = current_app.config['FLASKY_STREAM_CHUNK_SIZE']
+                books = query.order_by(None).order_by(Book.id.asc()) \
+                    .execution_options(stream_results=True).yield_per(chunk_size)
+                return add_validators(build_streaming_response(
+                    {'ok': True, 'code': 200},
+                    (book.get_response(fields) for book in books),
+                    content_type,
+                    chunk_size=chunk_size,
+                    model=Book,
+                    fields=fields,
+                ), etag, last_modified)
+            try:
+                if rank is not None and 'sort' not in args:
+                    # most relevant books first
+                    books, next_cursor = paginate_by_rank(query, Book, rank, limit, after)
+                else:
+                    books, next_cursor = paginate(query, Book, limit, after, sort)
+            except InvalidPageArgument as e:
+                return build_response({
+                    'ok': False,
+                    'code': 400,
+                    'message': str(e)
+                }, content_type)
+            return add_validators(build_response({
                 'ok': True,
                 'code': 200,
-                'data': [book.get_response() for book in books]
-            }, content_type)
+                'data': [book.get_response(fields) for book in books],
+                'next': next_cursor,
+            }, content_type, Book, fields), etag, last_modified)
 
 
 api_restful.add_resource(
@@ -77,3 +179,30 @@ api_restful.add_resource(
     '/books',
     '/books/<int:book_id>',
 )
+
+
+class BookStatsView(Resource):
+    '''
+    catalog statistics (count, prices, price histogram, authors with the
+    most books), or those of one author with author_id=<id>
+    '''
+
+    @replica_reads
+    @cache.cached(book_cache_tags)
+    def get(self):
+        content_type = get_content_type(request.args)
+        author_id = request.args.get('author_id')
+        if author_id is not None and not author_id.isdigit():
+            return build_response({
+                'ok': False,
+                'code': 400,
+                'message': 'author_id is invalid'
+            }, content_type)
+        return build_response({
+            'ok': True,
+            'code': 200,
+            'data': BookStats.summarize(int(author_id) if author_id is not None else None)
+        }, content_type)
+
+
+api_restful.add_resource(BookStatsView, '/books/stats')
@@ -1,17 +1,29 @@
 
-import uuid
-from flask import request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+import csv
+import io
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import request, current_app
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from flask_restful import Resource, reqparse
+from sqlalchemy import func
 import werkzeug
 from werkzeug.utils import secure_filename
 
 from . import api as api, api_restful, logger
-from .. import db, boto
+from .. import db, boto, cache, identity_cache, purger, uploader
 from ..utils import Utils
 from ..utils.s3 import S3
-from ..models import User, Book, Permission
+from ..utils.book_import import InvalidImport, import_books, read_records
+from ..utils.fulltext import index_book, unindex_books
+from ..utils.purge import purge_user
+from ..utils.fields import InvalidFields, get_fields, project
+from ..utils.pagination import InvalidPageArgument, get_page_args, paginate
+from ..models import User, Book, BookStats, Permission, CoverStatus
+from ..common.decorators import owner_required, permission_required, replica_reads
 from ..schema.book import validate_publish_book, validate_update_book
+from .book import book_cache_tags
 from ..utils.response import build_response, get_content_type
 
 utils = Utils()
@@ -19,6 +31,130 @@ utils = Utils()
 ALLOWED_EXTENSIONS = set(['jpg', 'png', 'bmp'])
 
 
+def load_identity(user_id):
+    '''
+    Return the cached Identity (user json and role permissions) of a user
+    for the JWT token of the request, or None if the user does not exist
+    '''
+    return identity_cache.get(user_id, get_jwt()['jti'], User.load_identity)
+
+
+def cover_values(urls):
+    ''' Return the Book columns of a cover uploaded to `urls` '''
+    values = {'cover': urls['original'], 'cover_status': CoverStatus.READY, 'cover_upload_key': None}
+    for name in Book.COVER_DERIVATIVES:
+        values['cover_' + name] = urls.get(name)
+    return values
+
+
+def spool_cover(file_cover, file_extension):
+    '''
+    Spool an uploaded cover to disk. Covers are keyed by content hash:
+    a cover this process already uploaded is used at once.
+    Return (Book columns to set, S3 key, spooled path to upload or None).
+    '''
+    path, digest = uploader.spool(file_cover, file_extension)
+    key = f'books/cover/{digest}.{file_extension}'
+    urls = uploader.known(key)
+    if urls is not None:
+        os.remove(path)
+        return cover_values(urls), key, None
+    return {'cover_status': CoverStatus.PENDING, 'cover_upload_key': key}, key, path
+
+
+def cover_uploaded(book_id, key):
+    '''
+    Return the callback of the background upload of the cover `key` of a
+    book: it publishes the URLs of the cover and its derivatives, unless
+    another cover was sent since.
+    '''
+    def callback(urls):
+        if urls is not None:
+            values = cover_values(urls)
+        else:
+            values = {'cover_status': CoverStatus.FAILED, 'cover_upload_key': None}
+        updated = Book.query.filter_by(id=book_id, cover_upload_key=key) \
+            .update(values, synchronize_session=False)
+        db.session.commit()
+        if updated:
+            cache.invalidate(*book_cache_tags(), *book_cache_tags(book_id))
+    return callback
+
+
+def queue_cover_upload(book_id, path, key, file_extension):
+    uploader.submit(
+        lambda: S3(boto.clients['s3']), path, key, file_extension, cover_uploaded(book_id, key))
+
+
+def _call_all(callbacks):
+    def callback(urls):
+        for f in callbacks:
+            f(urls)
+    return callback
+
+
+def requeue_covers(min_age):
+    '''
+    Upload again the covers left pending by a stopped process, from their
+    files left in the spool for `min_age` seconds at least. The books whose
+    file is lost get the failed cover status; the other old files of the
+    spool are removed. Return (books requeued, books failed, files removed).
+    '''
+    covers, others = defaultdict(list), []
+    for path, digest in uploader.old_spool_files(min_age):
+        (covers[digest] if digest else others).append(path)
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+    pending = defaultdict(list)
+    for book_id, key in db.session.query(Book.id, Book.cover_upload_key).filter(
+            Book.cover_status == CoverStatus.PENDING, func.coalesce(Book.updated, Book.created) <= cutoff):
+        pending[key].append(book_id)
+
+    requeued = failed = 0
+    for key, book_ids in pending.items():
+        # books/cover/<content hash>.<extension>
+        digest, _, file_extension = key.rsplit('/', 1)[-1].partition('.')
+        paths = covers.pop(digest, [])
+        if not paths:
+            Book.query.filter(Book.id.in_(book_ids), Book.cover_upload_key == key).update(
+                {'cover_status': CoverStatus.FAILED, 'cover_upload_key': None}, synchronize_session=False)
+            db.session.commit()
+            cache.invalidate(*book_cache_tags(), *[tag for book_id in book_ids for tag in book_cache_tags(book_id)])
+            failed += len(book_ids)
+            continue
+        others.extend(paths[1:])
+        uploader.submit(lambda: S3(boto.clients['s3']), paths[0], key, file_extension,
+                        _call_all([cover_uploaded(book_id, key) for book_id in book_ids]))
+        requeued += len(book_ids)
+
+    for paths in covers.values():
+        others.extend(paths)
+    for path in others:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return requeued, failed, len(others)
+
+
+def purge_account(user_id):
+    '''
+    Purge a deleted user and its books, dropping the cached responses of
+    the books of each chunk as it is deleted. The books counted since the
+    user was deleted (published with a token cached by another process)
+    are uncounted at the end.
+    '''
+    config = current_app.config
+
+    def progress(book_ids):
+        cache.invalidate(*[tag for book_id in book_ids for tag in book_cache_tags(book_id)])
+    deleted = purge_user(db.session, User, Book, user_id,
+                         config['ACCOUNT_PURGE_CHUNK_SIZE'], config['ACCOUNT_PURGE_PAUSE'], progress)
+    if deleted is not None:
+        BookStats.remove_author(user_id)
+        db.session.commit()
+    return deleted
+
+
 class UserView(Resource):
     parser = reqparse.RequestParser()
     parser.add_argument('password', type=str)
@@ -27,13 +163,14 @@ class UserView(Resource):
     parser.add_argument('pseudonym')
 
     @jwt_required()
+    @replica_reads
     def get(self):
         content_type = get_content_type(request.args)
         # get basic information of user in JWT token
         current_user = get_jwt_identity()
         # find user by username
-        user = User.query.filter_by(id=current_user['userid']).first()
-        if user is None:
+        identity = load_identity(current_user['userid'])
+        if identity is None:
             return build_response({
                 'ok': False,
                 'code': 404,
@@ -44,8 +181,8 @@ class UserView(Resource):
         return build_response({
             'ok': True,
             'code': 200,
-            'data': user.get_response()
-        }, content_type)
+            'data': identity.data
+        }, content_type, User)
 
     @jwt_required()
     def put(self):
@@ -65,7 +202,7 @@ class UserView(Resource):
         # get basic information of user in JWT token
         current_user = get_jwt_identity()
         # find user by user_id
-        user = User.query.filter_by(id=current_user['userid']).first()
+        user = User.query.filter_by(id=current_user['userid'], deleted_at=None).first()
         if user is None:
             return build_response({
                 'ok': False,
@@ -79,12 +216,13 @@ class UserView(Resource):
         # commit the changes to database
         try:
             db.session.commit()
+            identity_cache.invalidate(user.id)
             # return user information
             return build_response({
                 'ok': True,
                 'code': 200,
                 'data': user.get_response()
-            }, content_type)
+            }, content_type, User)
         except Exception as e:
             # Rollback if it have any error
             logger.error(e)
@@ -100,7 +238,7 @@ class UserView(Resource):
         # get basic information of user in JWT token
         current_user = get_jwt_identity()
         # find user by user_id
-        user = User.query.filter_by(id=current_user['userid']).first()
+        user = User.query.filter_by(id=current_user['userid'], deleted_at=None).first()
         if user is None:
             return build_response({
                 'ok': False,
@@ -109,10 +247,18 @@ class UserView(Resource):
             }, content_type)
 
         try:
-            # Detele all published book and then, delete the user
-            Book.query.filter_by(author_id=user.id).delete()
-            db.session.delete(user)
+            # Mark the user as deleted, which hides its books at once: the
+            # books and then the user are purged in background, by chunks
+            user.deleted_at = datetime.utcnow()
+            BookStats.remove_author(user.id)
             db.session.commit()
+            identity_cache.invalidate(user.id)
+            # the responses of the books are hidden now, not as they are purged
+            tags = list(book_cache_tags())
+            for (book_id,) in db.session.query(Book.id).filter(Book.author_id == user.id):
+                tags.extend(book_cache_tags(book_id))
+            cache.invalidate(*tags)
+            purger.submit(purge_account, user.id)
             return build_response({
                 'ok': False,
                 'code': 200,
@@ -138,26 +284,13 @@ class UserPublicBookView(Resource):
     parser.add_argument('cover', type=werkzeug.datastructures.FileStorage, location='files')
     parser.add_argument('price', type=int)
 
-    def __init__(self) -> None:
-        super().__init__()
-
-        # Init Aws s3 client
-        self.S3_BUCKET_NAME = 'kashyyyk-resources'
-        self.s3 = S3(boto.clients['s3'])
-
     @jwt_required()
+    @owner_required
+    @replica_reads
     def get(self, user_id):
         content_type = get_content_type(request.args)
-        # get basic information of user in JWT token
-        current_user = get_jwt_identity()
-        if user_id != current_user['userid']:
-            return build_response({
-                'ok': False,
-                'code': 403,
-                'message': 'jwt token not belong to user_id'
-            }, content_type)
         # find user by id
-        user = User.query.filter_by(id=user_id).first()
+        user = load_identity(user_id)
         if user is None:
             return build_response({
                 'ok': False,
@@ -165,48 +298,41 @@ class UserPublicBookView(Resource):
                 'message': 'user not found'
             }, content_type)
 
-        books = Book.query.filter_by(author_id=user_id).all()
-        res = [book.to_json() for book in books]
+        try:
+            fields = get_fields(request.args, Book.JSON_FIELDS)
+            limit, after, sort = get_page_args(
+                request.args,
+                current_app.config['FLASKY_BOOKS_PER_PAGE'],
+                current_app.config['FLASKY_MAX_BOOKS_PER_PAGE'],
+            )
+            query = project(Book.query.filter_by(author_id=user_id), Book, fields, sort.lstrip('-'))
+            books, next_cursor = paginate(query, Book, limit, after, sort)
+        except (InvalidFields, InvalidPageArgument) as e:
+            return build_response({
+                'ok': False,
+                'code': 400,
+                'message': str(e)
+            }, content_type)
+        res = [book.to_json(fields) for book in books]
 
         return build_response({
             'ok': True,
             'code': 200,
-            'data': res
-        }, content_type)
+            'data': res,
+            'next': next_cursor,
+        }, content_type, Book, fields)
 
     @jwt_required()
+    @owner_required
+    @permission_required(Permission.PUBLISH)
     def post(self, user_id):
         content_type = get_content_type(request.args)
-        # get basic information of user in JWT token
-        current_user = get_jwt_identity()
-        if user_id != current_user['userid']:
-            return build_response({
-                'ok': False,
-                'code': 403,
-                'message': 'jwt token not belong to user_id'
-            }, content_type)
 
         args = self.parser.parse_args()
         logger.info(args)
 
-        # find user by id
-        user = User.query.filter_by(id=user_id).first()
-        if user is None:
-            return build_response({
-                'ok': False,
-                'code': 404,
-                'message': 'user not found'
-            }, content_type)
-        
-        # Check user permission
-        if user.can(Permission.PUBLISH) == False:
-            return build_response({
-                'ok': False,
-                'code': 401,
-                'message': 'user does not have permission to publish the book'
-            }, content_type)
-        # parse book cover file content
-        book_cover_url = None
+        # spool the book cover file to disk, it is uploaded to S3 in background
+        cover_params, cover_path = {}, None
         if 'cover' in args and args['cover'] != None and args['cover'].filename != '':
             file_cover = args['cover']
             file_name = secure_filename(file_cover.filename)
@@ -217,28 +343,37 @@ class UserPublicBookView(Resource):
                     'code': 400,
                     'message': 'file extension is not one of our supported types'
                 }, content_type)
-            # TODO: upload book cover to S3 (set public access)
-            image_key_name = f'books/cover/' + uuid.uuid4().hex + '.' + file_extension
-            book_cover_url = self.s3.upload_public(self.S3_BUCKET_NAME, image_key_name, file_cover, file_extension)
+            cover_params, image_key_name, cover_path = spool_cover(file_cover, file_extension)
 
         try:
             book = Book(
                 title=args['title'],
                 description=args['description'],
-                cover=book_cover_url,
                 price=args['price'],
                 author_id=user_id,
             )
+            for key, value in cover_params.items():
+                setattr(book, key, value)
             db.session.add(book)
+            # flush to get the book id, then index and count it in the same transaction
+            db.session.flush()
+            index_book(db.session, book)
+            BookStats.add(user_id, [book.price])
             db.session.commit()
+            cache.invalidate(*book_cache_tags(), *book_cache_tags(book.id))
+            if cover_path is not None:
+                path, cover_path = cover_path, None
+                queue_cover_upload(book.id, path, image_key_name, file_extension)
             return build_response({
                 'ok': True,
                 'code': 200,
                 'data': book.get_response()
-            }, content_type)
+            }, content_type, Book)
         except Exception as e:
             logger.error(e)
             db.session.rollback()
+            if cover_path is not None:
+                os.remove(cover_path)
             return build_response({
                 'ok': False,
                 'code': 500,
@@ -246,28 +381,14 @@ class UserPublicBookView(Resource):
             }, content_type)
 
     @jwt_required()
+    @owner_required
+    @permission_required(Permission.PUBLISH)
     def put(self, user_id, book_id):
         content_type = get_content_type(request.args)
-        # get basic information of user in JWT token
-        current_user = get_jwt_identity()
-        if user_id != current_user['userid']:
-            return build_response({
-                'ok': False,
-                'code': 403,
-                'message': 'jwt token not belong to user_id'
-            }, content_type)
 
         args = self.parser.parse_args()
         logger.info(args)
 
-        # find user by id
-        user = User.query.filter_by(id=user_id).first()
-        if user is None:
-            return build_response({
-                'ok': False,
-                'code': 404,
-                'message': 'user not found'
-            })
         book = Book.query.filter_by(id=book_id, author_id=user_id).first()
         if book is None:
             return build_response({
@@ -282,8 +403,9 @@ class UserPublicBookView(Resource):
             'price': args['price'],
         }
         logger.info(params)
+        cover_params, cover_path = {}, None
         if 'cover' in args and args['cover'] != None and args['cover'].filename != '':
-            # parse book cover file content and upload to aws S3
+            # parse book cover file content and spool it, it is uploaded to S3 in background
             file_cover = args['cover']
             file_name = secure_filename(file_cover.filename)
             file_extension = file_name.rsplit('.', 1)[1].lower()
@@ -294,26 +416,39 @@ class UserPublicBookView(Resource):
                     'code': 400,
                     'message': 'file extension is not one of our supported types'
                 }, content_type)
-            # upload book cover to S3 (set public access)
-            image_key_name = f'books/cover/' + uuid.uuid4().hex + '.' + file_extension
-            params['cover'] = self.s3.upload_public(self.S3_BUCKET_NAME, image_key_name, file_cover, file_extension)
+            cover_params, image_key_name, cover_path = spool_cover(file_cover, file_extension)
 
         params = utils.remove_none_params(params)
+        # the derivatives of a new cover may be None
+        params.update(cover_params)
         try:
+            old_price = book.price
             # update book with request params
             for key, value in params.items():
                 setattr(book, key, value)
+            if 'title' in params or 'description' in params:
+                index_book(db.session, book)
+            if book.price != old_price:
+                db.session.flush()
+                BookStats.remove(user_id, [old_price])
+                BookStats.add(user_id, [book.price])
             # commit the changes to database
             db.session.commit()
+            cache.invalidate(*book_cache_tags(), *book_cache_tags(book.id))
+            if cover_path is not None:
+                path, cover_path = cover_path, None
+                queue_cover_upload(book.id, path, image_key_name, file_extension)
             # return user information
             return build_response({
                 'ok': True,
                 'code': 200,
                 'data': book.get_response()
-            }, content_type)
+            }, content_type, Book)
         except Exception as e:
             logger.error(e)
             db.session.rollback()
+            if cover_path is not None:
+                os.remove(cover_path)
             return build_response({
                 'ok': False,
                 'code': 500,
@@ -321,21 +456,20 @@ class UserPublicBookView(Resource):
             })
     
     @jwt_required()
+    @owner_required
     def delete(self, user_id, book_id):
         content_type = get_content_type(request.args)
-        # get basic information of user in JWT token
-        current_user = get_jwt_identity()
-        if user_id != current_user['userid']:
-            return build_response({
-                'ok': False,
-                'code': 403,
-                'message': 'jwt token not belong to user_id'
-            }, content_type)
         
         try:
             # Delete a published book
-            Book.query.filter_by(id=book_id, author_id=user_id).delete()
+            price = db.session.query(Book.price).filter_by(id=book_id, author_id=user_id).first()
+            deleted = Book.query.filter_by(id=book_id, author_id=user_id).delete()
+            if deleted:
+                unindex_books(db.session, Book, book_ids=[book_id])
+                BookStats.remove(user_id, [price[0]])
             db.session.commit()
+            if deleted:
+                cache.invalidate(*book_cache_tags(), *book_cache_tags(book_id))
             return build_response({
                 'ok': True,
                 'code': 200,
@@ -355,4 +489,64 @@ api_restful.add_resource(
     UserPublicBookView, 
     '/users/<int:user_id>/books',
     '/users/<int:user_id>/books/<int:book_id>',
-)
\ No newline at end of file
+)
+
+
+def count_imported_books(author_id):
+    ''' Return the callback counting the books of each INSERT of an import '''
+    return lambda rows: BookStats.add(author_id, [row['price'] for row in rows])
+
+
+class UserBookImport(Resource):
+    '''
+    publish many books at once: the request body is streamed, in CSV with
+    a header row (format=csv, or Content-Type text/csv) or JSON lines
+    '''
+
+    @jwt_required()
+    @owner_required
+    @permission_required(Permission.PUBLISH)
+    def post(self, user_id):
+        content_type = get_content_type(request.args)
+        format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        config = current_app.config
+
+        # the books of the transactions committed so far
+        committed = {'created': 0, 'rejected': 0}
+
+        def progress(created, rejected):
+            committed.update(created=created, rejected=rejected)
+            logger.info(f'book import of user {user_id}: {created} created, {rejected} rejected')
+
+        try:
+            created, rejected, errors = import_books(
+                db.session, Book, read_records(lines, format), user_id,
+                config['FLASKY_IMPORT_CHUNK_SIZE'], config['FLASKY_IMPORT_TRANSACTION_ROWS'],
+                config['FLASKY_IMPORT_MAX_ERRORS'], progress, count_imported_books(user_id))
+        except (InvalidImport, UnicodeDecodeError, csv.Error) as e:
+            return build_response({
+                'ok': False,
+                'code': 400,
+                'message': f'Bad request parameters: {e}'
+            }, content_type)
+        except Exception as e:
+            logger.error(e)
+            # the books committed before the error stay: tell which ones
+            return build_response({
+                'ok': False,
+                'code': 500,
+                'message': 'internal server error, the books created before it are kept',
+                'data': committed,
+            }, content_type)
+        finally:
+            # books of the committed transactions are listed, even after an error
+            cache.invalidate(*book_cache_tags())
+        return build_response({
+            'ok': True,
+            'code': 200,
+            'data': {'created': created, 'rejected': rejected, 'errors': errors}
+        }, content_type)
+
+
+api_restful.add_resource(UserBookImport, '/users/<int:user_id>/books/import')
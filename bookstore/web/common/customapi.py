@@ -4,6 +4,7 @@ import logging
 from jwt.exceptions import ExpiredSignatureError, InvalidSignatureError
 from flask_jwt_extended.exceptions import NoAuthorizationError, JWTDecodeError, InvalidHeaderError
 
+from ..utils.hashing import HashingPoolFull
 from ..utils.response import build_response, get_content_type
 
 class CustomApi(flask_restful.Api):
@@ -17,6 +18,8 @@ class CustomApi(flask_restful.Api):
             return build_response({"ok": False, "code": 401, "error": "token is missing"}, content_type)
         if isinstance(e, JWTDecodeError) or isinstance(e, InvalidSignatureError):
             return build_response({"ok": False, "code": 403, "error": "can not decode the token"}, content_type)
+        if isinstance(e, HashingPoolFull):
+            return build_response({"ok": False, "code": 503, "error": "server is busy, please try again later"}, content_type)
 
         message = ''
         if hasattr(e, 'message'):
@@ -0,0 +1,93 @@
+from functools import wraps
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt, get_jwt_identity
+
+from .. import cache, identity_cache, replicas
+from ..models import Role, User
+from ..utils.response import build_response, get_content_type
+
+
+def _deleted_user():
+    # the token of a deleted user stays signed until it expires: its
+    # cached identity (see load_identity) is None once the user is deleted
+    identity = identity_cache.get(get_jwt_identity()['userid'], get_jwt()['jti'], User.load_identity)
+    if identity is None:
+        return build_response({
+            'ok': False,
+            'code': 401,
+            'message': 'user not found, please log in again'
+        }, get_content_type(request.args))
+    return None
+
+
+def owner_required(f):
+    '''
+    Reject the request unless the `user_id` of the url is the user of the
+    JWT token, and this user is not deleted. Must be placed under
+    jwt_required.
+    '''
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if kwargs.get('user_id') != get_jwt_identity()['userid']:
+            return build_response({
+                'ok': False,
+                'code': 403,
+                'message': 'jwt token not belong to user_id'
+            }, get_content_type(request.args))
+        rejected = _deleted_user()
+        if rejected is not None:
+            return rejected
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def permission_required(permission, message='user does not have permission to publish the book'):
+    '''
+    Reject the request unless the role permissions signed into the JWT
+    token grant `permission`. Tokens issued before a change of the role
+    permissions (other role version), or of a deleted user, are rejected.
+    The database is only queried to refresh the role versions and the
+    cached identity of the user. Must be placed under jwt_required.
+    '''
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            claims = get_jwt()
+            role_versions = identity_cache.role_versions(Role.load_versions)
+            if 'rid' not in claims or role_versions.get(claims['rid']) != claims.get('rv'):
+                return build_response({
+                    'ok': False,
+                    'code': 401,
+                    'message': 'token is outdated, please log in again'
+                }, get_content_type(request.args))
+            rejected = _deleted_user()
+            if rejected is not None:
+                return rejected
+            if claims.get('perms', 0) & permission != permission:
+                return build_response({
+                    'ok': False,
+                    'code': 401,
+                    'message': message
+                }, get_content_type(request.args))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def replica_reads(f):
+    '''
+    Run the queries of a read-only view on a read replica, unless its
+    client has just written: it then reads from the primary, without the
+    response cache, which may hold a response of a lagging replica.
+    The client is the user of the token, if any, else the address. Must be
+    placed above cache.cached.
+    '''
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if replicas.route_reads() is not None:
+            cache.hold_stale()
+        elif current_app.config['SQLALCHEMY_REPLICA_BINDS'] and replicas.is_pinned():
+            cache.skip()
+        return f(*args, **kwargs)
+    return decorated_function
@@ -3,9 +3,14 @@ from datetime import datetime
 
 from flask import current_app
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import exists
 
-from . import db
+from . import db, hasher, identity_cache
+from .utils import book_stats
+from .utils.fulltext import setup_book_index
+from .utils.hashing import HashingPoolFull
+from .utils.identity import Identity
+from .utils.serializer import row_encoder
 
 class Permission:
     VIEW = 1
@@ -13,13 +18,24 @@ class Permission:
     ADMIN = 4
 
 
+class CoverStatus:
+    PENDING = 'pending'
+    READY = 'ready'
+    FAILED = 'failed'
+
+
 class Role(db.Model):
     __tablename__ = 'roles'
 
+    #: Attributes exposed by to_json, in output order
+    JSON_FIELDS = ('id', 'name', 'permissions', 'created', 'updated')
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True)
     default = db.Column(db.Boolean, default=False, index=True)
     permissions = db.Column(db.Integer)
+    # bumped whenever permissions change, tokens carrying another version are stale
+    version = db.Column(db.Integer, default=1, nullable=False, server_default='1')
     created = db.Column(db.DateTime(), default=datetime.utcnow)
     updated = db.Column(db.DateTime(), onupdate=datetime.utcnow)
 
@@ -34,14 +50,7 @@ class Role(db.Model):
         return '<Role %r>' % self.name
 
     def to_json(self):
-        _json = {
-            'id': self.id,
-            'name': self.name,
-            'permission': self.permission,
-            'created': self.created,
-            'updated': self.updated,
-        }
-        return _json
+        return row_encoder(Role)(self)
 
     @staticmethod
     def insert_roles():
@@ -55,12 +64,16 @@ class Role(db.Model):
             role = Role.query.filter_by(name=r).first()
             if role is None:
                 role = Role(name=r)
+            old_permissions = role.permissions
             role.reset_permissions()
             for perm in roles[r]:
                 role.add_permission(perm)
+            if role.id is not None and role.permissions != old_permissions:
+                role.version = (role.version or 1) + 1
             role.default = (role.name == default_role)
             db.session.add(role)
         db.session.commit()
+        identity_cache.invalidate_roles()
 
     def add_permission(self, perm):
         if not self.has_permission(perm):
@@ -72,10 +85,22 @@ class Role(db.Model):
     def has_permission(self, perm):
         return self.permissions & perm == perm
 
+    @staticmethod
+    def default_role_id():
+        role = Role.query.filter_by(default=True).first()
+        return role.id if role is not None else None
+
+    @staticmethod
+    def load_versions():
+        return {role_id: version for role_id, version in db.session.query(Role.id, Role.version)}
+
 
 class User(db.Model):
     __tablename__ = 'users'
 
+    #: Attributes exposed by to_json, in output order
+    JSON_FIELDS = ('id', 'username', 'email', 'name', 'pseudonym', 'confirmed', 'created', 'updated')
+
     id = db.Column(db.Integer, primary_key=True)
     password_hash = db.Column(db.String(128))
     username = db.Column(db.String(30), unique=True, index=True, nullable=False)
@@ -86,6 +111,9 @@ class User(db.Model):
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
     created = db.Column(db.DateTime(), default=datetime.utcnow)
     updated = db.Column(db.DateTime(), onupdate=datetime.utcnow)
+    # set when the account is deleted: its books are hidden until the
+    # background purge removes them, and the user with them
+    deleted_at = db.Column(db.DateTime(), index=True)
 
     books = db.relationship('Book', backref='author', lazy='dynamic')
 
@@ -98,17 +126,7 @@ class User(db.Model):
         return '<User: {}>'.format(self.id)
 
     def to_json(self):
-        _json = {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'name': self.name,
-            'pseudonym': self.pseudonym,
-            'confirmed': self.confirmed,
-            'created': self.created,
-            'updated': self.updated,
-        }
-        return _json
+        return row_encoder(User)(self)
 
     def get_response(self):
         return self.to_json()
@@ -119,14 +137,25 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.generate(password)
 
     def verify_password(self, password):
         try:
-            return check_password_hash(self.password_hash, password)
+            return hasher.verify(self.password_hash, password)
+        except HashingPoolFull:
+            raise
         except:
             return False
 
+    def password_needs_rehash(self):
+        return self.password_hash is not None and hasher.needs_rehash(self.password_hash)
+
+    def token_claims(self):
+        ''' Role permissions signed into the access tokens of the user '''
+        if self.role is None:
+            return {'perms': 0, 'rid': None, 'rv': None}
+        return {'perms': self.role.permissions, 'rid': self.role.id, 'rv': self.role.version}
+
     def generate_confirmation_token(self, expiration=3600):
         s = Serializer(current_app.config['SECRET_KEY'], expiration)
         return s.dumps({'confirm': self.id}).decode('utf-8')
@@ -146,15 +175,47 @@ class User(db.Model):
     def can(self, perm):
         return self.role is not None and self.role.has_permission(perm)
 
+    @staticmethod
+    def load_identity(user_id):
+        """Return the Identity of a user, loaded with its role permissions in
+        a single query, or None if the user does not exist or is deleted."""
+        row = db.session.query(User, Role.permissions) \
+            .outerjoin(Role, User.role_id == Role.id) \
+            .filter(User.id == user_id, User.deleted_at.is_(None)).first()
+        if row is None:
+            return None
+        user, permissions = row
+        return Identity(user.id, permissions, user.to_json())
+
     
 
 class Book(db.Model):
     __tablename__ = 'books'
+    # The id is the tie-breaker of every keyset ordering (see utils.pagination)
+    __table_args__ = (
+        db.Index('ix_books_author_id_id', 'author_id', 'id'),
+        db.Index('ix_books_price_id', 'price', 'id'),
+        db.Index('ix_books_created_id', 'created', 'id'),
+    )
+
+    #: Attributes exposed by to_json, in output order
+    JSON_FIELDS = ('id', 'title', 'description', 'cover', 'cover_thumbnail', 'cover_card', 'cover_full',
+                   'cover_status', 'price', 'author_id', 'created', 'updated')
+
+    #: Resized copies of the cover (see COVER_DERIVATIVES), in cover_<name>
+    COVER_DERIVATIVES = ('thumbnail', 'card', 'full')
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(1024))
     description = db.Column(db.Text)
     cover = db.Column(db.String(1024))
+    cover_thumbnail = db.Column(db.String(1024))
+    cover_card = db.Column(db.String(1024))
+    cover_full = db.Column(db.String(1024))
+    # state of the last cover upload (CoverStatus), and the key it is
+    # uploaded to while pending
+    cover_status = db.Column(db.String(16))
+    cover_upload_key = db.Column(db.String(1024))
     price = db.Column(db.Integer, default=0)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     created = db.Column(db.DateTime(), default=datetime.utcnow)
@@ -166,18 +227,61 @@ class Book(db.Model):
     def __repr__(self):
         return '<Book: {}>'.format(self.id)
 
-    def to_json(self):
-        _json = {
-            'id': self.id,
-            'title': self.title,
-            'description': self.description,
-            'cover': self.cover,
-            'price': self.price,
-            'author_id': self.author_id,
-            'created': self.created,
-            'updated': self.updated,
-        }
-        return _json
+    def to_json(self, fields=None):
+        # only touch the requested attributes: the others may not be loaded
+        return row_encoder(Book, fields)(self)
 
-    def get_response(self):
-        return self.to_json()
\ No newline at end of file
+    def get_response(self, fields=None):
+        return self.to_json(fields)
+
+    @staticmethod
+    def visible():
+        ''' Filter of the books shown to readers: not of a deleted user '''
+        return ~exists().where(User.id == Book.author_id, User.deleted_at.isnot(None))
+
+
+setup_book_index(Book.__table__)
+
+
+class BookStats(db.Model):
+    """Summary of the visible books by author and price bucket (the
+    FLASKY_STATS_PRICE_BUCKETS edges), kept up to date in the transactions
+    which change the books, so the catalog statistics never scan them.
+    """
+    __tablename__ = 'book_stats'
+
+    author_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    book_count = db.Column(db.Integer, nullable=False, default=0)
+    price_sum = db.Column(db.BigInteger, nullable=False, default=0)
+    price_min = db.Column(db.Integer)
+    price_max = db.Column(db.Integer)
+
+    def __repr__(self):
+        return '<BookStats: {} {}>'.format(self.author_id, self.bucket)
+
+    @staticmethod
+    def add(author_id, prices):
+        book_stats.add_books(db.session, BookStats, current_app.config['FLASKY_STATS_PRICE_BUCKETS'],
+                             author_id, prices)
+
+    @staticmethod
+    def remove(author_id, prices):
+        ''' Must be called once the books are deleted (or their price changed) '''
+        book_stats.remove_books(db.session, BookStats, Book, current_app.config['FLASKY_STATS_PRICE_BUCKETS'],
+                                author_id, prices)
+
+    @staticmethod
+    def remove_author(author_id):
+        book_stats.remove_author(db.session, BookStats, author_id)
+
+    @staticmethod
+    def rebuild():
+        return book_stats.rebuild(db.session, BookStats, Book, current_app.config['FLASKY_STATS_PRICE_BUCKETS'],
+                                  Book.visible())
+
+    @staticmethod
+    def summarize(author_id=None):
+        config = current_app.config
+        return book_stats.summarize(db.session, BookStats, config['FLASKY_STATS_PRICE_BUCKETS'],
+                                    author_id, config['FLASKY_STATS_TOP_AUTHORS'])
@@ -1,4 +1,4 @@
-from jsonschema import validate
+from jsonschema import validate, validators
 from jsonschema.exceptions import ValidationError
 from jsonschema.exceptions import SchemaError
 
@@ -33,4 +33,16 @@ def validate_update_book(data):
         return {'ok': False, 'message': e}
     except SchemaError as e:
         return {'ok': False, 'message': e}
-    return {'ok': True, 'data': data}
\ No newline at end of file
+    return {'ok': True, 'data': data}
+
+
+# checked once: the rows of an import are validated by this instance
+book_publish_validator = validators.validator_for(book_publish_schema)(book_publish_schema)
+
+
+def validate_import_book(data):
+    try:
+        book_publish_validator.validate(data)
+    except ValidationError as e:
+        return {'ok': False, 'message': e}
+    return {'ok': True, 'data': data}
@@ -6,13 +6,13 @@ from jsonschema.exceptions import SchemaError
 user_register_schema = {
     "type": "object",
     "properties": {
-        "username": {"type": "string", "maxLength": 128},
+        "username": {"type": "string", "maxLength": 30},
         "password": {
             "type": "string",
             "minLength": 5,
             "maxLength": 64
         },
-        "email": { "type": "string", "format": "email" },
+        "email": { "type": "string", "format": "email", "maxLength": 128 },
         "name": { "type": "string", "maxLength": 128 },
         "pseudonym": { "type": "string", "maxLength": 128 },
     },
@@ -0,0 +1,131 @@
+import csv
+import json
+
+from ..schema.book import book_publish_schema, validate_import_book
+from .fulltext import index_last_books
+
+FORMATS = ('csv', 'jsonl')
+
+
+class InvalidImport(ValueError):
+    pass
+
+
+class UnreadableRecord:
+    ''' Stands for a record of the input which could not be parsed '''
+    __slots__ = ('message',)
+
+    def __init__(self, message):
+        self.message = message
+
+
+def _error(index, record, message):
+    title = record.get('title') if isinstance(record, dict) else None
+    return {'index': index, 'title': title, 'message': message}
+
+
+def _csv_record(row):
+    # every CSV cell is a string: empty cells are missing, the price a number
+    if None in row:
+        return UnreadableRecord('row has more fields than the header')
+    record = {key: value for key, value in row.items() if value not in (None, '')}
+    price = record.get('price')
+    if price is not None and price.lstrip('-').isdigit():
+        record['price'] = int(price)
+    return record
+
+
+def read_records(lines, format='jsonl'):
+    '''
+    Yield the book records of `lines` (a text file or any iterable of
+    lines) one at a time, in `format`: 'csv' with a header row or 'jsonl'.
+    A record which cannot be parsed is yielded as an UnreadableRecord.
+    '''
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        unknown = [name for name in reader.fieldnames or () if name not in book_publish_schema['properties']]
+        if unknown:
+            raise InvalidImport('unknown columns: %s' % ', '.join(unknown))
+        for row in reader:
+            yield _csv_record(row)
+    elif format == 'jsonl':
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield UnreadableRecord('invalid JSON: %s' % e)
+    else:
+        raise InvalidImport('format must be one of %s' % ', '.join(FORMATS))
+
+
+def import_books(session, model, records, author_id, chunk_size=1000, transaction_rows=10000,
+                 max_errors=1000, progress=None, on_insert=None):
+    '''
+    Create the books of the `records` iterable for the author `author_id`:
+    each record is validated against the publish schema, the valid ones are
+    inserted `chunk_size` rows per INSERT and committed every
+    `transaction_rows` rows, so memory does not grow with the input.
+    `progress(created, rejected)` is called after each commit, and
+    `on_insert(rows)` after each INSERT, in its transaction.
+    The first `max_errors` invalid records are reported.
+    On a database error the rows of the transaction in progress are rolled
+    back and the error raised: the ones committed before stay.
+    Return (number of books created, number rejected, [{'index', 'title', 'message'}]).
+    '''
+    table = model.__table__
+    created = rejected = pending = 0
+    errors = []
+    chunk = []
+
+    def reject(index, record, message):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < max_errors:
+            errors.append(_error(index, record, message))
+
+    def flush():
+        nonlocal pending
+        if chunk:
+            session.execute(table.insert(), chunk)
+            index_last_books(session, model, len(chunk))
+            if on_insert is not None:
+                on_insert(chunk)
+            pending += len(chunk)
+            chunk.clear()
+
+    def commit():
+        nonlocal created, pending
+        flush()
+        session.commit()
+        created, pending = created + pending, 0
+        if progress is not None:
+            progress(created, rejected)
+
+    try:
+        for index, record in enumerate(records):
+            if isinstance(record, UnreadableRecord):
+                reject(index, None, record.message)
+                continue
+            if not isinstance(record, dict):
+                reject(index, record, 'record is not an object')
+                continue
+            data = validate_import_book({k: v for k, v in record.items() if v is not None})
+            if not data['ok']:
+                reject(index, record, f'Bad request parameters: {data["message"].message}')
+                continue
+            row = dict.fromkeys(('title', 'description', 'cover'))
+            row.update(data['data'])
+            row['price'] = row.get('price', 0)
+            row['author_id'] = author_id
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush()
+                if pending >= transaction_rows:
+                    commit()
+        commit()
+    except Exception:
+        session.rollback()
+        raise
+    return created, rejected, errors
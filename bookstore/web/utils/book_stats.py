@@ -0,0 +1,189 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from sqlalchemy import and_, case, func, insert, literal
+from sqlalchemy.dialects import mysql, sqlite
+
+#: Bucket of the books without a price: counted, out of the prices
+UNPRICED = -1
+
+
+def price_bucket(edges, price):
+    '''
+    Return the index of the histogram bucket [edges[i], edges[i + 1]) of
+    `price`, or UNPRICED
+    '''
+    if price is None:
+        return UNPRICED
+    return max(bisect_right(edges, price) - 1, 0)
+
+
+def _bucket_bounds(edges, bucket):
+    return edges[bucket], edges[bucket + 1] if bucket + 1 < len(edges) else None
+
+
+def _group(edges, prices):
+    # bucket: [count, sum, min, max]
+    groups = {}
+    for price in prices:
+        bucket = price_bucket(edges, price)
+        group = groups.get(bucket)
+        if group is None:
+            groups[bucket] = [1, price or 0, price, price]
+        elif price is None:
+            group[0] += 1
+        else:
+            group[0] += 1
+            group[1] += price
+            group[2] = min(group[2], price)
+            group[3] = max(group[3], price)
+    return groups
+
+
+def _upsert(session, table, row):
+    # add `row` to the row of its key, in one statement where supported
+    dialect = session.connection().dialect.name
+    c = table.c
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(**row)
+        new = stmt.inserted
+        session.execute(stmt.on_duplicate_key_update(
+            book_count=c.book_count + new.book_count,
+            price_sum=c.price_sum + new.price_sum,
+            price_min=func.least(c.price_min, new.price_min),
+            price_max=func.greatest(c.price_max, new.price_max),
+        ))
+        return
+    if dialect == 'sqlite':
+        stmt = sqlite.insert(table).values(**row)
+        new = stmt.excluded
+        # min() and max() of several arguments are scalar functions in SQLite
+        session.execute(stmt.on_conflict_do_update(index_elements=[c.author_id, c.bucket], set_={
+            'book_count': c.book_count + new.book_count,
+            'price_sum': c.price_sum + new.price_sum,
+            'price_min': func.min(c.price_min, new.price_min),
+            'price_max': func.max(c.price_max, new.price_max),
+        }))
+        return
+    updated = session.execute(table.update().where(
+        c.author_id == row['author_id'], c.bucket == row['bucket']).values(
+        book_count=c.book_count + row['book_count'],
+        price_sum=c.price_sum + row['price_sum'],
+        price_min=case((c.price_min < row['price_min'], c.price_min), else_=row['price_min']),
+        price_max=case((c.price_max > row['price_max'], c.price_max), else_=row['price_max']),
+    ))
+    if not updated.rowcount:
+        session.execute(table.insert().values(**row))
+
+
+def add_books(session, model, edges, author_id, prices):
+    '''
+    Count books of `author_id` with `prices` in the summary `model`, inside
+    the transaction which creates them: one upsert per price bucket.
+    '''
+    for bucket, (count, total, low, high) in _group(edges, prices).items():
+        _upsert(session, model.__table__, {
+            'author_id': author_id, 'bucket': bucket, 'book_count': count,
+            'price_sum': total, 'price_min': low, 'price_max': high,
+        })
+
+
+def remove_books(session, model, book_model, edges, author_id, prices):
+    '''
+    Uncount books of `author_id` with `prices` from the summary `model`,
+    inside the transaction which deletes them, after they are deleted. The
+    minimum or maximum of a bucket losing its extreme price is read again
+    from the books of the author in the bucket.
+    '''
+    table = model.__table__
+    c = table.c
+    for bucket, (count, total, low, high) in _group(edges, prices).items():
+        key = and_(c.author_id == author_id, c.bucket == bucket)
+        session.execute(table.update().where(key).values(
+            book_count=c.book_count - count, price_sum=c.price_sum - total))
+        row = session.execute(table.select().where(key)).first()
+        if row is None:
+            continue
+        if row.book_count <= 0:
+            session.execute(table.delete().where(key))
+        elif bucket != UNPRICED and (low <= row.price_min or high >= row.price_max):
+            lower, upper = _bucket_bounds(edges, bucket)
+            price = book_model.price
+            criteria = [book_model.author_id == author_id, price >= lower]
+            if upper is not None:
+                criteria.append(price < upper)
+            low, high = session.query(func.min(price), func.max(price)).filter(*criteria).one()
+            session.execute(table.update().where(key).values(price_min=low, price_max=high))
+
+
+def remove_author(session, model, author_id):
+    ''' Uncount every book of `author_id` from the summary `model` '''
+    session.execute(model.__table__.delete().where(model.__table__.c.author_id == author_id))
+
+
+def rebuild(session, model, book_model, edges, *criteria):
+    '''
+    Compute the summary `model` again from the books meeting `criteria`,
+    with one GROUP BY over the books table, e.g. after the buckets changed
+    or to repair a drift. Return the number of summary rows.
+    '''
+    table = model.__table__
+    price = book_model.price
+    bucket = case((price.is_(None), literal(UNPRICED)),
+                  *[(price >= edge, literal(i)) for i, edge in reversed(list(enumerate(edges)))],
+                  else_=literal(0))
+    query = session.query(
+        book_model.author_id, bucket, func.count(book_model.id), func.coalesce(func.sum(price), 0),
+        func.min(price), func.max(price)).filter(book_model.author_id.isnot(None), *criteria) \
+        .group_by(book_model.author_id, bucket)
+    session.execute(table.delete())
+    session.execute(insert(table).from_select(
+        ['author_id', 'bucket', 'book_count', 'price_sum', 'price_min', 'price_max'], query.statement))
+    return session.query(func.count()).select_from(table).scalar()
+
+
+def summarize(session, model, edges, author_id=None, top_authors=100):
+    '''
+    Return the catalog statistics read from the summary `model`: book
+    count, price min/max/avg, the histogram of prices over the `edges`
+    buckets, and the `top_authors` authors with the most books. With
+    `author_id`, the statistics of the books of that author. The books
+    without a price are counted, but not in the prices.
+    '''
+    c = model.__table__.c
+    criteria = [c.author_id == author_id] if author_id is not None else []
+    count, total, low, high = session.query(
+        func.sum(c.book_count), func.sum(c.price_sum), func.min(c.price_min), func.max(c.price_max)) \
+        .filter(*criteria).one()
+    counts = defaultdict(int, session.query(c.bucket, func.sum(c.book_count))
+                         .filter(*criteria).group_by(c.bucket).all())
+    histogram = []
+    for i in range(len(edges)):
+        lower, upper = _bucket_bounds(edges, i)
+        histogram.append({'min': lower, 'max': upper, 'count': int(counts[i])})
+
+    book_count = func.sum(c.book_count)
+    priced_count = func.sum(case((c.bucket != UNPRICED, c.book_count), else_=0))
+    authors = session.query(
+        c.author_id, book_count, priced_count, func.sum(c.price_sum), func.min(c.price_min),
+        func.max(c.price_max)) \
+        .filter(*criteria).group_by(c.author_id) \
+        .order_by(book_count.desc(), c.author_id).limit(top_authors)
+    count = int(count or 0)
+    priced = count - int(counts[UNPRICED])
+    return {
+        'count': count,
+        'price': {
+            'min': low,
+            'max': high,
+            'avg': round(float(total) / priced, 2) if priced else None,
+        },
+        'histogram': histogram,
+        'authors': [{
+            'author_id': author,
+            'count': int(author_count),
+            'price_min': author_low,
+            'price_max': author_high,
+            'price_avg': round(float(author_total) / int(author_priced), 2) if author_priced else None,
+        } for author, author_count, author_priced, author_total, author_low, author_high in authors],
+    }
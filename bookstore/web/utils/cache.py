@@ -0,0 +1,241 @@
+import hashlib
+import json
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, current_app, g, request
+
+try:
+    import redis
+except ImportError:  # optional, only needed for RESPONSE_CACHE_TYPE = 'redis'
+    redis = None
+
+
+class SimpleCacheBackend:
+    """In-process cache with per-entry TTL and LRU eviction.
+
+    Tag versions are kept apart from the entries, at most
+    `version_threshold` of them (4 * threshold by default), the least
+    recently used evicted first. A tag without a version reads the floor
+    version, raised above every version evicted: an entry built with a
+    lost version never becomes valid again.
+    """
+
+    def __init__(self, threshold=1024, version_threshold=None):
+        self.threshold = threshold
+        self.version_threshold = version_threshold or 4 * threshold
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def get_versions(self, tags):
+        with self._lock:
+            versions = []
+            for tag in tags:
+                version = self._versions.get(tag)
+                if version is None:
+                    version = self._floor
+                else:
+                    self._versions.move_to_end(tag)
+                versions.append(version)
+            return versions
+
+    def bump_versions(self, tags):
+        with self._lock:
+            versions = self._versions
+            for tag in tags:
+                versions[tag] = versions.get(tag, self._floor) + 1
+                versions.move_to_end(tag)
+            while len(versions) > self.version_threshold:
+                _, version = versions.popitem(last=False)
+                self._floor = max(self._floor, version + 1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._floor = 0
+
+
+class RedisCacheBackend:
+    """Cache shared by every worker, stored in Redis. Eviction is left to
+    the Redis ``maxmemory-policy`` (allkeys-lru recommended, tag versions
+    are stored without expiry).
+    """
+
+    def __init__(self, url, prefix='bookstore:cache:'):
+        if redis is None:
+            raise RuntimeError('RESPONSE_CACHE_TYPE = "redis" requires the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, timeout):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=int(timeout))
+
+    def get_versions(self, tags):
+        values = self.client.mget([self.prefix + 'tag:' + tag for tag in tags])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump_versions(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr(self.prefix + 'tag:' + tag)
+        pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def normalize_args(args):
+    '''
+    Return a canonical string of query params: sorted, with the json `q`
+    filters re-encoded so that formatting does not change the cache key
+    '''
+    items = []
+    for key in sorted(args.keys()):
+        for value in args.getlist(key):
+            if key == 'q':
+                try:
+                    value = json.dumps(json.loads(value), sort_keys=True, separators=(',', ':'))
+                except ValueError:
+                    pass
+            items.append((key, value))
+    return urlencode(items)
+
+
+class ResponseCache:
+    """Read-through cache of whole responses.
+
+    Entries are tagged (e.g. ``books`` for listings, ``book:<id>`` for one
+    book) and each tag has a version number which is part of the cache key.
+    Invalidating a tag bumps its version, so every entry built from it is
+    missed from then on and ages out of the backend.
+
+    A request reading from a source which may lag behind the writes (a read
+    replica) calls `hold_stale`: its response is not stored while one of
+    its tags was invalidated less than RESPONSE_CACHE_SETTLE_SECONDS ago.
+    A request which must see the latest writes calls `skip`.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESPONSE_CACHE_TYPE', 'simple')
+        app.config.setdefault('RESPONSE_CACHE_DEFAULT_TIMEOUT', 60)
+        app.config.setdefault('RESPONSE_CACHE_THRESHOLD', 1024)
+        app.config.setdefault('RESPONSE_CACHE_REDIS_URL', None)
+        app.config.setdefault('RESPONSE_CACHE_SETTLE_SECONDS', 0)
+
+        cache_type = app.config['RESPONSE_CACHE_TYPE']
+        if cache_type == 'redis':
+            backend = RedisCacheBackend(app.config['RESPONSE_CACHE_REDIS_URL'])
+        elif cache_type == 'simple':
+            backend = SimpleCacheBackend(app.config['RESPONSE_CACHE_THRESHOLD'])
+        else:
+            backend = None
+        app.extensions['response_cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('response_cache')
+
+    def make_key(self, tags):
+        versions = self.backend.get_versions(tags)
+        raw = '%s?%s|%s' % (
+            request.path,
+            normalize_args(request.args),
+            ','.join('%s=%d' % (tag, v) for tag, v in zip(tags, versions)),
+        )
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def skip(self):
+        ''' Neither serve nor store a cached response in the current request '''
+        g._response_cache_skip = True
+
+    def hold_stale(self):
+        '''
+        Do not store the response of the current request while its tags
+        settle: it may be read from data older than their invalidation
+        '''
+        g._response_cache_hold = True
+
+    def _settling(self, backend, tags):
+        return any(backend.get('settle:' + tag) for tag in tags)
+
+    def cached(self, tags, timeout=None):
+        '''
+        Decorate a view method to serve its response from the cache.
+        `tags` is called with the view keyword arguments and returns the
+        tags of the response.
+        '''
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                backend = self.backend
+                if backend is None or g.get('_response_cache_skip'):
+                    return f(*args, **kwargs)
+
+                response_tags = tuple(tags(**kwargs))
+                key = self.make_key(response_tags)
+                cached = backend.get(key)
+                if cached is not None:
+                    status, headers, body = cached
+                    # answer If-None-Match / If-Modified-Since with a 304
+                    return Response(body, status=status, headers=headers).make_conditional(request)
+
+                response = f(*args, **kwargs)
+                # error envelopes are sent with no-store (see build_response)
+                if isinstance(response, Response) and response.status_code == 200 \
+                        and not response.is_streamed and not response.cache_control.no_store \
+                        and not (g.get('_response_cache_hold') and self._settling(backend, response_tags)):
+                    backend.set(
+                        key,
+                        (response.status_code, list(response.headers.items()), response.get_data()),
+                        timeout or current_app.config['RESPONSE_CACHE_DEFAULT_TIMEOUT'],
+                    )
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate(self, *tags):
+        ''' Invalidate every cached response with one of `tags` '''
+        backend = self.backend
+        if backend is not None and tags:
+            backend.bump_versions(tags)
+            settle = current_app.config['RESPONSE_CACHE_SETTLE_SECONDS']
+            if settle:
+                for tag in tags:
+                    backend.set('settle:' + tag, True, settle)
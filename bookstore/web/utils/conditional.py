@@ -0,0 +1,75 @@
+import datetime
+import hashlib
+
+from flask import Response, request
+from sqlalchemy import func
+
+from .cache import normalize_args
+
+
+def make_etag(*parts) -> str:
+    '''
+    Return a strong ETag for the representation described by `parts`.
+    The normalized query params are always part of it, since they select
+    the content type, the filters and the page.
+    '''
+    raw = '|'.join(str(part) for part in parts + (request.path, normalize_args(request.args)))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _last_modified(*timestamps):
+    timestamps = [t for t in timestamps if t is not None]
+    if not timestamps:
+        return None
+    # HTTP dates have a one second precision
+    return max(timestamps).replace(microsecond=0, tzinfo=datetime.timezone.utc)
+
+
+def book_validators(session, model, book_id, *criteria):
+    '''
+    Return (etag, last_modified) of one book, reading only its timestamps,
+    or (None, None) if the book does not exist or does not meet `criteria`
+    '''
+    row = session.query(model.created, model.updated).filter(model.id == book_id, *criteria).first()
+    if row is None:
+        return None, None
+    created, updated = row
+    return make_etag(book_id, created, updated), _last_modified(created, updated)
+
+
+def collection_validators(query, model):
+    '''
+    Return (etag, last_modified) of the rows selected by `query`, computed
+    with a single aggregate query: row count and latest created/updated
+    timestamps change whenever a row is added, updated or removed
+    '''
+    count, created, updated = query.order_by(None).with_entities(
+        func.count(model.id), func.max(model.created), func.max(model.updated)).one()
+    return make_etag(count, created, updated), _last_modified(created, updated)
+
+
+def not_modified(etag, last_modified):
+    '''
+    Return a 304 response if the request validators match, None otherwise
+    '''
+    if etag is None:
+        return None
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        matched = last_modified <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    response = Response(status=304)
+    return add_validators(response, etag, last_modified)
+
+
+def add_validators(response, etag, last_modified):
+    ''' Set the ETag and Last-Modified headers of a response '''
+    if etag is not None:
+        response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
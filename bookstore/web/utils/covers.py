@@ -0,0 +1,52 @@
+import os
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # optional, covers are then stored as uploaded only
+    Image = None
+
+
+def derivative_key(key, name):
+    ''' Return the S3 key of the derivative `name` of the cover `key` '''
+    return '%s/%s.jpg' % (key.rsplit('.', 1)[0], name)
+
+
+def _rgb(image):
+    # JPEG has no alpha: transparent covers are flattened on white
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def make_derivatives(path, sizes, quality=85, spool_dir=None):
+    '''
+    Decode the image `path` once and write a JPEG of it for each
+    {name: (width, height)} of `sizes`, fitting in the box (never
+    enlarged). The largest is made first and each smaller one is resized
+    from the previous. Return {name: path of the derivative}.
+    '''
+    if Image is None:
+        raise RuntimeError('cover derivatives require the Pillow package')
+    boxes = sorted(sizes.items(), key=lambda item: item[1][0] * item[1][1], reverse=True)
+    with Image.open(path) as image:
+        # JPEG: decode directly at the smallest scale still larger than needed
+        image.draft('RGB', (max(w for _, (w, _) in boxes), max(h for _, (_, h) in boxes)))
+        image = _rgb(image)
+
+    derivatives = {}
+    try:
+        for name, size in boxes:
+            image.thumbnail(size, Image.LANCZOS, reducing_gap=3.0)
+            fd, derivative_path = tempfile.mkstemp(suffix='.jpg', prefix='cover-%s-' % name, dir=spool_dir)
+            derivatives[name] = derivative_path
+            with os.fdopen(fd, 'wb') as out:
+                image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+    except Exception:
+        for derivative_path in derivatives.values():
+            os.remove(derivative_path)
+        raise
+    return derivatives
@@ -0,0 +1,120 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# Engine options which only apply to a queue of connections
+QUEUE_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+class PoolMetrics:
+    """Counters of a connection pool, fed by its events. Checkout wait is
+    the time spent waiting for a free connection (or opening a new one).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe_wait(self, seconds):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def reset(self):
+        with self._lock:
+            self.wait_total = self.wait_max = 0.0
+            self.connects = self.checkouts = self.checkins = self.invalidations = self.timeouts = 0
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(1000 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(1000 * self.wait_max, 3),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording its events and checkout wait time in `metrics`,
+    kept when the pool is recreated (engine.dispose())."""
+
+    # log with the pools of SQLAlchemy, not under the app logger ('web')
+    _sqla_logger_namespace = 'sqlalchemy.pool.impl.InstrumentedQueuePool'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        metrics = self.metrics = PoolMetrics()
+        if '_dispatch' in kwargs:
+            # recreate() copied the listeners, see below
+            return
+        event.listen(self, 'connect', lambda *args: metrics.count('connects'))
+        event.listen(self, 'checkout', lambda *args: metrics.count('checkouts'))
+        event.listen(self, 'checkin', lambda *args: metrics.count('checkins'))
+        event.listen(self, 'invalidate', lambda *args: metrics.count('invalidations'))
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.count('timeouts')
+            raise
+        finally:
+            self.metrics.observe_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        # the listeners copied to the new pool feed these metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def configure_engine_options(app):
+    '''
+    Complete SQLALCHEMY_ENGINE_OPTIONS of `app` with the instrumented pool.
+    SQLite in memory runs on a single static connection: the options of a
+    queue of connections are dropped.
+    '''
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        for name in QUEUE_OPTIONS:
+            options.pop(name, None)
+    else:
+        options.setdefault('poolclass', InstrumentedQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def pool_status(pool):
+    ''' Return the sizes of `pool` and, if instrumented, its metrics '''
+    status = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout(),
+        })
+    metrics = getattr(pool, 'metrics', None)
+    if metrics is not None:
+        status.update(metrics.to_json())
+    return status
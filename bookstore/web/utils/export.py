@@ -0,0 +1,79 @@
+import csv
+import io
+from itertools import islice
+
+from flask import Response, current_app, stream_with_context
+
+from .serializer import get_serializer
+
+#: Export formats (contentType) and their mimetypes
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def get_export_format(args):
+    '''
+    Return the export format asked by the query params (contentType=ndjson
+    or csv), or None
+    '''
+    content_type = args.get('contentType')
+    return content_type if content_type in EXPORT_FORMATS else None
+
+
+def stream_rows(query, model, columns, chunk_size=500):
+    '''
+    Return the `columns` of the rows of `query` in id order, fetched from a
+    server-side cursor `chunk_size` rows at a time. The rows are plain
+    tuples: no model instance is built.
+    '''
+    return query.with_entities(*[getattr(model, column) for column in columns]) \
+        .order_by(None).order_by(model.id.asc()) \
+        .execution_options(stream_results=True).yield_per(chunk_size)
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _ndjson(rows, columns, chunk_size):
+    dumps = get_serializer(current_app.config.get('JSON_SERIALIZER', 'auto'))
+    for chunk in _chunks(rows, chunk_size):
+        yield b''.join([dumps(dict(zip(columns, row)), False) + b'\n' for row in chunk])
+
+
+def _csv(rows, columns, chunk_size):
+    # None is written as an empty cell, datetimes as in the JSON responses
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_export(rows, columns, export_format, chunk_size=500):
+    '''
+    Encode the `rows` (tuples of the `columns`) in `export_format`: one JSON
+    object per line (ndjson) or a CSV file with a header row. Yield bytes,
+    `chunk_size` rows at a time.
+    '''
+    encode = _csv if export_format == 'csv' else _ndjson
+    return encode(rows, tuple(columns), chunk_size)
+
+
+def build_export_response(rows, columns, export_format, chunk_size=500) -> Response:
+    ''' Return a streamed response of the `rows` exported in `export_format` '''
+    return Response(
+        stream_with_context(iter_export(rows, columns, export_format, chunk_size)),
+        status=200, mimetype=EXPORT_FORMATS[export_format])
@@ -0,0 +1,32 @@
+from sqlalchemy.orm import load_only
+
+
+class InvalidFields(ValueError):
+    """Raised when ``fields`` names an attribute the model does not expose."""
+    pass
+
+
+def get_fields(args, allowed):
+    '''
+    Parse the sparse fieldset query param, e.g. fields=id,title,price.
+    Return the requested fields in the order of `allowed`, or None when
+    every field is wanted.
+    '''
+    if not args.get('fields'):
+        return None
+    requested = set(field.strip() for field in args['fields'].split(',') if field.strip())
+    if not requested or not requested.issubset(allowed):
+        raise InvalidFields('fields is invalid')
+    return tuple(field for field in allowed if field in requested)
+
+
+def project(query, model, fields, *required):
+    '''
+    Restrict the columns loaded by `query` to `fields` plus the `required`
+    ones (primary key, sort key), so unused columns such as long texts are
+    never read from the database.
+    '''
+    if fields is None:
+        return query
+    columns = set(fields) | set(required) | {'id'}
+    return query.options(load_only(*[getattr(model, column) for column in sorted(columns)]))
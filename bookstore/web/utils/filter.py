@@ -2,6 +2,7 @@
 from functools import lru_cache
 import inspect
 
+from sqlalchemy import bindparam
 from sqlalchemy.orm import Query
 from sqlalchemy.orm import ColumnProperty
 from sqlalchemy.orm import aliased
@@ -38,6 +39,11 @@ def primary_key_names(model):
             and isinstance(field.property, ColumnProperty)
             and field.property.columns[0].primary_key]
 
+@lru_cache()
+def primary_key_order(model):
+    """Returns the ascending order by clauses on the primary keys of a model."""
+    return tuple(getattr(model, field).asc() for field in primary_key_names(model))
+
 
 class Error(Exception):
     http_code = 500
@@ -95,6 +101,14 @@ OPERATORS = {
     'not_in': lambda f, a: ~f.in_(a),
 }
 
+#: The number of arguments accepted by each function in :data:`OPERATORS`,
+#: computed once at import time instead of on every filter.
+OPERATOR_ARITY = {name: len(inspect.getfullargspec(opfunc).args)
+                  for name, opfunc in OPERATORS.items()}
+
+#: Maximum number of compiled filter plans kept by :func:`compile_filters`.
+FILTER_PLAN_CACHE_SIZE = 256
+
 class UnknownField(Exception):
     """Raised when the user attempts to reference a field that does not
     exist on a model in a search.
@@ -173,7 +187,7 @@ def create_operation(model, fieldname, operator, argument):
     """
     # raises KeyError if operator not in OPERATORS
     opfunc = OPERATORS[operator]
-    numargs = len(inspect.getfullargspec(opfunc).args)
+    numargs = OPERATOR_ARITY[operator]
     # raises AttributeError if `fieldname` does not exist
     field = getattr(model, fieldname)
     # each of these will raise a TypeError if the wrong number of argments
@@ -188,6 +202,38 @@ def create_operation(model, fieldname, operator, argument):
     return opfunc(field, argument, fieldname)
 
 
+def argument_shape(operator, argument):
+    """Returns the part of a filter argument which changes the shape of the
+    SQL expression: ``None`` for operators without argument or ``NULL``
+    arguments, ``'list'`` for sequences and ``'scalar'`` otherwise.
+    """
+    # raises KeyError if operator not in OPERATORS
+    if OPERATOR_ARITY[operator] == 1 or argument is None:
+        return None
+    if isinstance(argument, (list, tuple, set)):
+        return 'list'
+    return 'scalar'
+
+
+@lru_cache(maxsize=FILTER_PLAN_CACHE_SIZE)
+def compile_filters(model, spec):
+    """Returns a tuple of SQLAlchemy criteria for a normalized filter `spec`.
+    `spec` is a tuple of ``(fieldname, operator, shape)`` triples as built
+    by :func:`search`. The argument of the i-th filter is left as the bind
+    parameter ``filter_<i>``, so the same plan is reused by every search
+    which only differs in the filter values.
+    Raises the same errors as :func:`create_operation`.
+    """
+    criteria = []
+    for i, (fieldname, operator, shape) in enumerate(spec):
+        if shape is None:
+            argument = None
+        else:
+            argument = bindparam('filter_%d' % i, expanding=(shape == 'list'))
+        criteria.append(create_operation(model, fieldname, operator, argument))
+    return tuple(criteria)
+
+
 def search(session, model, filters=None):
     """Returns a SQLAlchemy query instance with the specified parameters.
     Each instance in the returned query meet the requirements specified by
@@ -201,6 +247,9 @@ def search(session, model, filters=None):
     `model` is the SQLAlchemy model on which to create a query.
     
     When building the query, filters are applied first, then sorting.
+    The filter expressions are taken from :func:`compile_filters`, so they
+    are only built once per distinct set of fields, operators and argument
+    shapes.
     Raises :exc:`UnknownField` if one of the named fields given in one
     of the `filters` does not exist on the `model`.
     Raises one of :exc:`AttributeError`, :exc:`KeyError`, or :exc:`TypeError`
@@ -210,19 +259,22 @@ def search(session, model, filters=None):
 
     try:
         # Filter the query.
-        filters = [Filter.from_dictionary(model, f) for f in filters]
+        filters = [Filter.from_dictionary(model, f) for f in filters or []]
+        spec = tuple((f.fieldname, f.operator, argument_shape(f.operator, f.argument))
+                     for f in filters)
 
         # This function call may raise an exception.
-        filters = [create_filter(model, f) for f in filters]
+        criteria = compile_filters(model, spec)
     except UnknownField as e:
         raise BadRequest(cause=e, details=f'Invalid filter object: No such field "{e.field}"') from e
     except Exception as e:
         raise BadRequest(cause=e, details='Unable to construct query') from e
 
-    query = query.filter(*filters)
+    params = {'filter_%d' % i: list(f.argument) if shape == 'list' else f.argument
+              for i, (f, (_, _, shape)) in enumerate(zip(filters, spec))
+              if shape is not None}
+    query = query.filter(*criteria).params(**params)
     
-    pks = primary_key_names(model)
-    pk_order = (getattr(model, field).asc() for field in pks)
-    query = query.order_by(*pk_order)
+    query = query.order_by(*primary_key_order(model))
 
-    return query
\ No newline at end of file
+    return query
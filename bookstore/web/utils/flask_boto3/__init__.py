@@ -1,15 +1,22 @@
+import os
+import threading
+
 import boto3
+from botocore.config import Config
 from botocore.exceptions import UnknownServiceError
 from flask import _app_ctx_stack as stack
 from flask import current_app
 
 
 class Boto3(object):
-    """Stores a bunch of boto3 conectors inside Flask's application context
-    for easier handling inside view functions.
-    
-    All connectors are stored inside the dict `boto3_cns` where the keys are
-    the name of the services and the values their associated boto3 client.
+    """Stores a bunch of boto3 connectors for easier handling inside view
+    functions.
+
+    Clients are thread-safe: they are created once per process, on first
+    use, and shared by every request and thread, with a connection pool of
+    BOTO3_MAX_POOL_CONNECTIONS connections. Resources are not thread-safe:
+    they are created inside Flask's application context and closed with
+    it.
     """
 
     def __init__(self, app=None):
@@ -18,86 +25,122 @@ class Boto3(object):
             self.init_app(app)
 
     def init_app(self, app):
+        app.config.setdefault('BOTO3_MAX_POOL_CONNECTIONS', 10)
+        app.extensions['boto3'] = {
+            'lock': threading.Lock(),
+            'pid': None,
+            'clients': {},
+        }
         app.teardown_appcontext(self.teardown)
 
-    def connect(self):
-        """Iterate through the application configuration and instantiate
-        the services.
-        """
-        requested_services = set(
-            svc.lower() for svc in current_app.config.get('BOTO3_SERVICES', [])
-        )
+    def _params(self, svc, sess_params):
+        """Return the args and kwargs of the client or resource of `svc`"""
+        # Check for optional parameters
+        params = current_app.config.get(
+            'BOTO3_OPTIONAL_PARAMS', {}
+        ).get(svc, {})
+
+        # Get session params and override them with kwargs
+        # `profile_name` cannot be passed to clients and resources
+        kwargs = sess_params.copy()
+        kwargs.update(params.get('kwargs', {}))
+        del kwargs['profile_name']
+
+        # Override the region if one is defined as an argument
+        args = params.get('args', [])
+        if len(args) >= 1:
+            del kwargs['region_name']
+
+        if not(isinstance(args, list) or isinstance(args, tuple)):
+            args = [args]
 
-        region = current_app.config.get('BOTO3_REGION')
-        sess_params = {
+        # Size the connection pool, keeping any other client setting
+        pool_config = Config(max_pool_connections=current_app.config['BOTO3_MAX_POOL_CONNECTIONS'])
+        if kwargs.get('config') is not None:
+            pool_config = pool_config.merge(kwargs['config'])
+        kwargs['config'] = pool_config
+        return args, kwargs
+
+    def _session_params(self):
+        return {
             'aws_access_key_id': current_app.config.get('BOTO3_ACCESS_KEY'),
             'aws_secret_access_key': current_app.config.get('BOTO3_SECRET_KEY'),
             'profile_name': current_app.config.get('BOTO3_PROFILE'),
-            'region_name': region
+            'region_name': current_app.config.get('BOTO3_REGION')
         }
+
+    def _requested_services(self):
+        return set(
+            svc.lower() for svc in current_app.config.get('BOTO3_SERVICES', [])
+        )
+
+    def connect(self):
+        """Iterate through the application configuration and instantiate
+        the clients of the services.
+        """
+        sess_params = self._session_params()
         sess = boto3.session.Session(**sess_params)
 
         try:
             cns = {}
-            for svc in requested_services:
-                # Check for optional parameters
-                params = current_app.config.get(
-                    'BOTO3_OPTIONAL_PARAMS', {}
-                ).get(svc, {})
-
-                # Get session params and override them with kwargs
-                # `profile_name` cannot be passed to clients and resources
-                kwargs = sess_params.copy()
-                kwargs.update(params.get('kwargs', {}))
-                del kwargs['profile_name']
-
-                # Override the region if one is defined as an argument
-                args = params.get('args', [])
-                if len(args) >= 1:
-                    del kwargs['region_name']
-
-                if not(isinstance(args, list) or isinstance(args, tuple)):
-                    args = [args]
-
-                # Create resource or client
-                if svc in sess.get_available_resources():
-                    cns.update({svc: sess.resource(svc, *args, **kwargs)})
-                else:
-                    cns.update({svc: sess.client(svc, *args, **kwargs)})
+            for svc in self._requested_services():
+                args, kwargs = self._params(svc, sess_params)
+                cns.update({svc: sess.client(svc, *args, **kwargs)})
         except UnknownServiceError:
             raise
         return cns
 
+    def connect_resources(self):
+        """Instantiate the resources of the services which have one"""
+        sess_params = self._session_params()
+        sess = boto3.session.Session(**sess_params)
+        available = sess.get_available_resources()
+        cns = {}
+        for svc in self._requested_services():
+            if svc in available:
+                args, kwargs = self._params(svc, sess_params)
+                cns.update({svc: sess.resource(svc, *args, **kwargs)})
+        return cns
+
     def teardown(self, exception):
         ctx = stack.top
-        if hasattr(ctx, 'boto3_cns'):
-            for c in ctx.boto3_cns:
-                con = ctx.boto3_cns[c]
-                if hasattr(con, 'close') and callable(con.close):
-                    ctx.boto3_cns[c].close()
+        if hasattr(ctx, 'boto3_resources'):
+            for c in ctx.boto3_resources:
+                client = ctx.boto3_resources[c].meta.client
+                if hasattr(client, 'close') and callable(client.close):
+                    client.close()
 
     @property
     def resources(self):
-        c = self.connections
-        return {k: v for k, v in c.items() if hasattr(c[k].meta, 'client')}
+        ctx = stack.top
+        if ctx is not None:
+            if not hasattr(ctx, 'boto3_resources'):
+                ctx.boto3_resources = self.connect_resources()
+            return ctx.boto3_resources
 
     @property
     def clients(self):
         """
-        Get all clients (with and without associated resources)
+        Get the clients of all the services, shared by the process
         """
-        clients = {}
-        for k, v in self.connections.items():
-            if hasattr(v.meta, 'client'):       # has boto3 resource
-                clients[k] = v.meta.client
-            else:                               # no boto3 resource
-                clients[k] = v
-        return clients
+        state = current_app.extensions['boto3']
+        # the connections of a client must not be shared with a forked child
+        if state['pid'] != os.getpid():
+            with state['lock']:
+                if state['pid'] != os.getpid():
+                    state['clients'] = self.connect()
+                    state['pid'] = os.getpid()
+        return state['clients']
 
     @property
     def connections(self):
-        ctx = stack.top
-        if ctx is not None:
-            if not hasattr(ctx, 'boto3_cns'):
-                ctx.boto3_cns = self.connect()
-            return ctx.boto3_cns
+        return self.clients
+
+    def reset(self):
+        """Close the clients, the next use creates new ones"""
+        state = current_app.extensions['boto3']
+        with state['lock']:
+            for client in state['clients'].values():
+                client.close()
+            state['clients'] = {}
+            state['pid'] = None
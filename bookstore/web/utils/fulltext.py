@@ -0,0 +1,107 @@
+import re
+
+from sqlalchemy import DDL, Column, Integer, MetaData, Table, Text, event, false, func, literal_column, or_, select
+from sqlalchemy.dialects.mysql import match
+
+#: Name of the MySQL FULLTEXT index on books(title, description)
+FULLTEXT_INDEX_NAME = 'ix_books_fulltext'
+
+#: SQLite FTS5 table mirroring books(title, description), keyed by the book id.
+#: It lives in its own metadata so that ``db.create_all`` does not try to
+#: create it as an ordinary table.
+books_fts = Table(
+    'books_fts', MetaData(),
+    Column('rowid', Integer, primary_key=True),
+    Column('title', Text),
+    Column('description', Text),
+)
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def setup_book_index(table):
+    '''
+    Create the full-text index together with the `books` table:
+    a FULLTEXT index on MySQL, a FTS5 virtual table on SQLite.
+    '''
+    event.listen(table, 'after_create', DDL(
+        f'ALTER TABLE {table.name} ADD FULLTEXT INDEX {FULLTEXT_INDEX_NAME} (title, description)'
+    ).execute_if(dialect='mysql'))
+    event.listen(table, 'after_create', DDL(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {books_fts.name} USING fts5(title, description)'
+    ).execute_if(dialect='sqlite'))
+    event.listen(table, 'before_drop', DDL(
+        f'DROP TABLE IF EXISTS {books_fts.name}'
+    ).execute_if(dialect='sqlite'))
+
+
+def _dialect(session):
+    return session.connection().dialect.name
+
+
+def _fts5_query(terms):
+    # Quote every word so user input can never be parsed as FTS5 syntax
+    return ' '.join('"%s"' % word for word in _WORD_RE.findall(terms))
+
+
+def search_books(session, query, model, terms):
+    '''
+    Restrict `query` to books matching the full-text `terms`.
+    Return (query, rank) where `rank` is a SQL expression, higher is more
+    relevant.
+    '''
+    dialect = _dialect(session)
+    if dialect == 'mysql':
+        rank = match(model.title, model.description, against=terms).in_natural_language_mode()
+        return query.filter(rank > 0), rank
+    if dialect == 'sqlite':
+        terms = _fts5_query(terms)
+        if not terms:
+            return query.filter(false()), literal_column('0')
+        query = query.join(books_fts, books_fts.c.rowid == model.id) \
+            .filter(literal_column(books_fts.name).match(terms))
+        # bm25() is smaller for better matches
+        rank = -func.bm25(literal_column(books_fts.name))
+        return query, rank
+    # No full-text support: fall back to a plain (unranked) substring search
+    pattern = '%' + terms + '%'
+    return query.filter(or_(model.title.ilike(pattern), model.description.ilike(pattern))), literal_column('0')
+
+
+def index_book(session, book):
+    '''
+    Add or refresh `book` in the full-text index, inside the current
+    transaction. MySQL maintains its FULLTEXT index by itself.
+    '''
+    if _dialect(session) != 'sqlite':
+        return
+    session.execute(books_fts.delete().where(books_fts.c.rowid == book.id))
+    session.execute(books_fts.insert().values(
+        rowid=book.id, title=book.title or '', description=book.description or ''))
+
+
+def index_last_books(session, model, count):
+    '''
+    Add the `count` books inserted last to the full-text index, inside the
+    transaction which inserted them: SQLite has a single writer, so no other
+    book got an id since. For the bulk INSERTs, whose ids are not returned.
+    '''
+    if _dialect(session) != 'sqlite' or not count:
+        return
+    last = select(model.id, func.coalesce(model.title, ''), func.coalesce(model.description, '')) \
+        .order_by(model.id.desc()).limit(count)
+    session.execute(books_fts.insert().from_select(['rowid', 'title', 'description'], last))
+
+
+def unindex_books(session, model, book_ids=None, author_id=None):
+    '''
+    Remove books from the full-text index, either by id or every book of
+    an author. Must be called before the books themselves are deleted.
+    '''
+    if _dialect(session) != 'sqlite':
+        return
+    if book_ids is not None:
+        session.execute(books_fts.delete().where(books_fts.c.rowid.in_(book_ids)))
+    if author_id is not None:
+        session.execute(books_fts.delete().where(books_fts.c.rowid.in_(
+            select(model.id).where(model.author_id == author_id))))
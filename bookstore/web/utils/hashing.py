@@ -0,0 +1,114 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from itertools import repeat
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+class HashingPoolFull(Exception):
+    """Raised when too many password hashes are already queued, or one did
+    not complete in time. Reported to the client as a 503.
+    """
+    pass
+
+
+class PasswordHasher:
+    """Computes PBKDF2 password hashes in a bounded pool of worker processes,
+    so that a burst of logins does not hold the request threads (and the
+    GIL) for the whole computation.
+
+    With PASSWORD_HASH_WORKERS = 0 the hashes are computed inline.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:%d' % DEFAULT_PBKDF2_ITERATIONS)
+        app.config.setdefault('PASSWORD_HASH_SALT_LENGTH', 16)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 0)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', 32)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)
+
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.salt_length = app.config['PASSWORD_HASH_SALT_LENGTH']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_MAX_PENDING'])
+
+    def _get_pool(self):
+        # A pool inherited through fork() is not usable: one per process
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        # fail fast instead of queueing requests behind a saturated pool
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolFull('too many password hashes pending')
+        try:
+            future = self._get_pool().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError as e:
+            future.cancel()
+            raise HashingPoolFull('password hash timed out') from e
+
+    def generate(self, password):
+        ''' Return the hash of `password` with the configured parameters '''
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def generate_many(self, passwords):
+        '''
+        Return the hashes of `passwords`, in order. They are submitted in
+        sub-batches of one password per worker, each taking a pending slot
+        of its own, so that logins are queued behind at most one sub-batch.
+        '''
+        passwords = list(passwords)
+        if not self.workers or len(passwords) < 2:
+            return [self.generate(password) for password in passwords]
+        hashes = []
+        for start in range(0, len(passwords), self.workers):
+            batch = passwords[start:start + self.workers]
+            # wait for a slot: a batch is not worth failing for a short burst
+            if not self._slots.acquire(timeout=self.timeout):
+                raise HashingPoolFull('too many password hashes pending')
+            try:
+                results = self._get_pool().map(
+                    generate_password_hash, batch, repeat(self.method), repeat(self.salt_length),
+                    timeout=self.timeout)
+                hashes.extend(results)
+            except TimeoutError as e:
+                raise HashingPoolFull('password hashes timed out') from e
+            finally:
+                self._slots.release()
+        return hashes
+
+    def verify(self, password_hash, password):
+        ''' Return True if `password` matches `password_hash` '''
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        ''' Return True if `password_hash` was made with other parameters '''
+        return password_hash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g
+
+
+class Identity:
+    """What the JWT protected endpoints need to know about the current user:
+    its id, the permissions of its role and its public json.
+    """
+    __slots__ = ('user_id', 'permissions', 'data')
+
+    def __init__(self, user_id, permissions, data):
+        self.user_id = user_id
+        self.permissions = permissions or 0
+        self.data = data
+
+    def can(self, perm):
+        return self.permissions & perm == perm
+
+    def __repr__(self):
+        return '<Identity: {}>'.format(self.user_id)
+
+
+class IdentityCache:
+    """Two level cache of identities keyed by (user id, token id): one for
+    the current request (flask.g) and one for the process with a TTL and
+    LRU eviction.
+
+    Invalidating a user bumps its generation: every entry loaded before is
+    ignored. Invalidating the roles bumps the generation of every user.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_TTL', 60)
+        app.config.setdefault('IDENTITY_CACHE_SIZE', 4096)
+        app.config.setdefault('ROLE_VERSIONS_TTL', 30)
+        app.extensions['identity_cache'] = {
+            'entries': OrderedDict(),
+            'generations': {},
+            'roles_generation': 0,
+            'role_versions': (0, None),
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['identity_cache']
+
+    def _generation(self, state, user_id):
+        return (state['roles_generation'], state['generations'].get(user_id, 0))
+
+    def get(self, user_id, token_id, loader):
+        '''
+        Return the identity of `user_id` for the token `token_id`,
+        calling `loader(user_id)` on a miss. Missing users (None) are not
+        cached.
+        '''
+        key = (user_id, token_id)
+        request_cache = g.setdefault('_identities', {})
+        if key in request_cache:
+            return request_cache[key]
+
+        state = self._state
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation(state, user_id)
+            item = state['entries'].get(key)
+            if item is not None:
+                expires, item_generation, identity = item
+                if expires >= now and item_generation == generation:
+                    state['entries'].move_to_end(key)
+                    request_cache[key] = identity
+                    return identity
+                del state['entries'][key]
+
+        identity = loader(user_id)
+        if identity is not None:
+            with self._lock:
+                entries = state['entries']
+                entries[key] = (now + current_app.config['IDENTITY_CACHE_TTL'], generation, identity)
+                while len(entries) > current_app.config['IDENTITY_CACHE_SIZE']:
+                    entries.popitem(last=False)
+        request_cache[key] = identity
+        return identity
+
+    def invalidate(self, user_id):
+        ''' Forget the cached identities of a user, e.g. after it changed '''
+        state = self._state
+        with self._lock:
+            state['generations'][user_id] = state['generations'].get(user_id, 0) + 1
+        g.pop('_identities', None)
+
+    def role_versions(self, loader):
+        '''
+        Return the {role id: version} map of every role, as returned by
+        `loader()` at most ROLE_VERSIONS_TTL seconds ago. The roles table is
+        tiny and rarely changes, so every process keeps all of it.
+        '''
+        state = self._state
+        expires, versions = state['role_versions']
+        now = time.monotonic()
+        if versions is None or expires < now:
+            versions = loader()
+            with self._lock:
+                state['role_versions'] = (now + current_app.config['ROLE_VERSIONS_TTL'], versions)
+        return versions
+
+    def invalidate_roles(self):
+        ''' Forget every cached identity, e.g. after role permissions changed '''
+        state = self._state
+        with self._lock:
+            state['roles_generation'] += 1
+            state['role_versions'] = (0, None)
+        g.pop('_identities', None)
@@ -0,0 +1,143 @@
+import base64
+import binascii
+import datetime
+import json
+
+from sqlalchemy import and_, or_
+from sqlalchemy.types import Date, DateTime
+
+
+class InvalidPageArgument(ValueError):
+    """Raised when ``limit``, ``after`` or ``sort`` can not be used to
+    paginate a query.
+    """
+    pass
+
+
+def encode_cursor(sort, value, pk):
+    '''
+    Return an opaque cursor pointing right after the row with sort key
+    `value` and primary key `pk`
+    '''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, column):
+    '''
+    Return (value, pk) stored in a cursor made by `encode_cursor`.
+    The cursor must have been built for the same `sort` key.
+    '''
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        _sort, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise InvalidPageArgument('cursor is invalid') from e
+    if _sort != sort or not isinstance(pk, int):
+        raise InvalidPageArgument('cursor is invalid')
+    if value is not None:
+        try:
+            if isinstance(column.type, DateTime):
+                value = datetime.datetime.fromisoformat(value)
+            elif isinstance(column.type, Date):
+                value = datetime.date.fromisoformat(value)
+        except (ValueError, TypeError) as e:
+            raise InvalidPageArgument('cursor is invalid') from e
+    return value, pk
+
+
+def get_page_args(args, default_limit, max_limit, sortable=('id',)):
+    '''
+    Parse `limit`, `after` and `sort` query params.
+    `sort` is a column name, prefixed by "-" for descending order.
+    '''
+    try:
+        limit = int(args.get('limit', default_limit))
+    except (TypeError, ValueError) as e:
+        raise InvalidPageArgument('limit is invalid') from e
+    if limit < 1:
+        raise InvalidPageArgument('limit is invalid')
+    limit = min(limit, max_limit)
+
+    sort = args.get('sort') or 'id'
+    if sort.lstrip('-') not in sortable:
+        raise InvalidPageArgument('sort is invalid')
+
+    after = args.get('after') or None
+    return limit, after, sort
+
+
+def page_query(query, model, limit, after=None, sort='id'):
+    '''
+    Return `query` ordered by (sort key, id) and restricted to the rows
+    after the cursor `after`, with one row more than `limit` to know
+    whether there is a next page. NULL sort keys come first in ascending
+    order and last in descending order, as MySQL and SQLite sort them.
+    '''
+    descending = sort.startswith('-')
+    key = sort.lstrip('-')
+    column = getattr(model, key)
+    pk = model.id
+
+    if key == 'id':
+        order = [pk.desc() if descending else pk.asc()]
+    else:
+        order = [column.desc() if descending else column.asc(),
+                 pk.desc() if descending else pk.asc()]
+    query = query.order_by(None).order_by(*order)
+
+    if after is not None:
+        value, last_id = decode_cursor(after, sort, column)
+        if key == 'id':
+            query = query.filter(pk < last_id if descending else pk > last_id)
+        elif value is None:
+            # `column > NULL` matches nothing: the rows after a NULL key
+            if descending:
+                query = query.filter(column.is_(None), pk < last_id)
+            else:
+                query = query.filter(or_(column.isnot(None), and_(column.is_(None), pk > last_id)))
+        elif descending:
+            query = query.filter(or_(column < value, column.is_(None), and_(column == value, pk < last_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, pk > last_id)))
+    return query.limit(limit + 1)
+
+
+def paginate(query, model, limit, after=None, sort='id'):
+    '''
+    Return one page of `query` as (items, next_cursor) using keyset
+    pagination on (sort key, id), so the cost of a page does not depend on
+    how deep it is. `next_cursor` is None on the last page.
+    '''
+    key = sort.lstrip('-')
+    items = page_query(query, model, limit, after, sort).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(sort, getattr(last, key), last.id)
+    return items, next_cursor
+
+
+def paginate_by_rank(query, model, rank, limit, after=None):
+    '''
+    Return one page of `query` ordered by the SQL expression `rank`
+    (most relevant first, then id) as (items, next_cursor).
+    '''
+    pk = model.id
+    query = query.order_by(None).order_by(rank.desc(), pk.asc())
+    if after is not None:
+        value, last_id = decode_cursor(after, 'rank', pk)
+        if not isinstance(value, (int, float)):
+            raise InvalidPageArgument('cursor is invalid')
+        query = query.filter(or_(rank < value, and_(rank == value, pk > last_id)))
+
+    rows = query.add_columns(rank.label('rank')).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, last_rank = rows[-1]
+        next_cursor = encode_cursor('rank', float(last_rank), last.id)
+    return [item for item, _ in rows], next_cursor
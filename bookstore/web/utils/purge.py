@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
+
+from .fulltext import unindex_books
+
+logger = logging.getLogger(__name__)
+
+
+def purge_user(session, user_model, book_model, user_id, chunk_size=500, pause=0.0, progress=None):
+    '''
+    Delete the deleted user `user_id` (deleted_at set) and its books,
+    `chunk_size` books per transaction in id order, sleeping `pause`
+    seconds between them: each transaction locks a bounded number of rows
+    of the books table, whatever the size of the catalog. Stopped at any
+    point, it resumes where it was from the books left.
+    `progress(book ids)` is called after each committed chunk.
+    Return the number of books deleted, or None if the user is not deleted.
+    '''
+    user = session.query(user_model.id) \
+        .filter(user_model.id == user_id, user_model.deleted_at.isnot(None)).first()
+    if user is None:
+        return None
+    deleted, after = 0, 0
+    while True:
+        # keyset order on (author_id, id): no scan of the chunks deleted before
+        book_ids = [book_id for (book_id,) in session.query(book_model.id)
+                    .filter(book_model.author_id == user_id, book_model.id > after)
+                    .order_by(book_model.id).limit(chunk_size)]
+        if book_ids:
+            unindex_books(session, book_model, book_ids=book_ids)
+            session.query(book_model).filter(book_model.id.in_(book_ids)) \
+                .delete(synchronize_session=False)
+            session.commit()
+            deleted, after = deleted + len(book_ids), book_ids[-1]
+            if progress is not None:
+                progress(book_ids)
+            if pause:
+                time.sleep(pause)
+            continue
+        try:
+            # not while it has books, even where no foreign key is enforced
+            removed = session.query(user_model).filter(
+                user_model.id == user_id, ~exists().where(book_model.author_id == user_id)) \
+                .delete(synchronize_session=False)
+            session.commit()
+            if removed:
+                return deleted
+        except IntegrityError:
+            session.rollback()
+        # a book was published meanwhile: purge it too
+
+
+class AccountPurger:
+    """Purges the deleted accounts in a background thread, so that deleting
+    a user with a large catalog returns at once (see `purge_user`).
+
+    With ACCOUNT_PURGE_WORKERS = 0 the purges run inline in `submit`. The
+    accounts left deleted (e.g. the process stopped) are purged by the
+    ``flask purge-users`` command.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._futures = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ACCOUNT_PURGE_WORKERS', 1)
+        app.config.setdefault('ACCOUNT_PURGE_CHUNK_SIZE', 500)
+        app.config.setdefault('ACCOUNT_PURGE_PAUSE', 0.05)
+
+    def _get_pool(self, workers):
+        # threads do not survive fork(): one pool per process
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='account-purge')
+                self._pool_pid = os.getpid()
+                self._futures = set()
+            return self._pool
+
+    def submit(self, purge, user_id):
+        '''
+        Queue `purge(user_id)`, which runs in an app context of its own
+        '''
+        app = current_app._get_current_object()
+        workers = app.config['ACCOUNT_PURGE_WORKERS']
+        if not workers:
+            self._purge(purge, user_id)
+            return None
+        future = self._get_pool(workers).submit(self._run, app, purge, user_id)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _run(self, app, *args):
+        with app.app_context():
+            return self._purge(*args)
+
+    def _purge(self, purge, user_id):
+        try:
+            return purge(user_id)
+        except Exception:
+            logger.exception('purge of user %s failed, it is resumed by flask purge-users', user_id)
+            return None
+
+    def wait(self, timeout=None):
+        ''' Wait for the queued purges, return True if none is left '''
+        with self._lock:
+            futures = set(self._futures)
+        done, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,288 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlparse
+
+import limits
+from limits.errors import ConfigurationError
+from limits.storage import Storage
+
+try:
+    from limits.storage.base import SlidingWindowCounterSupport
+except ImportError:  # limits < 4.1: fixed window strategy only
+    SlidingWindowCounterSupport = object
+
+logger = logging.getLogger(__name__)
+
+# File header: magic, layout version, number of buckets, slots per bucket
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 64
+MAGIC = b'BKRL'
+LAYOUT_VERSION = 1
+
+# Slot: key digest, last access time, expiry time, counter, counter of the
+# previous window (sliding window counter only)
+SLOT = struct.Struct('<16sddqq')
+EMPTY = bytes(16)
+
+# Locks guard bucket % LOCK_STRIPES: a thread lock inside the process and
+# the byte `stripe` of the file between processes
+LOCK_STRIPES = 64
+
+
+class SharedMemoryStorage(Storage, SlidingWindowCounterSupport):
+    """Rate limit counters in a fixed size hash table mapped in shared
+    memory, so every worker process of the host counts against the same
+    limits without a network round trip.
+
+    Keys hash to a bucket of `ways` slots; a key missing from a full bucket
+    takes the slot of an expired key, or else of the least recently used
+    one. The memory used is buckets * ways * 48 bytes, whatever the number
+    of clients.
+
+    ``mmap:///path/to/file?buckets=16384&ways=8`` shares the table between
+    all the processes opening the file. ``mmap://`` uses an anonymous file,
+    shared with the processes forked after the app was created.
+    """
+
+    STORAGE_SCHEME = ['mmap']
+
+    def __init__(self, uri=None, wrap_exceptions=False, buckets=16384, ways=8, **options):
+        parsed = urlparse(uri or 'mmap://')
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        self.buckets = int(query.get('buckets', buckets))
+        self.ways = int(query.get('ways', ways))
+        if self.buckets < 1 or self.ways < 1:
+            raise ConfigurationError('mmap storage needs at least one bucket and one way')
+        self.bucket_size = self.ways * SLOT.size
+        self.size = HEADER_SIZE + self.buckets * self.bucket_size
+        self.path = parsed.path or None
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._open()
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    def _open(self):
+        if self.path:
+            self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), 'r+b')
+        else:
+            self._file = tempfile.TemporaryFile()
+        fd = self._file.fileno()
+        # one process sizes and stamps a new file, the others check it
+        fcntl.lockf(fd, fcntl.LOCK_EX, HEADER_SIZE)
+        try:
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, HEADER.pack(MAGIC, LAYOUT_VERSION, self.buckets, self.ways), 0)
+            header = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+            if header != (MAGIC, LAYOUT_VERSION, self.buckets, self.ways) \
+                    or os.fstat(fd).st_size != self.size:
+                raise ConfigurationError(
+                    '%s is not a rate limit table of %d buckets of %d slots'
+                    % (self.path, self.buckets, self.ways))
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, HEADER_SIZE)
+        self._map = mmap.mmap(fd, self.size)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def _locate(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        bucket = int.from_bytes(digest[:8], 'little') % self.buckets
+        return digest, bucket
+
+    @contextmanager
+    def _lock(self, bucket):
+        stripe = bucket % LOCK_STRIPES
+        fd = self._file.fileno()
+        with self._locks[stripe]:
+            fcntl.lockf(fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, 1, stripe)
+
+    def _find(self, digest, bucket, now):
+        '''
+        Return (offset of the live slot of `digest` or None, offset of the
+        slot to take for it). Must be called under the lock of `bucket`.
+        '''
+        mm = self._map
+        start = HEADER_SIZE + bucket * self.bucket_size
+        victim, victim_atime = None, None
+        for offset in range(start, start + self.bucket_size, SLOT.size):
+            slot_digest, atime, expires, _, _ = SLOT.unpack_from(mm, offset)
+            if slot_digest == digest:
+                if expires > now:
+                    return offset, offset
+                return None, offset
+            if slot_digest == EMPTY or expires <= now:
+                atime = -1.0
+            if victim is None or atime < victim_atime:
+                victim, victim_atime = offset, atime
+        return None, victim
+
+    def incr(self, key, expiry, amount=1):
+        '''
+        increments the counter for a given rate limit key
+
+        :param key: the key to increment
+        :param expiry: amount in seconds for the key to expire in
+        :param amount: the number to increment by
+        '''
+        digest, bucket = self._locate(key)
+        now = time.time()
+        with self._lock(bucket):
+            found, offset = self._find(digest, bucket, now)
+            if found is None:
+                count, expires = amount, now + expiry
+            else:
+                _, _, expires, count, _ = SLOT.unpack_from(self._map, found)
+                count += amount
+            SLOT.pack_into(self._map, offset, digest, now, expires, count, 0)
+        return count
+
+    def decr(self, key, amount=1):
+        digest, bucket = self._locate(key)
+        now = time.time()
+        with self._lock(bucket):
+            found, _ = self._find(digest, bucket, now)
+            if found is None:
+                return 0
+            _, _, expires, count, _ = SLOT.unpack_from(self._map, found)
+            count = max(count - amount, 0)
+            SLOT.pack_into(self._map, found, digest, now, expires, count, 0)
+        return count
+
+    def _read(self, key):
+        digest, bucket = self._locate(key)
+        with self._lock(bucket):
+            found, _ = self._find(digest, bucket, time.time())
+            if found is None:
+                return None
+            return SLOT.unpack_from(self._map, found)
+
+    def get(self, key):
+        '''
+        :param key: the key to get the counter value for
+        '''
+        slot = self._read(key)
+        return slot[3] if slot is not None else 0
+
+    def get_expiry(self, key):
+        '''
+        :param key: the key to get the expiry for
+        '''
+        slot = self._read(key)
+        return slot[2] if slot is not None else time.time()
+
+    def clear(self, key):
+        '''
+        :param key: the key to clear rate limits for
+        '''
+        digest, bucket = self._locate(key)
+        with self._lock(bucket):
+            found, _ = self._find(digest, bucket, time.time())
+            if found is not None:
+                SLOT.pack_into(self._map, found, EMPTY, 0.0, 0.0, 0, 0)
+
+    def check(self):
+        '''
+        check if storage is healthy
+        '''
+        return not self._map.closed
+
+    def reset(self):
+        '''
+        reset storage to clear limits, return the number of live keys
+        '''
+        now = time.time()
+        cleared = 0
+        for bucket in range(self.buckets):
+            start = HEADER_SIZE + bucket * self.bucket_size
+            with self._lock(bucket):
+                for offset in range(start, start + self.bucket_size, SLOT.size):
+                    digest, _, expires, _, _ = SLOT.unpack_from(self._map, offset)
+                    if digest != EMPTY and expires > now:
+                        cleared += 1
+                self._map[start:start + self.bucket_size] = bytes(self.bucket_size)
+        return cleared
+
+    # Sliding window counter: the slot of the key holds the counters of the
+    # current and previous windows of `expiry` seconds; its expiry time
+    # (end of the window after the current one) tells which window it is.
+    # The hits of the previous window are weighted by its remaining share.
+
+    def _windows(self, slot, expiry, window):
+        if slot is None:
+            return 0, 0
+        _, _, expires, current, previous = slot
+        slot_window = round(expires / expiry) - 2
+        if slot_window == window:
+            return previous, current
+        if slot_window == window - 1:
+            return current, 0
+        return 0, 0
+
+    def _window_info(self, previous, current, expiry, now):
+        previous_ttl = 0.0
+        if previous:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous, previous_ttl, current, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        digest, bucket = self._locate(key)
+        now = time.time()
+        window = int(now / expiry)
+        with self._lock(bucket):
+            found, offset = self._find(digest, bucket, now)
+            slot = SLOT.unpack_from(self._map, found) if found is not None else None
+            previous, current = self._windows(slot, expiry, window)
+            previous, previous_ttl, current, _ = self._window_info(previous, current, expiry, now)
+            if int(previous * previous_ttl / expiry + current) + amount > limit:
+                return False
+            SLOT.pack_into(self._map, offset, digest, now, (window + 2) * expiry, current + amount, previous)
+        return True
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous, current = self._windows(self._read(key), expiry, int(now / expiry))
+        return self._window_info(previous, current, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        self.clear(key)
+
+
+def check_strategy(app):
+    '''
+    Fall back to the fixed window strategy when the installed limits has no
+    sliding window counter (limits < 4.1, e.g. on Python < 3.9)
+    '''
+    if app.config.get('RATELIMIT_STRATEGY') == 'sliding-window-counter' \
+            and SlidingWindowCounterSupport is object:
+        logger.warning('limits %s has no sliding window counter: using the fixed window strategy',
+                       limits.__version__)
+        app.config['RATELIMIT_STRATEGY'] = 'fixed-window'
+
+
+def check_storage_uri(app):
+    '''
+    Warn when the rate limit counters of `app` are in an anonymous mmap
+    file: the workers of a server which does not fork them from the created
+    app (no preload) would each count apart
+    '''
+    parsed = urlparse(app.config.get('RATELIMIT_STORAGE_URI') or '')
+    if parsed.scheme == 'mmap' and not parsed.path and not app.testing:
+        logger.warning('RATELIMIT_STORAGE_URI is mmap:// without a file: the rate limits are only '
+                       'shared by the workers forked after the app was created')
@@ -0,0 +1,104 @@
+from sqlalchemy import or_
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from .. import hasher
+from ..schema.user import validate_register_user
+
+
+def _error(index, record, message):
+    username = record.get('username') if isinstance(record, dict) else None
+    return {'index': index, 'username': username, 'message': message}
+
+
+def validate_records(records):
+    '''
+    Validate the registration `records` against the user schema.
+    Return ([(index, data)] of the valid ones, [error] of the others);
+    a username or email repeated in the batch is an error.
+    '''
+    valid, errors = [], []
+    usernames, emails = set(), set()
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append(_error(index, record, 'record is not an object'))
+            continue
+        data = validate_register_user({k: v for k, v in record.items() if v is not None})
+        if not data['ok']:
+            errors.append(_error(index, record, f'Bad request parameters: {data["message"].message}'))
+            continue
+        data = data['data']
+        if data['username'] in usernames:
+            errors.append(_error(index, data, 'username is repeated in the batch'))
+        elif data['email'] in emails:
+            errors.append(_error(index, data, 'email is repeated in the batch'))
+        else:
+            usernames.add(data['username'])
+            emails.add(data['email'])
+            valid.append((index, data))
+    return valid, errors
+
+
+def _drop_existing(session, model, chunk, errors):
+    ''' Remove from `chunk` the records whose username or email is taken '''
+    usernames = [data['username'] for _, data in chunk]
+    emails = [data['email'] for _, data in chunk]
+    taken = session.query(model.username, model.email) \
+        .filter(or_(model.username.in_(usernames), model.email.in_(emails))).all()
+    taken_usernames = {username for username, _ in taken}
+    taken_emails = {email for _, email in taken}
+    remaining = []
+    for index, data in chunk:
+        if data['username'] in taken_usernames:
+            errors.append(_error(index, data, 'username already exists'))
+        elif data['email'] in taken_emails:
+            errors.append(_error(index, data, 'email already exists'))
+        else:
+            remaining.append((index, data))
+    return remaining
+
+
+def register_users(session, model, records, role_id, chunk_size=500):
+    '''
+    Create the users of the registration `records` with the role
+    `role_id`, `chunk_size` records at a time: one query for the taken
+    names, the password hashes computed in parallel and one bulk INSERT.
+    Invalid records are reported instead of aborting the batch.
+    Return (number of users created, [{'index', 'username', 'message'}]).
+    '''
+    valid, errors = validate_records(records)
+    table = model.__table__
+    created = 0
+    for start in range(0, len(valid), chunk_size):
+        chunk = _drop_existing(session, model, valid[start:start + chunk_size], errors)
+        if not chunk:
+            continue
+        hashes = hasher.generate_many(data['password'] for _, data in chunk)
+        rows = [{
+            'username': data['username'],
+            'email': data['email'],
+            'name': data.get('name'),
+            'pseudonym': data.get('pseudonym'),
+            'password_hash': password_hash,
+            'role_id': role_id,
+        } for (_, data), password_hash in zip(chunk, hashes)]
+        try:
+            session.execute(table.insert(), rows)
+            session.commit()
+            created += len(rows)
+        except DBAPIError:
+            # a name was taken since the check, or a value is refused by
+            # the database: find out which one row by row
+            session.rollback()
+            for (index, data), row in zip(chunk, rows):
+                try:
+                    session.execute(table.insert(), [row])
+                    session.commit()
+                    created += 1
+                except IntegrityError:
+                    session.rollback()
+                    errors.append(_error(index, data, 'username or email already exists'))
+                except DBAPIError:
+                    session.rollback()
+                    errors.append(_error(index, data, 'record is refused by the database'))
+    errors.sort(key=lambda error: error['index'])
+    return created, errors
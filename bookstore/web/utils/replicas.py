@@ -0,0 +1,189 @@
+import itertools
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from jwt import PyJWTError
+from sqlalchemy import event, orm, text
+
+from .cache import SimpleCacheBackend
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the queries of a read-only request (see
+    `ReplicaRouter.route_reads`) to the replica chosen for the request.
+    Flushes, and the models bound to another database, use their own bind.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('_db_replica') if has_request_context() else None
+        if replica is not None and not self._flushing:
+            info = getattr(mapper.persist_selectable, 'info', {}) if mapper is not None else {}
+            if info.get('bind_key') is None:
+                return replica
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _track_writes(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _track_statement_writes(orm_execute_state):
+    # INSERT/UPDATE/DELETE statements run by session.execute() or
+    # Query.update()/delete(), which do not flush (e.g. bulk imports)
+    state = orm_execute_state
+    if state.is_insert or state.is_update or state.is_delete:
+        state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _pin_writer(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        current_app.extensions['replicas']['router'].pin()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_writes(session):
+    session.info.pop('wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    ''' SQLAlchemy whose sessions can read from the replicas '''
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _writer_keys():
+    # the user of the JWT token, else the client address: behind a proxy
+    # every client has the same one
+    try:
+        # public views do not verify the token of their readers
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except (JWTExtendedException, PyJWTError):  # a bad token: anonymous
+        identity = None
+    if identity:
+        return ['user:%s' % identity['userid']]
+    return ['addr:%s' % request.remote_addr]
+
+
+class ReplicaRouter:
+    """Routes the queries of read-only requests to the read replicas, the
+    SQLALCHEMY_BINDS named in SQLALCHEMY_REPLICA_BINDS.
+
+    Each request takes the next replica in turn (round-robin) and keeps it.
+    A replica is checked with ``SELECT 1`` every REPLICA_HEALTH_INTERVAL
+    seconds; one failing it is skipped for REPLICA_RETRY_INTERVAL seconds.
+    Without a healthy replica, the primary serves the reads.
+
+    A client (JWT user, else address) who committed a write reads from the
+    primary for REPLICA_PIN_SECONDS, so it sees its writes despite the
+    replication lag. The pins are kept in the response cache backend, shared
+    by the workers with RESPONSE_CACHE_TYPE = 'redis', else in the process.
+    """
+
+    def __init__(self, db=None, app=None):
+        self.db = db
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_BINDS', [])
+        app.config.setdefault('REPLICA_PIN_SECONDS', 5)
+        app.config.setdefault('REPLICA_HEALTH_INTERVAL', 5)
+        app.config.setdefault('REPLICA_RETRY_INTERVAL', 30)
+        app.config.setdefault('REPLICA_PIN_THRESHOLD', 4096)
+        app.extensions['replicas'] = {
+            'router': self,
+            'lock': threading.Lock(),
+            'turns': itertools.count(),
+            # bind key: (time of the next check, healthy)
+            'health': {},
+            'pins': SimpleCacheBackend(app.config['REPLICA_PIN_THRESHOLD']),
+        }
+        # streamed responses query until the end of the request
+        app.teardown_request(lambda exc: g.pop('_db_replica', None))
+
+    @property
+    def _state(self):
+        return current_app.extensions['replicas']
+
+    def _pins(self, state):
+        backend = current_app.extensions.get('response_cache')
+        return backend if backend is not None else state['pins']
+
+    def pin(self):
+        ''' Send the reads of the client of the request to the primary for a while '''
+        state = self._state
+        seconds = current_app.config['REPLICA_PIN_SECONDS']
+        if not seconds or not current_app.config['SQLALCHEMY_REPLICA_BINDS']:
+            return
+        pins = self._pins(state)
+        for key in _writer_keys():
+            pins.set('replica-pin:' + key, True, seconds)
+
+    def is_pinned(self):
+        pins = self._pins(self._state)
+        return any(pins.get('replica-pin:' + key) for key in _writer_keys())
+
+    def _check(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            return True
+        except Exception as e:
+            logger.warning('replica %s is unavailable: %s', engine.url, e)
+            return False
+
+    def is_healthy(self, key):
+        '''
+        Return whether the replica `key` passed its last check, checking it
+        again when due. Only one thread checks it, the others use the
+        previous result meanwhile.
+        '''
+        state = self._state
+        config = current_app.config
+        now = time.monotonic()
+        with state['lock']:
+            due, healthy = state['health'].get(key, (0.0, True))
+            if due > now:
+                return healthy
+            state['health'][key] = (now + config['REPLICA_HEALTH_INTERVAL'], healthy)
+        healthy = self._check(self.db.get_engine(current_app, bind=key))
+        interval = config['REPLICA_HEALTH_INTERVAL'] if healthy else config['REPLICA_RETRY_INTERVAL']
+        with state['lock']:
+            state['health'][key] = (time.monotonic() + interval, healthy)
+        return healthy
+
+    def choose(self):
+        ''' Return the engine of the next healthy replica, or None '''
+        keys = current_app.config['SQLALCHEMY_REPLICA_BINDS']
+        if not keys:
+            return None
+        start = next(self._state['turns'])
+        for turn in range(start, start + len(keys)):
+            key = keys[turn % len(keys)]
+            if self.is_healthy(key):
+                return self.db.get_engine(current_app, bind=key)
+        return None
+
+    def route_reads(self):
+        '''
+        Send the queries of the current request to a replica, unless the
+        client has just written. Return the engine used or None (primary).
+        '''
+        replica = None
+        if current_app.config['SQLALCHEMY_REPLICA_BINDS'] and not self.is_pinned():
+            replica = self.choose()
+        g._db_replica = replica
+        return replica
@@ -1,18 +1,70 @@
-
 from ast import arg
-from flask import jsonify, Response
-from dicttoxml import dicttoxml
+from flask import Response, stream_with_context
+
+from .serializer import dumps
+from .xmlencoder import XML_HEADER, encode_dict, encode_value, iter_document, xml_name, xml_row_encoder
 
-def build_response(content_dict, content_type='json') -> Response:
+def build_response(content_dict, content_type='json', model=None, fields=None) -> Response:
     '''
-    Return response for request base on content type, which is json or xml
+    Return response for request base on content type, which is json or xml.
+    `model` and `fields` describe the rows under "data", if any: the xml
+    encoder then writes them from the model columns.
     '''
     if content_type == 'xml':
         # Convert dict to xml
-        xml = dicttoxml(content_dict)
-        return Response(response=xml, status=200, mimetype="application/xml")
+        row_encoder = xml_row_encoder(model, fields) if model is not None else None
+        xml = ''.join(iter_document(content_dict, row_encoder)).encode('utf-8')
+        response = Response(response=xml, status=200, mimetype="application/xml")
+    else:
+        response = Response(response=dumps(content_dict) + b'\n', status=200, mimetype="application/json")
+    if not content_dict.get('ok'):
+        # errors are sent with the HTTP status 200: keep caches from storing them
+        response.cache_control.no_store = True
+    return response
+
+def build_streaming_response(content_dict, rows, content_type='json', key='data', chunk_size=500,
+                             model=None, fields=None) -> Response:
+    '''
+    Return a streamed response for request base on content type.
+    `content_dict` holds the envelope, `rows` is an iterable of dicts which
+    is written out as the `key` list of the envelope while it is consumed,
+    `chunk_size` rows at a time, so the whole list is never held in memory.
+    '''
+    if content_type == 'xml':
+        name, attrs = xml_name(key)
+        head = XML_HEADER + '<root>' + encode_dict(content_dict)
+        head = (head + '<%s%s type="list">' % (name, attrs)).encode('utf-8')
+        tail = ('</%s></root>' % name).encode('utf-8')
+        if model is not None:
+            row_encoder = xml_row_encoder(model, fields)
+            encode = lambda row: ('<item type="dict">%s</item>' % row_encoder(row)).encode('utf-8')
+        else:
+            encode = lambda row: encode_value('item', row).encode('utf-8')
+        separator = b''
+        mimetype = 'application/xml'
     else:
-        return jsonify(content_dict)
+        head = dumps(content_dict)[:-1]
+        head += b'%s"%s":[' % (b',' if content_dict else b'', key.encode('utf-8'))
+        tail = b']}\n'
+        encode = dumps
+        separator = b','
+        mimetype = 'application/json'
+
+    def generate():
+        yield head
+        buffer = []
+        first = True
+        for row in rows:
+            buffer.append(encode(row))
+            if len(buffer) >= chunk_size:
+                yield (b'' if first else separator) + separator.join(buffer)
+                first = False
+                buffer = []
+        if buffer:
+            yield (b'' if first else separator) + separator.join(buffer)
+        yield tail
+
+    return Response(stream_with_context(generate()), status=200, mimetype=mimetype)
 
 def get_content_type(args) -> str:
     '''
@@ -20,4 +72,10 @@ def get_content_type(args) -> str:
     '''
     if 'contentType' in args and args['contentType'] == 'xml':
         return 'xml'
-    return 'json'
\ No newline at end of file
+    return 'json'
+
+def is_stream_requested(args) -> bool:
+    '''
+    Return True if the client asked for a streamed response (stream=true)
+    '''
+    return args.get('stream', '').lower() in ('1', 'true')
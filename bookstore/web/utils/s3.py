@@ -1,4 +1,5 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 import logging
 
@@ -65,6 +66,47 @@ class S3:
             return None
         # close stringio object
         file.close()
-        # object_url = f"https://s3.amazonaws.com/{bucket_name}/{key_name}"
-        object_url = f"http://{bucket_name}.s3.amazonaws.com/{key_name}"
-        return object_url
+        return self.public_url(bucket_name, key_name)
+
+    def upload_file_public(self, bucket_name, key_name, path, file_extension,
+                           multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024):
+        """Uploads the local file `path` to S3, streamed from disk, in parts
+        of `multipart_chunksize` bytes when larger than `multipart_threshold`.
+        Returns the URL for the object uploaded, raises on failure.
+        Note: The acl for the file is set as 'public-acl' for the file uploaded.
+        Arguments:
+            bucket_name -- name of the bucket where file needs to be uploaded.
+            key_name -- key name to be kept in S3.
+            path -- path of the file which needs to be uploaded.
+            extension -- content type that needs to be set for the S3 object.
+        """
+        config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            use_threads=False,
+        )
+        self.client.upload_file(
+            path, bucket_name, key_name,
+            ExtraArgs={
+                'ACL': 'public-read',
+                'ContentType': FILE_CONTENT_TYPES.get(file_extension, 'application/octet-stream'),
+            },
+            Config=config,
+        )
+        return self.public_url(bucket_name, key_name)
+
+    def exists(self, bucket_name, key_name):
+        """Returns True if the object `key_name` is in the bucket (HEAD request).
+        """
+        try:
+            self.client.head_object(Bucket=bucket_name, Key=key_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    @staticmethod
+    def public_url(bucket_name, key_name):
+        # return f"https://s3.amazonaws.com/{bucket_name}/{key_name}"
+        return f"http://{bucket_name}.s3.amazonaws.com/{key_name}"
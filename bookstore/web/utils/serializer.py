@@ -0,0 +1,120 @@
+import datetime
+import decimal
+import json
+from functools import lru_cache
+from operator import attrgetter
+
+from flask import current_app
+from sqlalchemy.types import Date, DateTime, Time
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used instead
+    orjson = None
+
+
+class JSONEncoder(json.JSONEncoder):
+    ''' extend json-encoder class'''
+    def default(self, o):
+        if isinstance(o, set):
+            return list(o)
+        if isinstance(o, (datetime.date, datetime.datetime, datetime.time)):
+            return str(o)
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+
+        return json.JSONEncoder.default(self, o)
+
+
+# Same conversions as JSONEncoder, dispatched on the exact type
+_DEFAULTS = {
+    set: list,
+    datetime.date: str,
+    datetime.datetime: str,
+    datetime.time: str,
+    decimal.Decimal: str,
+}
+
+
+def _default(o):
+    try:
+        return _DEFAULTS[type(o)](o)
+    except KeyError:
+        # subclasses of the supported types
+        if isinstance(o, set):
+            return list(o)
+        if isinstance(o, (datetime.date, datetime.time, decimal.Decimal)):
+            return str(o)
+        raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+def orjson_dumps(obj, sort_keys=True) -> bytes:
+    # datetimes keep the str() format of JSONEncoder instead of orjson's
+    # RFC 3339 output, so responses do not change with the serializer.
+    # Those of the model rows are already strings (see row_encoder).
+    option = orjson.OPT_PASSTHROUGH_DATETIME
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+def stdlib_dumps(obj, sort_keys=True) -> bytes:
+    return json.dumps(obj, cls=JSONEncoder, separators=(',', ':'), sort_keys=sort_keys,
+                      ensure_ascii=False).encode('utf-8')
+
+
+SERIALIZERS = {
+    'orjson': orjson_dumps,
+    'json': stdlib_dumps,
+}
+
+
+def get_serializer(name='auto'):
+    '''
+    Return the dumps function named `name` ("orjson" or "json"),
+    "auto" picks orjson when it is installed
+    '''
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_SERIALIZER = "orjson" requires the orjson package')
+    return SERIALIZERS[name]
+
+
+def dumps(obj) -> bytes:
+    '''
+    Serialize `obj` to JSON bytes with the serializer configured by
+    JSON_SERIALIZER, keys sorted as configured by JSON_SORT_KEYS
+    '''
+    config = current_app.config
+    return get_serializer(config.get('JSON_SERIALIZER', 'auto'))(obj, config.get('JSON_SORT_KEYS', True))
+
+
+@lru_cache(maxsize=None)
+def row_encoder(model, fields=None):
+    '''
+    Return a function turning an instance of `model` into a dict of its
+    `fields` (default: model.JSON_FIELDS). The attribute getter is built
+    once per model and fieldset instead of once per row.
+    '''
+    fields = tuple(fields or model.JSON_FIELDS)
+    getter = attrgetter(*fields)
+    if len(fields) == 1:
+        get_values = lambda obj: (getter(obj),)
+    else:
+        get_values = getter
+    # temporal columns are formatted here as JSONEncoder does, rather than
+    # by a default callback of the serializer for every value
+    columns = model.__table__.columns
+    temporal = [index for index, field in enumerate(fields)
+                if field in columns and isinstance(columns[field].type, (Date, DateTime, Time))]
+    if not temporal:
+        return lambda obj: dict(zip(fields, get_values(obj)))
+
+    def encode(obj):
+        values = list(get_values(obj))
+        for index in temporal:
+            if values[index] is not None:
+                values[index] = str(values[index])
+        return dict(zip(fields, values))
+    return encode
@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from .covers import Image, derivative_key, make_derivatives
+
+logger = logging.getLogger(__name__)
+
+SPOOL_CHUNK_SIZE = 64 * 1024
+# spooled cover: cover-<content hash>-<random>.<extension>
+SPOOL_PREFIX = 'cover-'
+SPOOLED_COVER = re.compile(r'cover-([0-9a-f]{64})-')
+
+
+class CoverUploader:
+    """Uploads the files of the requests (book covers) to S3 from a pool
+    of background threads, so that the request only pays for writing the
+    file to local disk.
+
+    `spool` copies the upload to a file of COVER_SPOOL_DIR, `submit` queues
+    it: the pool decodes the image once to write its COVER_DERIVATIVES
+    (resized JPEGs, when Pillow is installed) and uploads all the files
+    (multipart above COVER_MULTIPART_THRESHOLD bytes), retrying
+    COVER_UPLOAD_RETRIES times with exponential backoff. The files are keyed
+    by content hash: the ones already in the bucket (HEAD) are not uploaded
+    again, and the URLs of the covers uploaded by the process are kept in
+    an index of COVER_INDEX_SIZE entries, see `known`. It then calls back
+    with the public URLs {'original': url, derivative name: url or None},
+    or None when every try of the original failed.
+
+    With COVER_UPLOAD_WORKERS = 0 the uploads run inline in `submit`.
+
+    The uploads queued in memory are lost if the process stops: the
+    ``flask requeue-covers`` command uploads again the covers left in the
+    spool for COVER_SWEEP_MIN_AGE seconds, see `old_spool_files`.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._futures = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COVER_UPLOAD_BUCKET', 'kashyyyk-resources')
+        app.config.setdefault('COVER_UPLOAD_WORKERS', 0)
+        app.config.setdefault('COVER_UPLOAD_RETRIES', 3)
+        app.config.setdefault('COVER_UPLOAD_RETRY_DELAY', 0.5)
+        app.config.setdefault('COVER_SPOOL_DIR', None)
+        app.config.setdefault('COVER_MULTIPART_THRESHOLD', 8 * 1024 * 1024)
+        app.config.setdefault('COVER_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024)
+        app.config.setdefault('COVER_DERIVATIVES', {})
+        app.config.setdefault('COVER_DERIVATIVE_QUALITY', 85)
+        app.config.setdefault('COVER_INDEX_SIZE', 10000)
+        app.config.setdefault('COVER_SWEEP_MIN_AGE', 600)
+        app.extensions['cover_uploader'] = {
+            'lock': threading.Lock(),
+            'entries': OrderedDict(),
+            'size': app.config['COVER_INDEX_SIZE'],
+        }
+
+    def _get_pool(self, workers):
+        # threads do not survive fork(): one pool per process
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cover-upload')
+                self._pool_pid = os.getpid()
+                self._futures = set()
+            return self._pool
+
+    def spool(self, file, extension):
+        '''
+        Copy the uploaded `file` (a FileStorage) to local disk, hashing it
+        on the way. Return (path, hex SHA-256 of the content).
+        '''
+        spool_dir = current_app.config['COVER_SPOOL_DIR']
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix='.' + extension, prefix='cover-', dir=spool_dir)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(SPOOL_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        finally:
+            file.close()
+        # the content hash in the name finds the file again after a restart
+        directory, name = os.path.split(path)
+        digest = digest.hexdigest()
+        spooled = os.path.join(directory, '%s%s-%s' % (SPOOL_PREFIX, digest, name[len(SPOOL_PREFIX):]))
+        os.rename(path, spooled)
+        return spooled, digest
+
+    def old_spool_files(self, min_age):
+        '''
+        Return [(path, content hash)] of the files left in the spool for
+        `min_age` seconds at least: the covers of uploads lost when a
+        process stopped, and their derivatives (content hash None).
+        '''
+        directory = current_app.config['COVER_SPOOL_DIR'] or tempfile.gettempdir()
+        if not os.path.isdir(directory):
+            return []
+        cutoff = time.time() - min_age
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(SPOOL_PREFIX) and entry.is_file() \
+                        and entry.stat().st_mtime <= cutoff:
+                    match = SPOOLED_COVER.match(entry.name)
+                    files.append((entry.path, match.group(1) if match else None))
+        return files
+
+    @property
+    def _index(self):
+        return current_app.extensions['cover_uploader']
+
+    def known(self, key):
+        ''' Return the URLs of the cover `key` if it was uploaded, else None '''
+        index = self._index
+        with index['lock']:
+            urls = index['entries'].get(key)
+            if urls is not None:
+                index['entries'].move_to_end(key)
+            return urls
+
+    def _remember(self, index, key, urls):
+        with index['lock']:
+            index['entries'][key] = urls
+            index['entries'].move_to_end(key)
+            while len(index['entries']) > index['size']:
+                index['entries'].popitem(last=False)
+
+    def submit(self, make_s3, path, key, extension, callback):
+        '''
+        Queue the upload of the spooled file `path` to `key`. In the app
+        context of the upload, `make_s3()` returns the S3 helper to use and
+        `callback(urls)` is called once done; the spooled file is removed.
+        '''
+        app = current_app._get_current_object()
+        workers = app.config['COVER_UPLOAD_WORKERS']
+        index = self._index
+        if not workers:
+            self._upload(app.config, index, make_s3, path, key, extension, callback)
+            return None
+        future = self._get_pool(workers).submit(
+            self._run, app, index, make_s3, path, key, extension, callback)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _run(self, app, *args):
+        with app.app_context():
+            return self._upload(app.config, *args)
+
+    def _upload_file(self, config, s3, key, path, extension):
+        for attempt in range(config['COVER_UPLOAD_RETRIES'] + 1):
+            if attempt:
+                time.sleep(config['COVER_UPLOAD_RETRY_DELAY'] * 2 ** (attempt - 1))
+            try:
+                return s3.upload_file_public(
+                    config['COVER_UPLOAD_BUCKET'], key, path, extension,
+                    config['COVER_MULTIPART_THRESHOLD'], config['COVER_MULTIPART_CHUNKSIZE'])
+            except Exception as e:
+                logger.warning('upload of %s failed (try %d): %s', key, attempt + 1, e)
+        return None
+
+    def _exists(self, s3, bucket, key):
+        try:
+            return s3.exists(bucket, key)
+        except Exception as e:
+            # upload it again rather than fail
+            logger.warning('HEAD of %s failed: %s', key, e)
+            return False
+
+    def _upload(self, config, index, make_s3, path, key, extension, callback):
+        bucket = config['COVER_UPLOAD_BUCKET']
+        names = list(config['COVER_DERIVATIVES']) if Image is not None else []
+        urls = None
+        derivatives = {}
+        try:
+            s3 = make_s3()
+            # the keys are content hashes: an existing object is the same file
+            if self._exists(s3, bucket, key):
+                urls = {'original': s3.public_url(bucket, key)}
+                for name in names:
+                    if self._exists(s3, bucket, derivative_key(key, name)):
+                        urls[name] = s3.public_url(bucket, derivative_key(key, name))
+                missing = [name for name in names if name not in urls]
+            else:
+                missing = names
+            if missing:
+                try:
+                    derivatives = make_derivatives(
+                        path, {name: config['COVER_DERIVATIVES'][name] for name in missing},
+                        config['COVER_DERIVATIVE_QUALITY'], config['COVER_SPOOL_DIR'])
+                except Exception as e:
+                    logger.warning('no derivatives of %s: %s', key, e)
+            if urls is None:
+                url = self._upload_file(config, s3, key, path, extension)
+                if url is not None:
+                    urls = {'original': url}
+            if urls is not None:
+                for name, derivative_path in derivatives.items():
+                    urls[name] = self._upload_file(
+                        config, s3, derivative_key(key, name), derivative_path, 'jpg')
+                # a failed derivative upload is retried by the next upload
+                if all(urls.values()):
+                    self._remember(index, key, urls)
+        except Exception:
+            logger.exception('upload of %s failed', key)
+            urls = None
+        finally:
+            os.remove(path)
+            for derivative_path in derivatives.values():
+                os.remove(derivative_path)
+        try:
+            callback(urls)
+        except Exception:
+            logger.exception('callback of the upload of %s failed', key)
+        return urls
+
+    def wait(self, timeout=None):
+        ''' Wait for the queued uploads, return True if none is left '''
+        with self._lock:
+            futures = set(self._futures)
+        done, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=True)
+            self._pool = None
@@ -0,0 +1,161 @@
+import datetime
+import decimal
+from functools import lru_cache
+from xml.dom.minidom import parseString
+
+from sqlalchemy.types import Boolean, Date, DateTime, Float, Integer, Numeric, Time
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" ?>'
+
+# The encoder writes the same document as dicttoxml(content, attr_type=True):
+# every element carries a type attribute and list items are <item> elements.
+
+
+def escape(s):
+    return s.replace('&', '&amp;').replace('"', '&quot;').replace('\'', '&apos;') \
+        .replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _is_valid_name(name):
+    # the test of dicttoxml: parse an element of that name
+    try:
+        parseString('%s<%s>foo</%s>' % (XML_HEADER, name, name))
+        return True
+    except Exception:  # minidom raises several exception types
+        return False
+
+
+@lru_cache(maxsize=1024)
+def xml_name(key):
+    '''
+    Return (tag name, attributes) of the element of a dict `key`, fixed as
+    dicttoxml does when it is not a valid XML name: 'n' prepended to a
+    number, spaces replaced with underscores, else <key name="...">.
+    '''
+    name = escape(str(key))
+    if _is_valid_name(name):
+        return name, ''
+    if name.isdigit():
+        return 'n' + name, ''
+    if _is_valid_name(name.replace(' ', '_')):
+        return name.replace(' ', '_'), ''
+    return 'key', ' name="%s"' % name
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _row_isoformat(value):
+    # row_encoder formats the temporal columns with str(), which separates
+    # the date and the time with a space
+    return value.replace(' ', 'T', 1)
+
+
+def _bool(value):
+    return 'true' if value else 'false'
+
+
+# (type attribute, formatter) of the scalar values, dispatched on the exact type
+_SCALARS = {
+    str: ('str', escape),
+    int: ('int', str),
+    bool: ('bool', _bool),
+    float: ('float', str),
+    decimal.Decimal: ('number', str),
+    datetime.datetime: ('str', _isoformat),
+    datetime.date: ('str', _isoformat),
+    datetime.time: ('str', _isoformat),
+}
+
+
+def encode_value(key, value):
+    ''' Return the <key> element of any value of a response envelope '''
+    name, attrs = xml_name(key)
+    if value is None:
+        return '<%s%s type="null"></%s>' % (name, attrs, name)
+    scalar = _SCALARS.get(type(value))
+    if scalar is not None:
+        type_name, fmt = scalar
+        return '<%s%s type="%s">%s</%s>' % (name, attrs, type_name, fmt(value), name)
+    if isinstance(value, dict):
+        return '<%s%s type="dict">%s</%s>' % (name, attrs, encode_dict(value), name)
+    if isinstance(value, (list, tuple, set)):
+        return '<%s%s type="list">%s</%s>' % (
+            name, attrs, ''.join(encode_value('item', v) for v in value), name)
+    raise TypeError('Unsupported data type: %s (%s)' % (value, type(value).__name__))
+
+
+def encode_dict(content):
+    ''' Return the elements of the items of a dict '''
+    return ''.join(encode_value(key, value) for key, value in content.items())
+
+
+def _column_format(column_type):
+    if isinstance(column_type, Boolean):
+        return 'bool', _bool
+    if isinstance(column_type, Integer):
+        return 'int', str
+    if isinstance(column_type, Float):
+        return 'float', str
+    if isinstance(column_type, Numeric):
+        return 'number', str
+    if isinstance(column_type, (DateTime, Date, Time)):
+        return 'str', _row_isoformat
+    return 'str', escape
+
+
+@lru_cache(maxsize=None)
+def xml_row_encoder(model, fields=None):
+    '''
+    Return a function writing the elements of a row dict of `model` (as
+    built by its to_json). Tag names and value formatters come from the
+    column types, once per model and fieldset.
+    '''
+    fields = tuple(fields or model.JSON_FIELDS)
+    columns = model.__table__.columns
+    parts = []
+    for field in fields:
+        type_name, fmt = _column_format(columns[field].type)
+        name, attrs = xml_name(field)
+        parts.append((
+            field,
+            '<%s%s type="%s">' % (name, attrs, type_name),
+            '</%s>' % name,
+            '<%s%s type="null"></%s>' % (name, attrs, name),
+            fmt,
+        ))
+
+    def encode(row):
+        out = []
+        for field, start, end, null, fmt in parts:
+            value = row[field]
+            if value is None:
+                out.append(null)
+            else:
+                out.append(start + fmt(value) + end)
+        return ''.join(out)
+    return encode
+
+
+def iter_document(content_dict, row_encoder=None, rows_key='data'):
+    '''
+    Yield the XML document of a response envelope piece by piece.
+    When `row_encoder` is given, the rows under `rows_key` (a list of row
+    dicts, or a single one) are written with it.
+    '''
+    yield XML_HEADER + '<root>'
+    for key, value in content_dict.items():
+        if key == rows_key and row_encoder is not None and value is not None:
+            name, attrs = xml_name(key)
+            if isinstance(value, dict):
+                # a single row: same elements, as a dict
+                yield '<%s%s type="dict">%s</%s>' % (name, attrs, row_encoder(value), name)
+                continue
+            yield '<%s%s type="list">' % (name, attrs)
+            for row in value:
+                yield '<item type="dict">%s</item>' % row_encoder(row)
+            yield '</%s>' % name
+        else:
+            yield encode_value(key, value)
+    yield '</root>'
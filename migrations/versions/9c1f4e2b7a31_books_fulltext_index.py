@@ -0,0 +1,24 @@
+"""books fulltext index
+
+Revision ID: 9c1f4e2b7a31
+Revises: 64e6a90ba4fb
+Create Date: 2026-10-18 10:12:40.512871
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c1f4e2b7a31'
+down_revision = '64e6a90ba4fb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FULLTEXT index used by GET /books?search=
+    op.create_index('ix_books_fulltext', 'books', ['title', 'description'], unique=False, mysql_prefix='FULLTEXT')
+
+
+def downgrade():
+    op.drop_index('ix_books_fulltext', table_name='books')